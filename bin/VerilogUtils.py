@@ -1,5 +1,12 @@
+import ast
+import hashlib
+import json
+import os
+import re
 from enum import Enum
 
+import util
+
 
 def is_number(q):
     # noinspection PyBroadException
@@ -48,11 +55,13 @@ class Wire:
         else:
             op2 = operand.name
 
-        g.write(f"assign {op1} = {op2};\n")
+        if operand.width != self.width:
+            g.note_width_change(op1, self.width, operand.name, operand.width)
+        g.assign(op1, op2)
         self.occupancy += 1
 
     def assign_array(self, g, op):
-        g.write(f"assign {self.name} = {op.name};\n")
+        g.assign(self.name, op.name)
 
     def get_array_subwire(self, i):
         if self.ar_width > 1:
@@ -67,17 +76,11 @@ class Wire:
         return 'sh_cl' in self.name or 'cl_sh' in self.name
 
     def tie_off(self, g, special_val="0"):
-        g.write(f"assign {self.name} = ")
         tieoff = "0"
         if special_val == '1':
             tieoff = '1' * self.width
-        if self.ar_width == 1:
-            g.write(f"{self.width}'b{tieoff};\n")
-        else:
-            g.write("'{")
-            for i in range(self.ar_width):
-                g.write(f"{self.width}'b{tieoff}, ")
-            g.write("};\n")
+        g.tie_off(self.name, f"{self.width}'b{tieoff}", self.ar_width)
+        self.occupancy = self.ar_width
 
     def __and__(self, other):
         assert other.ar_width == 1 and self.ar_width == 1
@@ -96,6 +99,7 @@ class VerilogPort(Wire):
         self.input = io_type == 'input'
         self.output = io_type == 'output'
         self.inout = io_type == 'inout'
+        self.io_type = io_type
         self.logic = is_logic
         assert self.input or self.output or self.inout
 
@@ -132,6 +136,70 @@ class VerilogPort(Wire):
         super().assign(g, Wire(val_str, self.width, self.ar_width))
 
 
+def port_class_of(name: str):
+    if name[:len(InterfacePrefixes.slave)] == InterfacePrefixes.slave:
+        return PortClass.Slave
+    elif name[:len(InterfacePrefixes.master)] == InterfacePrefixes.master:
+        return PortClass.Master
+    elif name[:len(InterfacePrefixes.DMA)] == InterfacePrefixes.DMA:
+        return PortClass.DMA
+    return None
+
+
+class PortTable:
+    """
+    Scraped ports with hash indexes so that the shell generator never has to scan the whole port list. Iterating
+    over the table yields the ports in their declaration order.
+    """
+    __slots__ = ('ports', 'by_name', 'by_class', 'by_group', 'by_part', 'by_prefix', 'by_suffix', 'found')
+
+    def __init__(self, ports):
+        self.ports = list(ports)
+        self.by_name = {}
+        self.by_class = {}
+        self.by_group = {}
+        self.by_part = {}
+        self.by_prefix = {}
+        # every '_'-separated tail of every name, e.g. 'ddr_is_ready', 'is_ready' and 'ready' for sh_cl_ddr_is_ready
+        self.by_suffix = {}
+        # memoized results of find()
+        self.found = {}
+        for p in self.ports:
+            self.by_name[p.name] = p
+            self.by_class.setdefault(port_class_of(p.name), []).append(p)
+            self.by_group.setdefault(p.get_group_name(), []).append(p)
+            self.by_part.setdefault(p.get_axi_part_name(), []).append(p)
+            self.by_prefix.setdefault(p.name.split('_')[0], []).append(p)
+            idx = p.name.find('_')
+            while idx != -1:
+                self.by_suffix.setdefault(p.name[idx + 1:], []).append(p)
+                idx = p.name.find('_', idx + 1)
+
+    def __iter__(self):
+        return iter(self.ports)
+
+    def __len__(self):
+        return len(self.ports)
+
+    def __getitem__(self, item):
+        return self.ports[item]
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def of_class(self, pc: PortClass):
+        return self.by_class.get(pc, [])
+
+    def find(self, part, prefix):
+        # Ports whose name contains `prefix` and ends with `_<part>`
+        key = (part, prefix)
+        matches = self.found.get(key)
+        if matches is None:
+            matches = [p for p in self.by_suffix.get(part, []) if prefix in p.name]
+            self.found[key] = matches
+        return matches
+
+
 class Reg(Wire):
     def assign(self, g, operand: Wire):
         assert self.occupancy < self.ar_width
@@ -146,130 +214,515 @@ class Reg(Wire):
             op2 = f"{operand.name}[{self.width - 1}:0]"
         else:
             op2 = operand.name
-        g.write(f"always_ff @(posedge clk)\n"
-                f"begin\n"
-                f"\t{op1} <= {op2};\n"
-                f"end\n")
+        if operand.width != self.width:
+            g.note_width_change(op1, self.width, operand.name, operand.width)
+        g.assign_reg(op1, op2)
         self.occupancy += 1
 
 
-def extract(s, p):
-    assert p in s
-    idx = s.find(p)
-    return s[:idx] + s[idx + len(p):]
-
+_element_ref = re.compile(r"^(\w+)\[(\d+)\]$")
+_simple_operand = re.compile(r"^(\w+(\[\d+\])?|\d*'[bBdDhH][0-9a-fA-F_]+|`\w+)$")
+
+
+class Netlist:
+    """
+    In-memory body of a generated module. Declarations, continuous assigns, register updates and tie-offs are
+    collected as they are made and only turned into text by render(). Rendering merges complete sets of per-element
+    assigns into single array/vector assigns, puts every register update into one always_ff block and writes array
+    tie-offs as '{default:...}.
+    """
+
+    def __init__(self, clock="clk"):
+        self.clock = clock
+        # (kind, name, width, ar_width)
+        self.decls = []
+        self.shapes = {}
+        # (lhs, rhs) in the order they were made
+        self.assigns = []
+        self.reg_assigns = []
+        # verbatim text (instances, comments), emitted after the logic above
+        self.body = []
+        # (module, name, [(port, signal, io_type)]) for connectivity checks
+        self.instances = []
+        # (lhs, lhs_width, operand, operand_width) for every assign that truncated or zero-extended
+        self.width_changes = []
+        # helper module definitions this netlist instantiates, name -> text
+        self.modules = {}
+        # XDC lines for the generated logic
+        self.constraints = []
+        # signals driven from verbatim body text, for connectivity checks
+        self.driven = set()
+        # synthesis attributes per declared signal
+        self.attrs = {}
+        # facts about the generated logic that other build steps need (e.g. the DDR address map)
+        self.metadata = {}
+
+    def write(self, text, drives=()):
+        self.body.append(text)
+        self.driven.update(drives)
+
+    def note_width_change(self, lhs, lhs_width, operand, operand_width):
+        self.width_changes.append((lhs, lhs_width, operand, operand_width))
+
+    def require_module(self, name, text):
+        self.modules.setdefault(name, text)
+
+    def render_modules(self):
+        return "".join(self.modules.values())
+
+    def instance(self, module, name, conns, params=""):
+        # conns are (port, signal, io_type) where io_type is the direction of the port on the instantiated module
+        # (None if unknown)
+        self.instances.append((module, name, conns))
+        header = f"{module} {params}\n\t{name}(\n" if params else f"{module} {name}(\n"
+        self.write(header + ",\n".join(f"\t.{port}({sig})" for port, sig, _ in conns) + "\n);\n")
+
+    def declare(self, kind, name, width, ar_width, attrs=""):
+        assert name not in self.shapes, f"{name} declared twice"
+        self.decls.append((kind, name, width, ar_width))
+        self.shapes[name] = (width, ar_width)
+        if attrs:
+            self.attrs[name] = attrs
+
+    def assign(self, lhs, rhs):
+        self.assigns.append((lhs, rhs))
+
+    def assign_reg(self, lhs, rhs):
+        self.reg_assigns.append((lhs, rhs))
+
+    def tie_off(self, name, value, ar_width=1):
+        if ar_width == 1:
+            self.assign(name, value)
+        else:
+            self.assign(name, "'{default:" + value + "}")
+
+    def element_count(self, name):
+        # number of elements that name[i] can address: array entries, or bits for a plain vector
+        width, ar_width = self.shapes[name]
+        return ar_width if ar_width > 1 else width
+
+    def merged_assigns(self):
+        # Group `X[i] = ...` assigns by X. Groups that drive every element of X exactly once with simple operands
+        # become a single assign. Everything else is left alone and keeps its original order.
+        groups = {}
+        for idx, (lhs, rhs) in enumerate(self.assigns):
+            m = _element_ref.match(lhs)
+            if m is None or m.group(1) not in self.shapes:
+                continue
+            groups.setdefault(m.group(1), {})[int(m.group(2))] = (idx, rhs)
+
+        merged = {}
+        consumed = set()
+        for base, elems in groups.items():
+            n = self.element_count(base)
+            if len(elems) != n or sorted(elems.keys()) != list(range(n)):
+                continue
+            if len(set(idx for idx, _ in elems.values())) != n or \
+                    sum(1 for lhs, _ in self.assigns if lhs == base or lhs.startswith(base + '[')) != n:
+                continue
+            rhss = [elems[i][1] for i in range(n)]
+            refs = [_element_ref.match(r) for r in rhss]
+            whole = None
+            if all(refs) and len(set(r.group(1) for r in refs)) == 1 and \
+                    all(int(r.group(2)) == i for i, r in enumerate(refs)) and \
+                    self.shapes.get(refs[0].group(1)) == self.shapes[base]:
+                whole = refs[0].group(1)
+            elif self.shapes[base][1] > 1:
+                # unpacked [n-1:0] array: the left-most pattern entry is the highest index
+                whole = "'{" + ", ".join(reversed(rhss)) + "}"
+            elif all(_simple_operand.match(r) for r in rhss):
+                # vector concatenation needs self-determined widths
+                whole = "{" + ", ".join(reversed(rhss)) + "}"
+            else:
+                continue
+            first = min(idx for idx, _ in elems.values())
+            merged[first] = (base, whole)
+            consumed.update(idx for idx, _ in elems.values())
+
+        result = []
+        for idx, a in enumerate(self.assigns):
+            if idx in merged:
+                result.append(merged[idx])
+            elif idx not in consumed:
+                result.append(a)
+        return result
+
+    def render(self):
+        out = []
+        for kind, name, width, ar_width in self.decls:
+            packed = f"[{width - 1}:0] " if width > 1 else ""
+            unpacked = f"[{ar_width - 1}:0]" if ar_width > 1 else ""
+            attrs = f"(* {self.attrs[name]} *) " if name in self.attrs else ""
+            out.append(f"{attrs}{kind} {packed}{name}{unpacked};\n")
+        for lhs, rhs in self.merged_assigns():
+            out.append(f"assign {lhs} = {rhs};\n")
+        if len(self.reg_assigns) > 0:
+            out.append(f"always_ff @(posedge {self.clock})\nbegin\n")
+            for lhs, rhs in self.reg_assigns:
+                out.append(f"\t{lhs} <= {rhs};\n")
+            out.append("end\n")
+        out.extend(self.body)
+        return "".join(out)
+
+    def flush(self, f):
+        f.write(self.render())
+
+
+class ExprDag:
+    """
+    Hash-consed expression graph for shell glue logic. Structurally identical subexpressions share a node, reductions
+    are built as balanced trees and materialize() emits each node once as a named wire. With pipeline_every > 0 a
+    register stage is inserted every that many tree levels, and shallower branches are delayed to match.
+    """
+    commutative = {'&', '|', '^'}
+
+    def __init__(self, prefix="beethoven_expr"):
+        self.prefix = prefix
+        # ('leaf', wire) or (op, a, b)
+        self.nodes = []
+        self.index = {}
+        self.heights = []
+        self.emitted = {}
+
+    def _intern(self, key, height):
+        node = self.index.get(key)
+        if node is None:
+            node = len(self.nodes)
+            self.nodes.append(key)
+            self.index[key] = node
+            self.heights.append(height)
+        return node
+
+    def leaf(self, wire: Wire):
+        assert wire.ar_width == 1
+        return self._intern(('leaf', wire.name, wire.width), 0)
+
+    def op(self, op, a, b):
+        if op in self.commutative:
+            if a == b and op != '^':
+                return a
+            a, b = min(a, b), max(a, b)
+        assert self.width(a) == self.width(b)
+        return self._intern((op, a, b), 1 + max(self.heights[a], self.heights[b]))
+
+    def reduce(self, op, nodes):
+        # log-depth reduction, pairing neighbours level by level
+        nodes = list(nodes)
+        assert len(nodes) > 0
+        while len(nodes) > 1:
+            paired = [self.op(op, nodes[i], nodes[i + 1]) for i in range(0, len(nodes) - 1, 2)]
+            if len(nodes) % 2 == 1:
+                paired.append(nodes[-1])
+            nodes = paired
+        return nodes[0]
+
+    def width(self, node):
+        key = self.nodes[node]
+        if key[0] == 'leaf':
+            return key[2]
+        return self.width(key[1])
+
+    def depth(self, node):
+        return self.heights[node]
+
+    def _delay(self, g, wire, stages, node, have):
+        # register `wire` until it has been through `stages` stages
+        while have < stages:
+            have += 1
+            key = (node, have)
+            if key not in self.emitted:
+                reg = Reg(f"{self.prefix}_{node}_d{have}", wire.width, 1)
+                g.declare('logic', reg.name, reg.width, 1)
+                reg.assign(g, wire)
+                self.emitted[key] = reg
+            wire = self.emitted[key]
+        return wire
+
+    def materialize(self, g, node, pipeline_every=0):
+        """
+        Emit `node` into netlist `g` and return (wire, stages) where stages is the number of register stages
+        between the leaves and the wire.
+        """
+        key = self.nodes[node]
+        if key[0] == 'leaf':
+            return Wire(key[1], key[2], 1), 0
+        done = self.emitted.get(node)
+        if done is not None:
+            return done
+        op, a, b = key
+        wa, sa = self.materialize(g, a, pipeline_every)
+        wb, sb = self.materialize(g, b, pipeline_every)
+        stages = max(sa, sb)
+        wa = self._delay(g, wa, stages, a, sa)
+        wb = self._delay(g, wb, stages, b, sb)
+        comb = declare_netlist_wire(g, f"{self.prefix}_{node}", wa.width)
+        g.assign(comb.name, f"{wa.name} {op} {wb.name}")
+        result = (comb, stages)
+        if pipeline_every > 0 and self.heights[node] % pipeline_every == 0:
+            result = (self._delay(g, comb, stages + 1, node, stages), stages + 1)
+        self.emitted[node] = result
+        return result
+
+
+def declare_netlist_wire(g, name, width, ar_width=1):
+    g.declare('wire', name, width, ar_width)
+    return Wire(name, width, ar_width)
+
+
+# Bump whenever the parser output changes so that stale cache entries are ignored
+PORT_PARSER_VERSION = 1
+port_cache_dir = util.beethoven_cache + "/ports"
+
+_port_tokens = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<attr>\(\*.*?\*\))
+  | (?P<skipline>`(?:define|undef|include|timescale|default_nettype|resetall)\b[^\n]*)
+  | (?P<cond>`(?:ifdef|ifndef|elsif)\s+\w+|`else\b|`endif\b)
+  | (?P<macro>`\w+)
+  | (?P<ident>[A-Za-z_][\w$]*)
+  | (?P<number>\d*'[sS]?[bBoOdDhH][0-9a-fA-FxXzZ_?]+|\d[\d_]*)
+  | (?P<end>\)\s*;)
+  | (?P<op><<|>>|[-+*/%()\[\]:,=#{}])
+  | (?P<other>.)
+""", re.S | re.X)
+
+_directions = {'input', 'output', 'inout'}
+_type_keywords = {'wire', 'logic', 'reg', 'var', 'tri', 'bit', 'signed', 'unsigned', 'integer', 'int'}
+_const_ops = {ast.Add: lambda a, b: a + b, ast.Sub: lambda a, b: a - b, ast.Mult: lambda a, b: a * b,
+              ast.FloorDiv: lambda a, b: a // b, ast.Div: lambda a, b: a // b, ast.Mod: lambda a, b: a % b,
+              ast.LShift: lambda a, b: a << b, ast.RShift: lambda a, b: a >> b}
+
+
+def _eval_const(toks, params):
+    # Evaluate a constant expression from the port list (e.g. `NUM_DDR-1`). Returns None when something in the
+    # expression can't be resolved so that the caller can fall back.
+    words = []
+    for kind, text in toks:
+        if kind == 'number':
+            if "'" in text:
+                base = {'b': 2, 'o': 8, 'd': 10, 'h': 16}[text[text.find("'") + 1:].lstrip('sS')[0].lower()]
+                digits = text[text.find("'") + 1:].lstrip('sS')[1:].replace('_', '')
+                try:
+                    text = str(int(digits, base))
+                except ValueError:
+                    return None
+            words.append(text.replace('_', ''))
+        elif kind in ('ident', 'macro'):
+            val = params.get(text.lstrip('`'))
+            if val is None:
+                return None
+            words.append(str(val))
+        else:
+            words.append(text)
+
+    def walk(node):
+        if isinstance(node, ast.Expression):
+            return walk(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            v = walk(node.operand)
+            return -v if isinstance(node.op, ast.USub) else v
+        if isinstance(node, ast.BinOp) and type(node.op) in _const_ops:
+            return _const_ops[type(node.op)](walk(node.left), walk(node.right))
+        raise ValueError
 
-def scrape_ports_from_lines(lns):
-    ports = []
-    lns_fresh = map(lambda x: x.strip().replace(',', '').replace('wire', ''), lns)
-    lns_filt = []
-    filter_stack = []
-
-    def can_consume():
-        return '/*' not in filter_stack and '`ifdef' not in filter_stack
-
-    for ln in lns_fresh:
-        found_comment = False
-        if '/*' in ln:
-            filter_stack.append('/*')
-            ln = ln[ln.find('/*')+2:]
-            found_comment = True
-        if '*/' in ln:
-            assert filter_stack[-1] == '/*'
-            filter_stack = filter_stack[:-1]
-            found_comment = False
-        if found_comment:
-            continue
-        if '`ifdef' in ln:
-            filter_stack.append('`ifdef')
+    try:
+        return walk(ast.parse(' '.join(words), mode='eval'))
+    except (SyntaxError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _dim_size(toks, params):
+    # [msb:lsb] gives |msb - lsb| + 1, C-style [N] gives N. Unresolvable dimensions are treated as 1
+    depth = 0
+    for i, (kind, text) in enumerate(toks):
+        if text in '([{':
+            depth += 1
+        elif text in ')]}':
+            depth -= 1
+        elif text == ':' and depth == 0:
+            msb = _eval_const(toks[:i], params)
+            lsb = _eval_const(toks[i + 1:], params)
+            if msb is None or lsb is None:
+                return 1
+            return abs(msb - lsb) + 1
+    n = _eval_const(toks, params)
+    return 1 if n is None or n < 1 else n
+
+
+def _tokenize_ports(text, defines):
+    # Single pass over the text. Preprocessor conditionals are resolved here so that the parser only ever sees the
+    # tokens that are actually active, and everything after the closing `);` is never looked at.
+    defines = set(defines)
+    # each entry is [parent_active, branch_taken, active]
+    cond_stack = []
+    active = True
+    for m in _port_tokens.finditer(text):
+        kind = m.lastgroup
+        tok = m.group(kind)
+        if kind in ('ws', 'comment', 'attr'):
             continue
-        if '`ifndef' in ln:
-            filter_stack.append('`ifndef')
+        if kind == 'cond':
+            spl = tok.split()
+            directive = spl[0]
+            if directive in ('`ifdef', '`ifndef'):
+                taken = (spl[1] in defines) == (directive == '`ifdef')
+                cond_stack.append([active, active and taken, active and taken])
+            elif not cond_stack:
+                raise Exception(f"Unbalanced {directive} in port list")
+            elif directive == '`elsif':
+                entry = cond_stack[-1]
+                entry[2] = entry[0] and not entry[1] and spl[1] in defines
+                entry[1] = entry[1] or entry[2]
+            elif directive == '`else':
+                entry = cond_stack[-1]
+                entry[2] = entry[0] and not entry[1]
+                entry[1] = True
+            else:
+                cond_stack.pop()
+            active = cond_stack[-1][2] if cond_stack else True
             continue
-        if '`endif' in ln:
-            assert filter_stack[-1] == '`ifndef' or filter_stack[-1] == '`ifdef'
-            filter_stack = filter_stack[:-1]
+        if not active:
             continue
-        if '`define' in ln:
+        if kind == 'skipline':
+            spl = tok.split(None, 2)
+            if spl[0] == '`define' and len(spl) > 1:
+                defines.add(spl[1])
+            elif spl[0] == '`undef' and len(spl) > 1:
+                defines.discard(spl[1])
             continue
-        if not can_consume():
+        if kind == 'end':
+            return
+        yield kind, tok
+
+
+def scrape_ports_from_lines(lns, defines=(), params=None):
+    """
+    Parse an ANSI-style port list into VerilogPorts. Parsing stops at the first `);`. `defines` are the macros that
+    are considered set for `ifdef/`ifndef and `params` provides values for parameters used in port dimensions
+    (parameters declared in the parsed header are picked up automatically).
+    """
+    params = dict(params or {})
+    ports = []
+    tokens = list(_tokenize_ports(''.join(lns), defines))
+    n = len(tokens)
+
+    def take_brackets(i, opening, closing):
+        # tokens[i] is the opening bracket. Returns the enclosed tokens and the index after the closing bracket
+        depth = 0
+        for j in range(i, n):
+            if tokens[j][1] == opening:
+                depth += 1
+            elif tokens[j][1] == closing:
+                depth -= 1
+                if depth == 0:
+                    return tokens[i + 1:j], j + 1
+        raise Exception(f"Unterminated '{opening}' in port list")
+
+    io_ty = None
+    is_logic = False
+    packed = 1
+    name = None
+    unpacked = 1
+    i = 0
+
+    def finish_port():
+        if name is None:
+            return
+        if 'rst_' in name or 'reset' in name or 'clk' in name or 'clock' in name:
+            return
+        ports.append(VerilogPort(name, packed, unpacked, io_ty, is_logic))
+
+    while i < n:
+        kind, tok = tokens[i]
+        if kind == 'ident' and tok in ('parameter', 'localparam'):
+            # parameter [type] [dims] NAME = expr
+            i += 1
+            while i < n and (tokens[i][1] in _type_keywords or tokens[i][1] == '['):
+                i = take_brackets(i, '[', ']')[1] if tokens[i][1] == '[' else i + 1
+            if i >= n:
+                break
+            pname = tokens[i][1]
+            expr = []
+            i += 1
+            if i < n and tokens[i][1] == '=':
+                i += 1
+                depth = 0
+                while i < n:
+                    t = tokens[i][1]
+                    if depth == 0 and t in (',', ')'):
+                        break
+                    if t in '([{':
+                        depth += 1
+                    elif t in ')]}':
+                        depth -= 1
+                    expr.append(tokens[i])
+                    i += 1
+            val = _eval_const(expr, params)
+            if val is not None:
+                params.setdefault(pname, val)
             continue
-        if ");" in ln:
-            break
-        lns_filt.append(ln)
-        pass
-
-    for ln in lns_filt:
-        if 'NUM_GTY' in ln:
-            raise Exception("AHH")
-        # remove everything after comments
-        if '//' in ln:
-            ln = ln[:ln.find('//')].strip()
-        if '(*' in ln:
-            ln = ln[:ln.find('(*')].strip() + ln[ln.find('*)')+2:].strip()
-        # if it's empty, remove now
-        if ln == '':
+        if kind == 'ident' and tok in _directions:
+            finish_port()
+            io_ty, is_logic, packed, name, unpacked = tok, False, 1, None, 1
+        elif io_ty is None:
+            # Anything before the first port declaration (module name, parameter list, etc.)
+            pass
+        elif kind == 'ident' and tok in _type_keywords:
+            is_logic = is_logic or tok == 'logic'
+        elif tok == '[':
+            dim, i = take_brackets(i, '[', ']')
+            if name is None:
+                packed *= _dim_size(dim, params)
+            else:
+                unpacked *= _dim_size(dim, params)
             continue
-        if ");" in ln:
-            return ports
-        if 'input' in ln:
-            io_ty = 'input'
-            ln = extract(ln, 'input')
-        elif 'output' in ln:
-            io_ty = 'output'
-            ln = extract(ln, 'output')
-        elif 'inout' in ln:
-            io_ty = 'inout'
-            ln = extract(ln, 'inout')
-        else:
-            raise Exception("Unrecognized port type in " + ln)
-
-        is_logic = 'logic' in ln
-        if is_logic:
-            ln = extract(ln, 'logic')
-
-        name_str = str(ln.replace('input', '').replace('output', '').strip())
-        found_start = False
-        found_end = False
-        name_start = -1
-        name_end = -1
-        for i, c in enumerate(name_str):
-            c = str(c)
-            if not found_start:
-                if c.isalpha():
-                    found_start = True
-                    name_start = i
-                    continue
-            elif found_start and not found_end:
-                if not c.isalnum() and c != '_':
-                    found_end = True
-                    name_end = i
-                    continue
-        if name_end != -1:
-            name = name_str[name_start:name_end]
-        else:
-            name = name_str[name_start:]
-
-        # Find width
-        before_name = name_str[:name_start]
-        if '[' in before_name:
-            n = before_name[before_name.find('[') + 1:before_name.find(':')]
-            if not is_number(n):
-                n = 0
-            width = 1 + int(n)
-        else:
-            width = 1
+        elif kind == 'ident':
+            if name is not None:
+                # e.g. a user-defined net type preceding the name
+                raise Exception(f"Unexpected identifier '{tok}' after port '{name}'")
+            name = tok
+        elif tok == ',':
+            # Later names in the same declaration share direction and packed width
+            finish_port()
+            name = None
+            unpacked = 1
+        elif tok == '=':
+            # skip default values
+            depth = 0
+            while i + 1 < n and not (depth == 0 and tokens[i + 1][1] in (',', ')')):
+                i += 1
+                if tokens[i][1] in '([{':
+                    depth += 1
+                elif tokens[i][1] in ')]}':
+                    depth -= 1
+        i += 1
+    finish_port()
+    return ports
 
-        # Find ar_width
-        after_name = name_str[name_end:]
-        if '[' in after_name:
-            ar_width = 1 + int(after_name[after_name.find('[') + 1:after_name.find(':')])
-        else:
-            ar_width = 1
-        # if 'bits_' in name:
-        #     name = name[:name.find('bits_')] + name[name.find('bits_') + 5:]
 
-        if 'rst_' in name or 'reset' in name or 'clk' in name or 'clock' in name:
-            continue
-        ports.append(VerilogPort(name, width, ar_width, io_ty, is_logic))
+def scrape_ports_cached(lns, defines=(), params=None):
+    # Shell interface files essentially never change between runs, so keep parse results keyed on the content
+    text = ''.join(lns)
+    h = hashlib.sha256()
+    h.update(f"{PORT_PARSER_VERSION}|{sorted(defines)}|{sorted((params or {}).items())}|".encode())
+    h.update(text.encode())
+    path = f"{port_cache_dir}/{h.hexdigest()}.json"
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                return [VerilogPort(*p) for p in json.load(f)]
+        except (OSError, ValueError, TypeError, AssertionError):
+            pass
+    ports = scrape_ports_from_lines([text], defines, params)
+    try:
+        os.makedirs(port_cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump([[p.name, p.width, p.ar_width, p.io_type, p.logic] for p in ports], f)
+        os.replace(tmp, path)
+    except OSError:
+        print("Weak warning: Could not write port cache to " + port_cache_dir)
     return ports
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import util
+
+# Per-AFI cache for beethoven-load. An entry holds the extracted env_<name>.tar.gz of one AFI and the BeethovenRuntime
+# binaries built against it. Entries are keyed by FpgaImageGlobalId and the S3 ETag of the archive, so re-uploading
+# the environment under the same name invalidates them. Binaries are additionally keyed by the Beethoven-Runtime
+# source revision.
+
+cache_dir = f"{util.beethoven_cache}/afi"
+max_entries = int(os.environ.get("BEETHOVEN_AFI_CACHE_ENTRIES", 16))
+
+
+def env_etag(bucket, key):
+    out = subprocess.run(["aws", "s3api", "head-object", "--bucket", bucket, "--key", key, "--query", "ETag",
+                          "--output", "text"], capture_output=True, text=True)
+    if out.returncode != 0:
+        return None
+    return out.stdout.strip().strip('"')
+
+
+def entry_dir(agfi, etag):
+    return f"{cache_dir}/{agfi}-{etag.replace('-', '_')}"
+
+
+def runtime_rev(runtime_dir):
+    # HEAD of the runtime checkout, plus a hash of local changes so that edits to the runtime rebuild it
+    head = subprocess.run(["git", "-C", runtime_dir, "rev-parse", "HEAD"], capture_output=True, text=True)
+    if head.returncode != 0:
+        return None
+    diff = subprocess.run(["git", "-C", runtime_dir, "diff", "HEAD"], capture_output=True)
+    rev = head.stdout.strip()[:12]
+    if diff.stdout:
+        rev += "-" + hashlib.sha256(diff.stdout).hexdigest()[:12]
+    return rev
+
+
+def fetch_env(bucket, name, agfi, dest, use_cache=True):
+    """
+    Put the extracted environment of AFI `agfi` into dest, from the cache if possible. Returns the cache entry
+    directory, or None when the archive could not be identified (or use_cache is off) and was fetched directly.
+    """
+    key = f"env_{name}.tar.gz"
+    etag = env_etag(bucket, key) if use_cache else None
+    os.makedirs(dest, exist_ok=True)
+    if etag is None:
+        assert 0 == subprocess.run(["bash", "-o", "pipefail", "-c",
+                                    f"aws s3 cp s3://{bucket}/{key} - | tar -xzf - -C {dest}"]).returncode
+        return None
+    entry = entry_dir(agfi, etag)
+    if not os.path.isdir(f"{entry}/env"):
+        # straight from S3 through tar into the cache, the archive itself is never written out
+        tmp = f"{entry}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(f"{tmp}/env")
+        ret = subprocess.run(["bash", "-o", "pipefail", "-c",
+                              f"aws s3 cp s3://{bucket}/{key} - | tar -xzf - -C {tmp}/env"]).returncode
+        if ret != 0:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise Exception(f"Could not fetch s3://{bucket}/{key}")
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp, entry)
+        evict()
+    else:
+        print(f"Using cached environment of {name} ({agfi})")
+    os.utime(entry)
+    assert 0 == os.system(f"cp -r {entry}/env/. {dest}/")
+    return entry
+
+
+def cached_runtime(entry, runtime_dir):
+    # path of a BeethovenRuntime built from this environment and the current runtime sources, or None
+    if entry is None:
+        return None
+    rev = runtime_rev(runtime_dir)
+    if rev is None or not os.path.exists(f"{entry}/BeethovenRuntime-{rev}"):
+        return None
+    return f"{entry}/BeethovenRuntime-{rev}"
+
+
+def store_runtime(entry, runtime_dir, binary, ret):
+    # ret is the exit status of the runtime build, after a failed one binary is whatever an earlier build left behind
+    rev = runtime_rev(runtime_dir)
+    if ret != 0 or entry is None or rev is None or not os.path.exists(binary):
+        return
+    shutil.copy2(binary, f"{entry}/BeethovenRuntime-{rev}")
+
+
+def evict():
+    # keep the most recently loaded entries
+    if not os.path.isdir(cache_dir):
+        return
+    entries = sorted((f"{cache_dir}/{e}" for e in os.listdir(cache_dir) if ".tmp-" not in e),
+                     key=os.path.getmtime, reverse=True)
+    for e in entries[max_entries:]:
+        shutil.rmtree(e, ignore_errors=True)
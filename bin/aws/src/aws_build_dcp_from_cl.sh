@@ -18,7 +18,7 @@
 # Usage help
 function usage
 {
-    echo "usage: aws_build_dcp_from_cl.sh [ [-script <vivado_script>] | [-strategy BASIC | DEFAULT | EXPLORE | TIMING | CONGESTION] [-clock_recipe_a A0 | A1 | A2] [-clock_recipe_b B0 | B1 | B2 | B3 | B4 | B5] [-clock_recipe_c C0 | C1 | C2 | C3] [-uram_option 2 | 3 | 4] [-vdefine macro1,macro2,macro3,.....,macrox] -foreground] [-notify] | [-h] | [-H] | [-help] ]"
+    echo "usage: aws_build_dcp_from_cl.sh [ [-script <vivado_script>] | [-strategy BASIC | DEFAULT | EXPLORE | TIMING | CONGESTION] [-clock_recipe_a A0 | A1 | A2] [-clock_recipe_b B0 | B1 | B2 | B3 | B4 | B5] [-clock_recipe_c C0 | C1 | C2 | C3] [-uram_option 2 | 3 | 4] [-vdefine macro1,macro2,macro3,.....,macrox] -foreground] [-notify] [-no_cache] | [-h] | [-H] | [-help] ]"
     echo " "
     echo "By default the build is run in the background using nohup so that the"
     echo "process will not be terminated if the terminal window is closed."
@@ -31,6 +31,10 @@ function usage
     echo "is closed. This option is useful if you want to wait for the build"
     echo "to complete. This option is safe if the terminal is running on the"
     echo "AWS instance, for example on a GUI desktop on the instance."
+    echo " "
+    echo "A build of a design, constraints and scripts that were built before with the"
+    echo "same arguments is restored from the checkpoint cache (beethoven-dcp-cache)"
+    echo "instead of running Vivado. The -no_cache option always runs Vivado."
 }
 
 # Default arguments for script and strategy
@@ -45,6 +49,7 @@ ignore_memory_requirement=0
 expected_memory_usage=30000000
 uram_option=2
 vdefine=""
+use_cache=1
 
 function info_msg {
   echo -e "INFO: $1"
@@ -100,6 +105,8 @@ while [ "$1" != "" ]; do
                                 ;;
         -ignore_memory_requirement) ignore_memory_requirement=1
                                 ;;
+        -no_cache )             use_cache=0
+                                ;;
         -h | -H | -help )       usage
                                 exit
                                 ;;
@@ -216,11 +223,32 @@ then
 	exit 1
 fi
 
+# Reuse an earlier build of exactly the same design, constraints, scripts and arguments
+cache_key=""
+if [[ $use_cache == 1 ]] && command -v beethoven-dcp-cache >/dev/null 2>&1; then
+  cache_key=$(beethoven-dcp-cache key $CL_DIR $strategy $clock_recipe_a $clock_recipe_b $clock_recipe_c $uram_option $vdefine)
+  cached=$(beethoven-dcp-cache fetch $CL_DIR $cache_key)
+  if [[ $? -eq 0 ]]; then
+    info_msg "This design was built before ($cached). Restored its checkpoints and reports into $CL_DIR/build from the cache."
+    exit 0
+  fi
+fi
+
 # Use timestamp for logs and output files
 timestamp=$(date +"%y_%m_%d-%H%M%S") 
 logname=$timestamp.vivado.log
 ln -s -f $logname last_log
 
+# What to do once Vivado succeeded: cache the build and offer it as reference for incremental implementation
+after_cmd="true"
+if [[ "$cache_key" != "" ]]; then
+  after_cmd="beethoven-dcp-cache store $CL_DIR $cache_key $timestamp"
+fi
+if command -v beethoven-incremental >/dev/null 2>&1; then
+  beethoven-incremental snapshot $CL_DIR $timestamp
+  after_cmd="$after_cmd; beethoven-incremental record $CL_DIR $timestamp"
+fi
+
 info_msg "Environment variables and directories are present. Checking for Vivado installation."
 
 # Before going too far make sure Vivado is available
@@ -242,10 +270,18 @@ id1_version=$(grep -v '^\//' $CL_DIR/design/cl_id_defines.vh | grep 'CL_SH_ID1'
 subsystem_id="0x${id1_version:0:4}";
 subsystem_vendor_id="0x${id1_version:4:4}";
 
+# Follow the log while Vivado writes it, for the phase timeline in build/reports (see beethoven-build-log)
+follow_log() {
+  if command -v beethoven-build-log >/dev/null 2>&1; then
+    nohup beethoven-build-log timeline $logname --follow --pid=$1 --out=$CL_DIR/build/reports/$timestamp.timeline.json > /dev/null 2>&1 &
+  fi
+}
+
 # Run vivado
 cmd="vivado -mode batch -nojournal -log $logname -source $vivado_script -tclargs $timestamp $strategy $hdk_version $shell_version $device_id $vendor_id $subsystem_id $subsystem_vendor_id $clock_recipe_a $clock_recipe_b $clock_recipe_c $uram_option $notify $opt_vdefine"
 if [[ "$foreground" == "0" ]]; then
-  nohup $cmd > $timestamp.nohup.out 2>&1 &
+  nohup bash -c "$cmd && { $after_cmd; }" > $timestamp.nohup.out 2>&1 &
+  follow_log $!
   
   info_msg "Build through Vivado is running as background process, this may take few hours."
   info_msg "Output is being redirected to $timestamp.nohup.out"
@@ -254,5 +290,6 @@ if [[ "$foreground" == "0" ]]; then
 else
   info_msg "Build through Vivado is running in the foreground, this may take a few hours."
   info_msg "The build may be terminated if the network connection to this terminal window is lost."
-  $cmd
+  follow_log $$
+  $cmd && bash -c "$after_cmd"
 fi
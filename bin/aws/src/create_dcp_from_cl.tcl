@@ -14,6 +14,7 @@
 # limitations under the License.
 
 package require tar
+package require struct::set
 
 ## Do not edit $TOP
 set TOP top_sp
@@ -184,6 +185,11 @@ switch $strategy {
     }
 }
 
+# Directive overrides of a build sweep variant (see aws-sweep)
+if { [file exists ./build_overrides.tcl] } {
+    source ./build_overrides.tcl
+}
+
 #Encrypt source code
 # Actually - don't do this for three reasons.
 # 1. You don't need it to get the toolchain to work
@@ -274,6 +280,22 @@ if {$implement} {
       }
    }
 
+   ########################
+   # Core floorplan
+   ########################
+   # pblocks for the accelerator cores, written by aws-gen-build with `floorplan pblock`
+   if {$place && [file exists ./beethoven_floorplan.tcl]} {
+      source ./beethoven_floorplan.tcl
+   }
+
+   ########################
+   # Incremental reference
+   ########################
+   # written by aws-gen-build when the last routed checkpoint that met timing is close enough to this design
+   if {$place && [file exists ./incremental.tcl]} {
+      source ./incremental.tcl
+   }
+
    ########################
    # CL Place
    ########################
@@ -317,6 +339,28 @@ if {$implement} {
    # Report final timing
    report_timing_summary -file $CL_DIR/build/reports/${timestamp}.SH_CL_final_timing_summary.rpt
 
+   # Utilization per instance and the sites available to the CL in each SLR, for beethoven-utilization
+   report_utilization -hierarchical -file $CL_DIR/build/reports/${timestamp}.SH_CL_utilization_hierarchical.rpt
+   set cl_cell [get_cells -quiet -hierarchical -filter "ORIG_REF_NAME == $CL_MODULE || REF_NAME == $CL_MODULE"]
+   set cl_pblock [get_pblocks -quiet -of_objects $cl_cell]
+   set fd [open $CL_DIR/build/reports/${timestamp}.SH_CL_slr_capacity.txt w]
+   if {[llength $cl_pblock] > 0} {
+      puts $fd "scope pblock"
+      set cl_sites [get_sites -quiet -of_objects $cl_pblock]
+   } else {
+      puts $fd "scope device"
+      set cl_sites [get_sites]
+   }
+   foreach slr [get_slrs] {
+      set sites [get_sites -quiet -of_objects $slr]
+      if {[llength $cl_pblock] > 0} {
+         set sites [struct::set intersect $sites $cl_sites]
+      }
+      set slices [llength [filter -quiet $sites {SITE_TYPE == SLICEL || SITE_TYPE == SLICEM}]]
+      puts $fd "$slr LUT [expr {$slices * 8}] FF [expr {$slices * 16}] BRAM [llength [filter -quiet $sites {SITE_TYPE == RAMB36}]] URAM [llength [filter -quiet $sites {SITE_TYPE == URAM288}]] DSP [llength [filter -quiet $sites {SITE_TYPE == DSP48E2}]]"
+   }
+   close $fd
+
    # This is what will deliver to AWS
    puts "AWS FPGA: ([clock format [clock seconds] -format %T]) - Writing final DCP to to_aws directory.";
 
@@ -122,6 +122,14 @@ set_property PROCESSING_ORDER EARLY  [get_files cl_clocks_aws.xdc]
 puts "AWS FPGA: ([clock format [clock seconds] -format %T]) Start design synthesis.";
 
 update_compile_order -fileset sources_1
+
+# Replicated cores are black boxes here, their out-of-context runs (see ooc_synth.py) go alongside this one
+if { [file exists ./ooc_run.sh] } {
+    file delete -force ooc.done
+    # the runs read the same defines as the synth_design below
+    set ::env(BEETHOVEN_VDEFINES) $VDEFINES
+    exec ./ooc_run.sh > ooc_run.out 2>@1 &
+}
 puts "\nRunning synth_design for $CL_MODULE $CL_DIR/build/scripts \[[clock format [clock seconds] -format {%a %b %d %H:%M:%S %Y}]\]"
 eval [concat synth_design -top $CL_MODULE -verilog_define XSDB_SLV_DIS $VDEFINES -part [DEVICE_TYPE] -mode out_of_context $synth_options -directive $synth_directive]
 
@@ -131,6 +139,10 @@ if { $failval==0 } {
 	exit 1
 }
 
+if { [file exists ./ooc_stitch.tcl] } {
+    source ./ooc_stitch.tcl
+}
+
 puts "AWS FPGA: ([clock format [clock seconds] -format %T]) writing post synth checkpoint.";
 write_checkpoint -force $CL_DIR/build/checkpoints/${timestamp}.CL.post_synth.dcp
 
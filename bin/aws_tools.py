@@ -1,6 +1,13 @@
+import json
+import mmap
 import os
+import re
 from typing import List
+
+import util
 from VerilogUtils import *
+import shell_check
+import shell_ip
 
 HOME = os.environ['HOME']
 EncryptTCLfname = HOME + "/bin/aws/src/encrypt.tcl"
@@ -10,47 +17,43 @@ if AWS_FPGA_REPO_DIR is None:
 
 
 def get_class(name: str):
-    if name[:len(InterfacePrefixes.slave)] == InterfacePrefixes.slave:
-        return PortClass.Slave
-    elif name[:len(InterfacePrefixes.master)] == InterfacePrefixes.master:
-        return PortClass.Master
-    elif name[:len(InterfacePrefixes.DMA)] == InterfacePrefixes.DMA:
-        return PortClass.DMA
-    else:
+    pc = port_class_of(name)
+    if pc is None:
         raise Exception
+    return pc
 
 
 def scrape_aws_ports():
     with open(f"{AWS_FPGA_REPO_DIR}/hdk/common/shell_stable/design/interfaces/cl_ports.vh") as f:
-        return scrape_ports_from_lines(f.readlines())
+        return PortTable(scrape_ports_cached(f.readlines()))
+
+
+def find_module_header(fname, module):
+    # Returns the text of `module`'s header (from `module` up to and including the closing `);`) without reading the
+    # whole file into memory. The generated sources can be hundreds of MB for large designs.
+    with open(fname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            m = re.compile(rb"^[ \t]*module[ \t]+" + module.encode() + rb"\b", re.M).search(mm)
+            if m is None:
+                return None
+            end = mm.find(b");", m.end())
+            end = len(mm) if end == -1 else end + 2
+            return mm[m.start():end].decode()
 
 
 def scrape_cl_ports():
-    ct = open(f"./generated-src/beethoven.sv")
-    lns = []
-    state = 0
-    for ln in ct.readlines():
-        if state == 0:
-            if len(ln) < 6:
-                continue
-            spl = ln.split()
-            if spl[0] == 'module':
-                if spl[1][:-1] == 'BeethovenTop':
-                    state = 1
-        elif state == 1:
-            # start scraping ios
-            if ln[:2] == ');':
-                lns.append(ln)
-                break
-            else:
-                lns.append(ln)
-    return scrape_ports_from_lines(lns)
+    header = find_module_header("./generated-src/beethoven.sv", "BeethovenTop")
+    if header is None:
+        raise Exception("Could not find module BeethovenTop in generated-src/beethoven.sv")
+    return PortTable(scrape_ports_cached([header]))
 
 
 def scrape_sh_ddr_ports():
     with open(f"{AWS_FPGA_REPO_DIR}/hdk/common/shell_stable/design/sh_ddr/sh_ddr.stub.sv") as f:
         lns = f.readlines()[45:]
-        return scrape_ports_from_lines(lns)
+        return PortTable(scrape_ports_cached(lns))
 
 
 def get_num_ddr_channels():
@@ -69,7 +72,431 @@ def bool_to_int(b):
     return 0
 
 
+def get_axi_channel(part):
+    # AXI channel (aw, w, b, ar, r) that a part name such as 'awaddr' or 'rdata' belongs to
+    for ch in ['aw', 'ar', 'w', 'b', 'r']:
+        if part.startswith(ch):
+            return ch
+    return None
+
+
+# beethoven.cfg interface names for the BeethovenTop port classes
+shell_interfaces = {'ddr': PortClass.Master, 'ocl': PortClass.Slave, 'pcis': PortClass.DMA}
+
+
+def group_axi_channels(ports):
+    # {(group, channel): (valid, ready, [payload])} for every complete valid/ready channel in `ports`
+    channels = {}
+    for p in ports:
+        ch = get_axi_channel(p.get_axi_part_name())
+        if ch is not None:
+            channels.setdefault((p.get_group_name(), ch), []).append(p)
+    result = {}
+    for (group, ch), members in channels.items():
+        valid = [p for p in members if p.get_axi_part_name() == ch + 'valid']
+        ready = [p for p in members if p.get_axi_part_name() == ch + 'ready']
+        if len(valid) != 1 or len(ready) != 1 or any(p.ar_width != 1 for p in members):
+            continue
+        payload = [p for p in members if p is not valid[0] and p is not ready[0]]
+        result[(group, ch)] = (valid[0], ready[0], payload)
+    return result
+
+
+def insert_axi_reg_slices(g, ports, shell_side, depth, resets, slrs=()):
+    """
+    Put `depth` register slice stages on every AXI channel of `ports` (BeethovenTop ports of one interface class).
+    shell_side maps each port to the wire that gets bound to the shell and is updated to point past the slices.
+    resets is the shell's ResetTree. slrs optionally pins each stage, counted from the BeethovenTop side, to an SLR.
+    """
+    if depth <= 0:
+        return
+    g.require_module("beethoven_axi_reg_slice", shell_ip.AXI_REG_SLICE)
+    for (group, ch), (valid, ready, payload) in group_axi_channels(ports).items():
+        members = [valid, ready] + payload
+        # widths come from the wires, whatever sits between BeethovenTop and here may have widened them
+        width = sum(shell_side[p].width for p in payload)
+        # sides[0] is BeethovenTop's end of the channel and sides[depth] is the shell's
+        sides = [[shell_side[p] for p in members]]
+        for k in range(1, depth + 1):
+            sides.append([declare_wire_with_name(g, f"{shell_side[p].name}_rs{k}", shell_side[p].width, 1)
+                          for p in members])
+
+        def data(ws):
+            return "{" + ", ".join(w.name for w in ws[2:]) + "}" if len(payload) > 0 else ""
+
+        for k in range(depth):
+            # BeethovenTop drives valid on channels it sources, otherwise data flows from the shell towards it
+            src, dst = (sides[k], sides[k + 1]) if valid.output else (sides[k + 1], sides[k])
+            inst = f"beethoven_rs_{group}_{ch}_{k}"
+            g.instance("beethoven_axi_reg_slice", inst,
+                       [("clk", "clk", "input"),
+                        ("rst", resets.take(), "input"),
+                        ("s_valid", src[0].name, "input"),
+                        ("s_ready", src[1].name, "output"),
+                        ("s_data", data(src) if len(payload) > 0 else "1'b0", "input"),
+                        ("m_valid", dst[0].name, "output"),
+                        ("m_ready", dst[1].name, "input"),
+                        ("m_data", data(dst), "output")],
+                       params=f"#(.WIDTH({max(width, 1)}))")
+            if k < len(slrs):
+                g.constraints.append(f"set_property USER_SLR_ASSIGNMENT {slrs[k]} [get_cells -hierarchical {inst}]")
+        for p, w in zip(members, sides[depth]):
+            shell_side[p] = w
+
+
+def insert_axi_cdc(g, ports, shell_side, accel_clock, accel_resets, shell_resets, depth=8, bus_skew=None):
+    """
+    Put an asynchronous FIFO on every AXI channel of `ports` so that BeethovenTop can run on accel_clock while the
+    shell side stays on clk. shell_side is updated like in insert_axi_reg_slices. Instances are named after the
+    direction they carry data in (beethoven_cdc_to_shell_*, beethoven_cdc_to_accel_*) so the XDC can tell the two
+    clocks apart.
+    """
+    g.require_module("beethoven_axi_cdc", shell_ip.AXI_CDC)
+    addr = max(2, (depth - 1).bit_length())
+    for (group, ch), (valid, ready, payload) in group_axi_channels(ports).items():
+        members = [valid, ready] + payload
+        width = sum(shell_side[p].width for p in payload)
+        accel_side = [shell_side[p] for p in members]
+        clk_side = [declare_wire_with_name(g, f"{shell_side[p].name}_cdc", shell_side[p].width, 1) for p in members]
+
+        def data(ws):
+            return "{" + ", ".join(w.name for w in ws[2:]) + "}" if len(payload) > 0 else ""
+
+        if valid.output:
+            inst = f"beethoven_cdc_to_shell_{group}_{ch}"
+            src, dst = accel_side, clk_side
+            src_clk, src_rst, dst_clk, dst_rst = accel_clock, accel_resets.take(), "clk", shell_resets.take()
+        else:
+            inst = f"beethoven_cdc_to_accel_{group}_{ch}"
+            src, dst = clk_side, accel_side
+            src_clk, src_rst, dst_clk, dst_rst = "clk", shell_resets.take(), accel_clock, accel_resets.take()
+        g.instance("beethoven_axi_cdc", inst,
+                   [("s_clk", src_clk, "input"),
+                    ("s_rst", src_rst, "input"),
+                    ("s_valid", src[0].name, "input"),
+                    ("s_ready", src[1].name, "output"),
+                    ("s_data", data(src) if len(payload) > 0 else "1'b0", "input"),
+                    ("m_clk", dst_clk, "input"),
+                    ("m_rst", dst_rst, "input"),
+                    ("m_valid", dst[0].name, "output"),
+                    ("m_ready", dst[1].name, "input"),
+                    ("m_data", data(dst), "output")],
+                   params=f"#(.WIDTH({max(width, 1)}), .ADDR({addr}))")
+        if bus_skew is not None:
+            for ptr, sync in [("wptr_gray", "wptr_meta"), ("rptr_gray", "rptr_meta")]:
+                g.constraints.append(f"set_bus_skew "
+                                     f"-from [get_cells -hierarchical -filter {{NAME =~ *{inst}/{ptr}_reg*}}] "
+                                     f"-to [get_cells -hierarchical -filter {{NAME =~ *{inst}/{sync}_reg*}}] "
+                                     f"{bus_skew}")
+        for p, w in zip(members, clk_side):
+            shell_side[p] = w
+
+
+def accel_clock_constraints(g):
+    # the accelerator clock is asynchronous to clk, the FIFO pointers are covered by set_bus_skew instead
+    def clocks_of(ptr):
+        pins = f"[get_pins -hierarchical -filter {{NAME =~ *beethoven_cdc_to_accel_*/{ptr}_reg*/C}}]"
+        return f"[get_clocks -of_objects {pins}]"
+    # write pointers of the FIFOs towards BeethovenTop are on clk, their read pointers on the accelerator clock
+    g.constraints.append(f"set_clock_groups -asynchronous -group {clocks_of('wptr_gray')} "
+                         f"-group {clocks_of('rptr_gray')}")
+
+
+# fields of each AXI channel the crossbar routes on, everything else is carried through as data
+xbar_fields = {'aw': ['id', 'addr'], 'w': ['last'], 'b': ['id'], 'ar': ['id', 'addr'], 'r': ['id', 'last']}
+
+
+def insert_ddr_xbar(g, ports, shell_side, resets, granularity, interleave=True, host=None, mem_id_width=16):
+    """
+    Put a crossbar between BeethovenTop's memory masters (`ports`) and the DDR channels they are bound to. With
+    interleave consecutive `granularity` byte blocks go to consecutive channels. Otherwise every BeethovenTop master
+    keeps its own channel and address, and `granularity` is the size of the region each channel gets in the address
+    space of `host`. host optionally adds the shell's dma_pcis ports as one more master, so host DMA reaches every
+    channel without going through BeethovenTop. shell_side is updated like in insert_axi_reg_slices. Returns the
+    address map for the runtime.
+    """
+    gran = granularity.bit_length() - 1
+    if granularity != 1 << gran or gran < 12:
+        raise Exception(f"DDR crossbar granularity must be a power of two of at least 4096 bytes (got {granularity})")
+    channels = {}
+    for (group, ch), channel in group_axi_channels(ports).items():
+        channels.setdefault(group, {})[ch] = channel
+    groups = sorted(channels.keys())
+    n = len(groups)
+    if n < (2 if host is None else 1):
+        return None
+    if n & (n - 1) != 0:
+        raise Exception(f"The DDR crossbar needs a power of two number of memory channels (got {n})")
+    if any(len(channels[group]) != 5 for group in groups):
+        raise Exception("The DDR crossbar needs complete AXI4 memory ports")
+    g.require_module("beethoven_rr_arb", shell_ip.RR_ARB)
+    g.require_module("beethoven_axi_xbar", shell_ip.AXI_XBAR)
+
+    def parts(group, ch):
+        valid, ready, payload = channels[group][ch]
+        return [valid, ready] + payload
+
+    def is_field(ch, p):
+        return p.get_axi_part_name()[len(ch):] in xbar_fields[ch]
+
+    # every master as {ch: {part: signal}}, BeethovenTop's through shell_side and the host's straight from the shell
+    masters = [{ch: {p.get_axi_part_name()[len(ch):]: shell_side[p] for p in parts(group, ch)} for ch in xbar_fields}
+               for group in groups]
+    if host is not None:
+        by_part = {p.get_axi_part_name(): p for p in host}
+        try:
+            masters.append({ch: {p.get_axi_part_name()[len(ch):]: by_part[p.get_axi_part_name()]
+                                 for p in parts(groups[0], ch)} for ch in xbar_fields})
+        except KeyError as e:
+            raise Exception(f"dma_pcis has no {e.args[0]}, it does not match BeethovenTop's memory ports")
+    nm = len(masters)
+    mb = max(nm - 1, 1).bit_length()
+    # request IDs must still fit the memory's ID once the master index is on top
+    idw = min(max(m[ch]['id'].width for m in masters for ch in ['aw', 'ar']), mem_id_width - mb)
+    # The host's (or a wide BeethovenTop port's) IDs may not fit. Cutting them would hand B and R back with the wrong
+    # ID, so such masters get their outstanding IDs remapped onto idw-bit slots instead.
+    host_outputs = [p for ch in masters[-1].values() for p in ch.values() if p.output] if host is not None else []
+    for i, m in enumerate(masters):
+        for req, rsp in [('aw', 'b'), ('ar', 'r')]:
+            if m[req]['id'].width <= idw:
+                continue
+            g.require_module("beethoven_axi_id_remap", shell_ip.ID_REMAP)
+            x = {f: declare_wire_with_name(g, f"beethoven_idmap_{i}_{req}{f}", w, 1)
+                 for f, w in [('valid', 1), ('ready', 1), ('id', idw)]}
+            rsp_id = declare_wire_with_name(g, f"beethoven_idmap_{i}_{rsp}id", idw, 1)
+            last = m[rsp]['last'].name if 'last' in m[rsp] else "1'b1"
+            g.instance("beethoven_axi_id_remap", f"beethoven_idmap_{i}_{req}",
+                       [("clk", "clk", "input"),
+                        ("rst", resets.take(), "input"),
+                        ("s_valid", m[req]['valid'].name, "input"),
+                        ("s_ready", m[req]['ready'].name, "output"),
+                        ("s_id", m[req]['id'].name, "input"),
+                        ("m_valid", x['valid'].name, "output"),
+                        ("m_ready", x['ready'].name, "input"),
+                        ("m_id", x['id'].name, "output"),
+                        ("rsp_valid", m[rsp]['valid'].name, "input"),
+                        ("rsp_ready", m[rsp]['ready'].name, "input"),
+                        ("rsp_last", last, "input"),
+                        ("rsp_m_id", rsp_id.name, "input"),
+                        ("rsp_s_id", m[rsp]['id'].name, "output")],
+                       params=f"#(.IW({m[req]['id'].width}), .OW({idw}), .N({min(16, 1 << idw)}))")
+            m[req] = dict(m[req], **x)
+            m[rsp] = dict(m[rsp], id=rsp_id)
+
+    def xbar_id(sig, into_xbar):
+        if sig.width == idw:
+            return sig.name
+        w = declare_wire_with_name(g, f"{sig.name.replace('[', '_').replace(']', '')}_xid", idw, 1)
+        if into_xbar:
+            w.assign(g, sig)
+        else:
+            sig.assign(g, w)
+        return w.name
+
+    def cat(names):
+        # index 0 ends up in the low bits
+        return "{" + ", ".join(reversed(names)) + "}"
+
+    params = {'NM': nm, 'NS': n, 'IDW': idw, 'AW': masters[0]['aw']['addr'].width, 'GRAN': gran,
+              'INTERLEAVE': 1 if interleave else 0, 'FIXED': 0 if interleave else (1 << n) - 1}
+    conns = [("clk", "clk", "input"), ("rst", resets.take(), "input")]
+    mem = {}
+    for ch, fields in xbar_fields.items():
+        # aw, w and ar go from the masters to the memory, b and r come back
+        request = ch in ['aw', 'w', 'ar']
+        data = [part[len(ch):] for part in (p.get_axi_part_name() for p in parts(groups[0], ch))
+                if part[len(ch):] not in ['valid', 'ready'] + fields]
+        params[f"{ch.upper()}P"] = max(sum(masters[0][ch][d].width for d in data), 1)
+        for group in groups:
+            for p in parts(group, ch):
+                # IDs on the memory side are the crossbar's (idw) with the master index on top
+                is_id = is_field(ch, p) and p.get_axi_part_name() == ch + 'id'
+                mem[p] = declare_wire_with_name(g, f"{shell_side[p].name}_ix",
+                                                idw + mb if is_id else shell_side[p].width, 1)
+        slaves = [{p.get_axi_part_name()[len(ch):]: mem[p] for p in parts(group, ch)} for group in groups]
+
+        def side(sigs, prefix, to_xbar):
+            # to_xbar: direction of valid and the fields, ready goes the other way
+            io, rio = ("input", "output") if to_xbar else ("output", "input")
+            # every signal must be as wide as its slice of the port, else the concatenation shifts the ones after it
+            expected = {'id': idw if prefix == 's' else idw + mb, 'addr': params['AW'], 'last': 1}
+            for k, m in enumerate(sigs):
+                widths = {f: idw if f == 'id' and prefix == 's' else m[f].width for f in fields}
+                if len(data) > 0:
+                    widths['data'] = sum(m[d].width for d in data)
+                for f, w in widths.items():
+                    want = params[f"{ch.upper()}P"] if f == 'data' else expected[f]
+                    if w != want:
+                        who = 'master' if prefix == 's' else 'slave'
+                        raise Exception(f"DDR crossbar {prefix}_{ch}_{f}: {who} {k} is {w} bits wide, the port takes "
+                                        f"{want} per {who}")
+            out = [(f"{prefix}_{ch}_valid", cat([m['valid'].name for m in sigs]), io),
+                   (f"{prefix}_{ch}_ready", cat([m['ready'].name for m in sigs]), rio)]
+            for f in fields:
+                names = [xbar_id(m[f], to_xbar) if f == 'id' and prefix == 's' else m[f].name for m in sigs]
+                out.append((f"{prefix}_{ch}_{f}", cat(names), io))
+            if len(data) > 0:
+                out.append((f"{prefix}_{ch}_data", cat([cat([m[d].name for d in data]) for m in sigs]), io))
+            else:
+                out.append((f"{prefix}_{ch}_data", cat(["1'b0"] * len(sigs)) if to_xbar else "", io))
+            return out
+
+        conns += side([m[ch] for m in masters], "s", request)
+        conns += side(slaves, "m", not request)
+    for p, w in mem.items():
+        shell_side[p] = w
+    g.instance("beethoven_axi_xbar", "beethoven_ddr_xbar", conns,
+               params="#(" + ", ".join(f".{k}({v})" for k, v in params.items()) + ")")
+    # the crossbar (or an ID remap in front of it) drives these, keep the final tie-off pass away from them
+    for p in host_outputs:
+        p.occupancy = p.ar_width
+    ddr_map = {'mode': 'interleave' if interleave else 'region', 'granularity': granularity, 'channels': n,
+               'channel_bits': [gran, gran + max(n - 1, 1).bit_length() - 1],
+               'ports': groups,
+               # the first memory port is bound to the shell's DDR, the others to sh_ddr in order
+               'ddr': ['C', 'A', 'B', 'D'][:n],
+               'host_bypass': host is not None}
+    return ddr_map
+
+
+# register block of one beethoven_axi_perf instance, (name, 32-bit words). Keep in sync with shell_ip.AXI_PERF
+perf_registers = [('cycles', 2), ('aw_count', 2), ('w_beats', 2), ('b_count', 2), ('ar_count', 2), ('r_beats', 2),
+                  ('aw_stall', 2), ('w_stall', 2), ('b_stall', 2), ('ar_stall', 2), ('r_stall', 2),
+                  ('rd_outstanding', 1), ('wr_outstanding', 1)]
+# upper bounds (cycles) of the read latency histogram buckets, the last bucket is open
+perf_latency_buckets = [32, 64, 128, 256, 512, 1024, 2048]
+perf_ocl_fields = ['awaddr', 'awvalid', 'awready', 'wdata', 'wstrb', 'wvalid', 'wready', 'bresp', 'bvalid', 'bready',
+                   'araddr', 'arvalid', 'arready', 'rdata', 'rresp', 'rvalid', 'rready']
+
+
+def insert_perf_counters(g, cl_ios, shell_side, resets, base):
+    """
+    Monitor every memory port at the point where it is bound to the DDR and map the counters into a 4 KiB OCL
+    window at `base`. The monitors only read shell_side, the OCL path gets a beethoven_perf_ocl in front of
+    BeethovenTop. Returns the register map for the reader.
+    """
+    if base % 4096 != 0:
+        raise Exception(f"perf_counters base address must be 4 KiB aligned (got {hex(base)})")
+    masters = {}
+    for (group, ch), channel in group_axi_channels(cl_ios.of_class(PortClass.Master)).items():
+        masters.setdefault(group, {})[ch] = channel
+    groups = sorted(masters.keys())
+    if len(groups) == 0 or len(groups) > 31:
+        raise Exception(f"perf_counters supports 1 to 31 memory ports (got {len(groups)})")
+    g.require_module("beethoven_axi_perf", shell_ip.AXI_PERF)
+    g.require_module("beethoven_perf_ocl", shell_ip.PERF_OCL)
+    freeze = declare_wire_with_name(g, "beethoven_perf_freeze", 1, 1)
+    clear = declare_wire_with_name(g, "beethoven_perf_clear", 1, 1)
+
+    regs = []
+    for group in groups:
+        def tap(ch, part):
+            valid, ready, payload = masters[group][ch]
+            p = {'valid': valid, 'ready': ready}.get(part)
+            if p is None:
+                p = [x for x in payload if x.get_axi_part_name() == ch + part][0]
+            return shell_side[p].name
+
+        reg = declare_wire_with_name(g, f"beethoven_perf_{group}_regs", 32 * 32, 1)
+        regs.append(reg.name)
+        conns = [("clk", "clk", "input"), ("rst", resets.take(), "input"),
+                 ("freeze", freeze.name, "input"), ("clear", clear.name, "input")]
+        for ch in ['aw', 'w', 'b', 'ar', 'r']:
+            conns += [(f"{ch}_valid", tap(ch, 'valid'), "input"), (f"{ch}_ready", tap(ch, 'ready'), "input")]
+            if ch in ['ar', 'r']:
+                conns.append((f"{ch}_id", tap(ch, 'id'), "input"))
+        conns += [("r_last", tap('r', 'last'), "input"), ("regs", reg.name, "output")]
+        idw = shell_side[[x for x in masters[group]['ar'][2] if x.get_axi_part_name() == 'arid'][0]].width
+        g.instance("beethoven_axi_perf", f"beethoven_perf_{group}", conns, params=f"#(.IDW({idw}))")
+
+    ocl = {p.get_axi_part_name(): p for p in cl_ios.of_class(PortClass.Slave)}
+    if any(f not in ocl for f in perf_ocl_fields):
+        raise Exception("perf_counters needs an AXI4-Lite OCL port on BeethovenTop")
+    conns = [("clk", "clk", "input"), ("rst", resets.take(), "input")]
+    shell_wires = {}
+    for f in perf_ocl_fields:
+        p = ocl[f]
+        shell_wires[f] = declare_wire_with_name(g, f"{shell_side[p].name}_pm", shell_side[p].width, 1)
+        # s_ faces the shell, m_ faces BeethovenTop
+        conns.append((f"s_{f}", shell_wires[f].name, "output" if p.output else "input"))
+        conns.append((f"m_{f}", shell_side[p].name, "input" if p.output else "output"))
+    conns += [("regs", "{" + ", ".join(reversed(regs)) + "}", "input"),
+              ("freeze", freeze.name, "output"), ("clear", clear.name, "output")]
+    g.instance("beethoven_perf_ocl", "beethoven_perf_ocl", conns,
+               params=f"#(.AW({ocl['awaddr'].width}), .BASE({base}), .NPORTS({len(groups)}))")
+    for f in perf_ocl_fields:
+        shell_side[ocl[f]] = shell_wires[f]
+
+    registers = []
+    offset = 0
+    for name, words in perf_registers:
+        registers.append({'name': name, 'offset': offset, 'words': words})
+        offset += 4 * words
+    return {'base': base, 'window': 4096,
+            'control': {'offset': 0, 'freeze': 1, 'clear': 2}, 'nports_offset': 4,
+            'ports': [{'name': group, 'ddr': ['C', 'A', 'B', 'D'][k] if k < 4 else None, 'offset': 128 * (k + 1)}
+                      for k, group in enumerate(groups)],
+            'registers': registers,
+            'latency_histogram': {'offset': offset, 'buckets': perf_latency_buckets}}
+
+
+class ResetTree:
+    """
+    Reset distribution for one clock domain of the shell. With the defaults every consumer shares `source`.
+    Otherwise `source` runs through `stages` register stages of `replicas` parallel flops and take() hands the last
+    stage out round-robin, with BeethovenTop getting a replica to itself.
+    """
+
+    def __init__(self, g, replicas=1, stages=0, max_fanout=0, clock="clk", source="active_high_rst",
+                 name="beethoven_rst"):
+        self.replicas = max(replicas, 1)
+        # replicas need at least one stage to live in
+        self.stages = max(stages, 1 if self.replicas > 1 else 0)
+        self.exclusive = 0
+        self.shared = 0
+        self.source = source
+        self.name = name
+        if self.stages == 0:
+            return
+        names = [f"{self.name}_s{k}" for k in range(self.stages - 1)] + [self.name]
+        for name in names[:-1]:
+            # keep the intermediate replicas apart, otherwise synthesis merges them back into one flop
+            g.declare('logic', name, self.replicas, 1, attrs='DONT_TOUCH = "true"')
+        # the last stage may still be replicated further by phys_opt, but not merged
+        last_attrs = 'equivalent_register_removal = "no"'
+        if max_fanout > 0:
+            last_attrs += f", max_fanout = {max_fanout}"
+        g.declare('logic', names[-1], self.replicas, 1, attrs=last_attrs)
+        # asserts with rst_main_n like the synchroniser in the module header, deasserts `stages` cycles after it
+        srcs = [f"{{{self.replicas}{{{source}}}}}"] + names[:-1]
+        g.write(f"always_ff @(negedge rst_main_n or posedge {clock})\n"
+                f"\tif (!rst_main_n)\n"
+                f"\tbegin\n" +
+                "".join(f"\t\t{name} <= '1;\n" for name in names) +
+                f"\tend\n"
+                f"\telse\n"
+                f"\tbegin\n" +
+                "".join(f"\t\t{name} <= {src};\n" for name, src in zip(names, srcs)) +
+                f"\tend\n", drives=names)
+
+    def take(self, exclusive=False):
+        # exclusive consumers should be served first, they keep their replica to themselves
+        if self.stages == 0:
+            return self.source
+        if exclusive and self.exclusive < self.replicas:
+            idx = self.exclusive
+            self.exclusive += 1
+        elif self.exclusive >= self.replicas:
+            idx = self.replicas - 1
+        else:
+            idx = self.exclusive + self.shared % (self.replicas - self.exclusive)
+            self.shared += 1
+        return f"{self.name}[{idx}]" if self.replicas > 1 else self.name
+
+
 def search_for_part(part, prefix, part_list: List[VerilogPort]):
+    if isinstance(part_list, PortTable):
+        return part_list.find(part, prefix)
     matches = []
     for port in filter(lambda x: prefix in x.name, part_list):
         if "_" + part == port.name[-len(part) - 1:]:
@@ -88,24 +515,12 @@ def declare_wire(g, width, ar_width):
 
 
 def declare_wire_with_name(g, name, width, ar_width):
-    g.write('wire ')
-    if width > 1:
-        g.write(f"[{width - 1}:0] ")
-    g.write(name)
-    if ar_width > 1:
-        g.write(f"[{ar_width - 1}:0]")
-    g.write(";\n")
+    g.declare('wire', name, width, ar_width)
     return Wire(name, width, ar_width)
 
 
 def declare_reg_with_name(g, name, width, ar_width):
-    g.write('logic ')
-    if width > 1:
-        g.write(f"[{width - 1}:0] ")
-    g.write(name)
-    if ar_width > 1:
-        g.write(f"[{ar_width - 1}:0]")
-    g.write(";\n")
+    g.declare('logic', name, width, ar_width)
     return Reg(name, width, ar_width)
 
 
@@ -130,23 +545,12 @@ def write_aws_header(f):
     f.write("`endif\n")
 
 
-def create_aws_shell():
-    # Get io_in and io_out ports for shell so that we can initialize them all to tied off values.
-
-    # How many AXI4-Mem interfaces did we intialize Beethoven with?
-    ndram = get_num_ddr_channels()
-
-    ddr_ios: List[VerilogPort] = scrape_sh_ddr_ports()
-    cl_ios: List[VerilogPort] = scrape_cl_ports()
-    shell_ports: List[VerilogPort] = scrape_aws_ports()
+# driven by write_aws_module_header rather than the netlist
+shell_header_signals = {'clk', 'pre_sync_rst_n', 'sync_rst_n', 'active_high_rst'}
 
-    to_tie = []
 
-    g = open("beethoven_aws.sv", 'w')
-    # Write header
-    write_aws_header(g)
-    # Write module header
-    g.write(
+def write_aws_module_header(f):
+    f.write(
         f"module beethoven_aws #(parameter NUM_PCIE=1, parameter NUM_DDR=4, parameter NUM_HMC=4, parameter NUM_GTY=4)\n"
         f"(\n"
         f"\t`include \"cl_ports.vh\" // fixed ports definition included by build script\n"
@@ -170,14 +574,114 @@ def create_aws_shell():
         f"\t\tactive_high_rst <= 0;\n"
         f"\tend\n")
 
+
+def create_aws_shell(opts=None):
+    # Get io_in and io_out ports for shell so that we can initialize them all to tied off values.
+
+    # How many AXI4-Mem interfaces did we intialize Beethoven with?
+    ndram = get_num_ddr_channels()
+
+    ddr_ios: PortTable = scrape_sh_ddr_ports()
+    cl_ios: PortTable = scrape_cl_ports()
+    shell_ports: PortTable = scrape_aws_ports()
+
+    opts = opts or {}
+    # the port scraper leaves clocks out, look for the accelerator clock in the port list directly
+    accel_clock = opts.get('accel_clock', 'clk_main_a0')
+    with open(f"{AWS_FPGA_REPO_DIR}/hdk/common/shell_stable/design/interfaces/cl_ports.vh") as f:
+        if re.search(r"\binput\b[^,;]*\b" + re.escape(accel_clock) + r"\b", f.read()) is None:
+            raise Exception(f"accel_clock {accel_clock} is not an input of the shell")
+    g = build_aws_shell(ndram, ddr_ios, cl_ios, shell_ports, opts)
+    check = opts.get('shell_check', 'on')
+    if check != 'off':
+        issues = shell_check.check_shell(g, shell_ports, externally_driven=shell_header_signals)
+        shell_check.report_shell_issues(issues, strict=check == 'strict')
+
+    with open("beethoven_aws.sv", 'w') as f:
+        write_aws_header(f)
+        f.write(g.render_modules())
+        write_aws_module_header(f)
+        g.flush(f)
+        f.write("\nendmodule\n")
+    # placement constraints for the generated logic, appended to the user's pnr constraints by aws-gen-build
+    if len(g.constraints) > 0:
+        with open("beethoven_aws.xdc", 'w') as f:
+            f.write("\n".join(g.constraints) + "\n")
+    elif os.path.exists("beethoven_aws.xdc"):
+        os.remove("beethoven_aws.xdc")
+    write_ddr_address_map(g.metadata.get('ddr_address_map'))
+    perf_map = "./generated-src/beethoven_perf_map.json"
+    if g.metadata.get('perf_counters') is not None:
+        with open(perf_map, 'w') as f:
+            json.dump(dict(g.metadata['perf_counters'], pci={'vendor': cl_vendor_id, 'device': cl_device_id}), f,
+                      indent=2)
+    elif os.path.exists(perf_map):
+        os.remove(perf_map)
+
+
+def write_ddr_address_map(ddr_map):
+    # The runtime allocator needs to know how addresses are spread over the DDR channels. The files go into
+    # generated-src so they travel with beethoven_hardware.h.
+    header = "./generated-src/beethoven_ddr_map.h"
+    if ddr_map is None:
+        for fname in [header, "./generated-src/beethoven_ddr_map.json"]:
+            if os.path.exists(fname):
+                os.remove(fname)
+        return
+    with open("./generated-src/beethoven_ddr_map.json", 'w') as f:
+        json.dump(ddr_map, f, indent=2)
+    with open(header, 'w') as f:
+        f.write(f"#ifndef BEETHOVEN_DDR_MAP_H\n"
+                f"#define BEETHOVEN_DDR_MAP_H\n"
+                f"#define BEETHOVEN_DDR_CHANNELS {ddr_map['channels']}\n"
+                f"#define BEETHOVEN_DDR_HOST_BYPASS {1 if ddr_map['host_bypass'] else 0}\n")
+        if ddr_map['mode'] == 'interleave':
+            f.write(f"// channel = (addr / BEETHOVEN_DDR_INTERLEAVE_BYTES) % BEETHOVEN_DDR_INTERLEAVE_CHANNELS\n"
+                    f"#define BEETHOVEN_DDR_INTERLEAVE_BYTES {ddr_map['granularity']}\n"
+                    f"#define BEETHOVEN_DDR_INTERLEAVE_CHANNELS {ddr_map['channels']}\n")
+        else:
+            f.write(f"// host DMA address = channel * BEETHOVEN_DDR_REGION_BYTES + offset within the channel\n"
+                    f"#define BEETHOVEN_DDR_REGION_BYTES {ddr_map['granularity']}\n")
+        f.write("#endif\n")
+
+
+def build_aws_shell(ndram, ddr_ios: PortTable, cl_ios: PortTable, shell_ports: PortTable, opts=None) -> Netlist:
+    # Builds the body of beethoven_aws in memory. Nothing here touches the filesystem.
+    # opts are the beethoven.cfg options
+    opts = opts or {}
+    g = Netlist()
+    reset_opts = [int(opts.get('reset_replicas', 1)), int(opts.get('reset_stages', 0)),
+                  int(opts.get('reset_max_fanout', 0))]
+    resets = ResetTree(g, *reset_opts)
+    accel_clock = opts.get('accel_clock', 'clk_main_a0')
+    if accel_clock != 'clk_main_a0':
+        # BeethovenTop runs on a different shell clock, everything between it and the shell gets a clock crossing
+        top_clock = declare_wire_with_name(g, "accel_clk", 1, 1).name
+        g.assign(top_clock, accel_clock)
+        # rst_main_n is asynchronous to the accelerator clock, synchronise it again
+        g.declare('logic', "beethoven_accel_rst_sync", 2, 1, attrs='ASYNC_REG = "TRUE"')
+        g.write(f"always_ff @(negedge rst_main_n or posedge {top_clock})\n"
+                f"\tif (!rst_main_n)\n"
+                f"\t\tbeethoven_accel_rst_sync <= '1;\n"
+                f"\telse\n"
+                f"\t\tbeethoven_accel_rst_sync <= {{beethoven_accel_rst_sync[0], 1'b0}};\n",
+                drives=["beethoven_accel_rst_sync"])
+        accel_resets = ResetTree(g, *reset_opts, clock=top_clock, source="beethoven_accel_rst_sync[1]",
+                                 name="beethoven_accel_rst")
+        top_reset = accel_resets.take(exclusive=True)
+    else:
+        top_clock = "clk"
+        accel_resets = None
+        # BeethovenTop holds nearly all of the reset fan-out, it gets a replica of its own
+        top_reset = resets.take(exclusive=True)
+
     ############# INIT ALL BEETHOVEN STUFF ################
     cl_io_wiremap = {}
     cl_mems = {}
     axi_parts = set()
     # Find unique part classes
-    for pr in cl_ios:
-        if 'M' in pr.name:
-            axi_parts.add(pr.get_axi_part_name())
+    for pr in cl_ios.of_class(PortClass.Master):
+        axi_parts.add(pr.get_axi_part_name())
     # Initialize list where all the underlying parts will live
     for part in axi_parts:
         cl_mems[part] = []
@@ -195,8 +699,6 @@ def create_aws_shell():
         if ndram >= 1:
             shell_sig_reg = declare_reg_with_name(g, "RESERVED_SHELL_is_ddr_ready", 1, 1)
             is_ready_search = search_for_part("is_ready", "ddr_", shell_ports)
-            print(shell_ports)
-            print(is_ready_search)
             shell_sig_reg.assign(g, is_ready_search[0])
             creadys.append(shell_sig_reg)
         if ndram > 1:
@@ -204,9 +706,10 @@ def create_aws_shell():
                 shell_sig_reg = declare_reg_with_name(g, f"RESERVED_SH_DDR_is_ddr_ready{i}", 1, 1)
                 shell_sig_reg.assign(g, ddr_trained_ddrsig.get_array_subwire(i))
                 creadys.append(shell_sig_reg)
-        for cr in creadys[1:]:
-            creadys[0] = creadys[0] & cr
-        dram_trained_signal = creadys[0]
+        # balanced (and optionally pipelined) AND tree instead of a linear chain
+        dag = ExprDag("beethoven_ddr_ready")
+        root = dag.reduce('&', [dag.leaf(cr) for cr in creadys])
+        dram_trained_signal, _ = dag.materialize(g, root, int(opts.get('ready_tree_pipeline', 0)))
     else:
         dram_trained_signal = Wire("1'b1", 1, 1)
 
@@ -220,30 +723,48 @@ def create_aws_shell():
         wr = declare_wire_with_name(g, f"beethoven_{pc.name}{wnumber}_{apn}", pr.width, pr.ar_width)
         # find wires in the group and fuse them together
         cl_io_wiremap.update({pr: wr})
-        if get_class(pr.name) == PortClass.Master:
-            a = cl_mems[pr.get_axi_part_name()]
-            cl_mems[pr.get_axi_part_name()] = a + [wr]
+    # BeethovenTop connects to cl_io_wiremap. The shell gets bound to shell_side, which is the same wire unless
+    # something (e.g. register slices) has been put in between
+    shell_side = dict(cl_io_wiremap)
+    if accel_resets is not None:
+        for pc in shell_interfaces.values():
+            insert_axi_cdc(g, cl_ios.of_class(pc), shell_side, top_clock, accel_resets, resets,
+                           int(opts.get('accel_cdc_depth', 8)), opts.get('accel_cdc_bus_skew', '2.0'))
+        accel_clock_constraints(g)
+    bypass = opts.get('pcis_bypass', 'off')
+    if opts.get('ddr_interleave') is not None or bypass != 'off':
+        host = [p for p in shell_ports if 'dma_pcis' in p.name] if bypass != 'off' else None
+        if opts.get('ddr_interleave') is not None:
+            granularity, interleave = int(opts['ddr_interleave'], 0), True
+        else:
+            # without interleaving the host sees one region per channel, by default the size of an F1 DIMM
+            granularity, interleave = (16 << 30) if bypass == 'on' else int(bypass, 0), False
+        mem_id_width = search_for_part("awid", "ddr_", shell_ports)[0].width
+        g.metadata['ddr_address_map'] = insert_ddr_xbar(g, cl_ios.of_class(PortClass.Master), shell_side, resets,
+                                                        granularity, interleave, host, mem_id_width)
+    # register slices sit on the shell side of any clock crossing or crossbar
+    for iface, pc in shell_interfaces.items():
+        slrs = [x.strip() for x in opts.get(f"reg_slice_{iface}_slr", "").split(',') if x.strip() != ""]
+        insert_axi_reg_slices(g, cl_ios.of_class(pc), shell_side, int(opts.get(f"reg_slice_{iface}", 0)), resets,
+                              slrs)
+    if opts.get('perf_counters') is not None:
+        # counters watch the memory ports right where they meet the DDR
+        g.metadata['perf_counters'] = insert_perf_counters(g, cl_ios, shell_side, resets,
+                                                           int(opts['perf_counters'], 0))
+    for pr in cl_ios.of_class(PortClass.Master):
+        cl_mems[pr.get_axi_part_name()].append(shell_side[pr])
     # Shape the parts into the same shape as the ddr ports
     ddr_axis = {}
-    testy = list(map(lambda x: x.name, ddr_ios))
     for ddr in ddr_ios:
         axi_name = ddr.get_axi_part_name()
         if ddr.is_ddr_pin():
             if ddr.name in reserved_ddr_wires:
                 continue
-            if ddr.ar_width == 1 and ddr.width > 1:
-                ddr_wire = [declare_wire_with_name(g, f"beethoven_ddr_{i}_{axi_name}", 1, 1)
-                            for i in range(ddr.width)]
-            else:
-                ddr_wire = [declare_wire_with_name(g, f"beethoven_ddr_{i}_{axi_name}", ddr.width, 1)
-                            for i in range(ddr.ar_width)]
             ddr_fuse = declare_wire_with_name(g, f"beethoven_ddr_fuse_{axi_name}", ddr.width,
                                               ddr.ar_width)
-            for i, w in enumerate(ddr_wire):
-                if ddr.input:
-                    ddr_fuse.get_array_subwire(i).assign(g, w)
-                else:
-                    w.assign(g, ddr_fuse.get_array_subwire(i))
+            # bind straight to the fused elements, the netlist merges them back into one assign where possible
+            n_elements = ddr.width if ddr.ar_width == 1 and ddr.width > 1 else ddr.ar_width
+            ddr_wire = [ddr_fuse.get_array_subwire(i) for i in range(n_elements)]
 
             ddr_axis.update({axi_name: ddr_fuse})
             if cl_mems.get(axi_name) is None and ddr.input:
@@ -288,11 +809,8 @@ def create_aws_shell():
                         ddr_wire[i].assign(g, port)
 
     # Connect the Slave AXIL ports
-    for clio in cl_io_wiremap.keys():
-        wi = cl_io_wiremap[clio]
-        pc = get_class(clio.name)
-        if pc != PortClass.Slave:
-            continue
+    for clio in cl_ios.of_class(PortClass.Slave):
+        wi = shell_side[clio]
         p = search_for_part(clio.get_axi_part_name(), "ocl", shell_ports)
         if len(p) == 0:
             if clio.input:
@@ -304,41 +822,35 @@ def create_aws_shell():
         else:
             p.assign(g, wi)
 
-    for dma in filter(lambda x: 'dma' in x.name, cl_ios):
+    for dma in cl_ios.of_class(PortClass.DMA):
+        if bypass != 'off':
+            # dma_pcis goes to the DDR crossbar, BeethovenTop's DMA port stays idle
+            if dma.input:
+                shell_side[dma].tie_off(g)
+            continue
         # find matching beethoven logic port
         p = search_for_part(dma.get_axi_part_name(), "dma_pcis", shell_ports)
         if len(p) == 0:
             if dma.input:
-                cl_io_wiremap[dma].tie_off(g)
+                shell_side[dma].tie_off(g)
                 continue
             else:
                 continue
         if dma.input:
-            cl_io_wiremap[dma].assign(g, p[0])
-        else:
-            p[0].assign(g, cl_io_wiremap[dma])
-
-    g.write("BeethovenTop myTop(\n"
-            "\t.clock(clk),\n"
-            "\t.reset(active_high_rst),\n")
-    for i, pr in enumerate(cl_ios):
-        g.write(f"\t.{pr.name}({cl_io_wiremap[pr].name})")
-        if i == len(cl_ios) - 1:
-            g.write("\n")
+            shell_side[dma].assign(g, p[0])
         else:
-            g.write(",\n")
-    g.write(');\n')
+            p[0].assign(g, shell_side[dma])
+
+    top_conns = [("clock", top_clock, "input"), ("reset", top_reset, "input")]
+    for pr in cl_ios:
+        top_conns.append((pr.name, cl_io_wiremap[pr].name, pr.io_type))
+    g.instance("BeethovenTop", "myTop", top_conns)
 
     # Instantiate SH_DDR module
-    g.write(f"// DDR controller instantiation\n"
-            f"sh_ddr #(.DDR_A_PRESENT({bool_to_int(ndram > 1)}),"
-            f" .DDR_B_PRESENT({bool_to_int(ndram > 2)}),"
-            f" .DDR_D_PRESENT({bool_to_int(ndram > 3)}))\n"
-            f"\tSH_DDR(\n"
-            f".clk(clk),\n"
-            f".rst_n(sync_rst_n),\n"
-            f".stat_clk(clk),\n"
-            f".stat_rst_n(sync_rst_n),\n")
+    ddr_conns = [("clk", "clk", "input"),
+                 ("rst_n", "sync_rst_n", "input"),
+                 ("stat_clk", "clk", "input"),
+                 ("stat_rst_n", "sync_rst_n", "input")]
     # Now we add DDR ports
     for port in ddr_ios:
         if port.name[:2] == 'M_' or 'CLK' in port.name or 'RST' in port.name:
@@ -349,43 +861,34 @@ def create_aws_shell():
             assert len(p) == 1
             p = p[0]
             if p.output or p.inout:
-                g.write(f".{port.name}({p.name}),\n")
+                ddr_conns.append((port.name, p.name, port.io_type))
             else:
-                g.write(f".{p.name}({port.name}),\n")
+                ddr_conns.append((p.name, port.name, port.io_type))
             continue
         assert not port.inout
         if port.name in reserved_ddr_wires:
-            g.write(f".{port.name}({reserved_ddr_map[port].name}),\n")
+            ddr_conns.append((port.name, reserved_ddr_map[port].name, port.io_type))
             continue
         fuse = ddr_axis[port.get_axi_part_name()]
         assert fuse is not None
-        g.write(f".{port.name}({fuse.name}),\n")
-    # write signals that go straight to shell (DDR pins)
+        ddr_conns.append((port.name, fuse.name, port.io_type))
+    # signals that go straight to shell (DDR pins)
     for letter, number in [('A', '0'), ('B', '1'), ('D', '3')]:
-        if letter != 'A':
-            g.write(",\n")
-        g.write(f".CLK_300M_DIMM{number}_DP(CLK_300M_DIMM{number}_DP),\n"
-                f".CLK_300M_DIMM{number}_DN(CLK_300M_DIMM{number}_DN),\n"
-                f".M_{letter}_ACT_N(M_{letter}_ACT_N),\n"
-                f".M_{letter}_MA(M_{letter}_MA),\n"
-                f".M_{letter}_BA(M_{letter}_BA),\n"
-                f".M_{letter}_BG(M_{letter}_BG),\n"
-                f".M_{letter}_CKE(M_{letter}_CKE),\n"
-                f".M_{letter}_ODT(M_{letter}_ODT),\n"
-                f".M_{letter}_CS_N(M_{letter}_CS_N),\n"
-                f".M_{letter}_CLK_DN(M_{letter}_CLK_DN),\n"
-                f".M_{letter}_CLK_DP(M_{letter}_CLK_DP),\n"
-                f".M_{letter}_PAR(M_{letter}_PAR),\n"
-                f".M_{letter}_DQ(M_{letter}_DQ),\n"
-                f".M_{letter}_ECC(M_{letter}_ECC),\n"
-                f".M_{letter}_DQS_DP(M_{letter}_DQS_DP),\n"
-                f".M_{letter}_DQS_DN(M_{letter}_DQS_DN),\n"
-                f".cl_RST_DIMM_{letter}_N(cl_RST_DIMM_{letter}_N)")
-    g.write(");\n")
-    list(filter(lambda x: x.name == 'cl_sh_id0', shell_ports))[0].assign_constant(g, "`CL_SH_ID0")
-    list(filter(lambda x: x.name == 'cl_sh_id1', shell_ports))[0].assign_constant(g, "`CL_SH_ID1")
-    list(filter(lambda x: x.name == 'cl_sh_status1', shell_ports))[0].assign_constant(g, "`CL_VERSION")
-    g.write("// begin tie-offs\n")
+        pins = [f"CLK_300M_DIMM{number}_DP", f"CLK_300M_DIMM{number}_DN"] + \
+               [f"M_{letter}_{pin}" for pin in ['ACT_N', 'MA', 'BA', 'BG', 'CKE', 'ODT', 'CS_N', 'CLK_DN', 'CLK_DP',
+                                                'PAR', 'DQ', 'ECC', 'DQS_DP', 'DQS_DN']] + \
+               [f"cl_RST_DIMM_{letter}_N"]
+        for pin in pins:
+            ddr_port = ddr_ios.get(pin)
+            ddr_conns.append((pin, pin, None if ddr_port is None else ddr_port.io_type))
+    g.write("// DDR controller instantiation\n")
+    g.instance("sh_ddr", "SH_DDR", ddr_conns,
+               params=f"#(.DDR_A_PRESENT({bool_to_int(ndram > 1)}),"
+                      f" .DDR_B_PRESENT({bool_to_int(ndram > 2)}),"
+                      f" .DDR_D_PRESENT({bool_to_int(ndram > 3)}))")
+    shell_ports.get('cl_sh_id0').assign_constant(g, "`CL_SH_ID0")
+    shell_ports.get('cl_sh_id1').assign_constant(g, "`CL_SH_ID1")
+    shell_ports.get('cl_sh_status1').assign_constant(g, "`CL_VERSION")
     for pwire in shell_ports:
         lower = pwire.name.lower()
         if pwire.name[:2] == 'M_' or lower.find('ddr') != -1 \
@@ -399,18 +902,18 @@ def create_aws_shell():
         if pwire.output and pwire.occupancy < pwire.ar_width:
             pwire.tie_off(g, set_to)
 
-    g.write("// begin secondary tie-offs\n")
-    # Do tie-offs
+    return g
 
-    g.write("\nendmodule\n")
 
-    g.close()
+# PCI IDs of the application PF, CL_SH_ID0 in cl_id_defines.vh
+cl_vendor_id = 0x1D0F
+cl_device_id = 0xF001
 
 
 def write_id_defines():
     with open("design/cl_id_defines.vh", 'w') as f:
         f.write("`define CL_NAME beethoven_aws\n"
-                "`define CL_SH_ID0 32'hF001_1D0F\n"
+                f"`define CL_SH_ID0 32'h{cl_device_id:04X}_{cl_vendor_id:04X}\n"
                 "`define CL_SH_ID1 32'h1D51_FEDC\n")
 
 
@@ -453,12 +956,17 @@ def create_synth_script():
         o.write(whole_file)
 
 
-def copy_dcp_scripts():
+def copy_dcp_scripts(opts=None):
     os.system(f"cp {HOME}/bin/aws/src/*dcp* build/scripts/")
+    # beethoven.cfg can change the default clock recipes (e.g. to speed up the clock accel_clock points at)
+    opts = opts or {}
+    for group in ['a', 'b', 'c']:
+        recipe = opts.get(f"clock_recipe_{group}")
+        if recipe is not None:
+            os.system(f"sed -i -E 's/^clock_recipe_{group}=.*/clock_recipe_{group}={recipe}/' "
+                      f"build/scripts/aws_build_dcp_from_cl.sh")
 
 
 def move_sources_to_design():
     os.system(f"cp -r generated-src/* design/")
-    with open("design/beethoven_aws.sv", "a") as f:
-        with open("generated-src/beethoven.sv", "r") as f2:
-            f.write(f2.read())
+    util.append_file("design/beethoven_aws.sv", "generated-src/beethoven.sv")
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# A small task graph for aws-gen-build. Each task declares the files it reads and writes and the option values it
+# depends on. A task runs when one of those changed since it last ran, when one of its outputs was changed or removed
+# by something else, or when a task it depends on changed its outputs. Otherwise it is skipped, independent tasks run
+# in parallel. Files are identified by content, a size and mtime match with the previous run stands in for re-hashing.
+# Outputs that a task rewrote with the same content get their old mtime back, so that tools downstream don't see a
+# change where there is none.
+
+state_file = ".beethoven_build_state.json"
+
+
+def tree(root, keep=lambda f: True):
+    # every file under root, sorted
+    files = []
+    for d, dirs, fs in os.walk(root):
+        dirs.sort()
+        files += [f"{d}/{f}" for f in sorted(fs) if keep(f)]
+    return files
+
+
+class Task:
+    def __init__(self, name, fn, inputs=(), outputs=(), values=(), deps=()):
+        # inputs and outputs are paths (files or directories) or a function returning them, evaluated when needed
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs
+        self.outputs = outputs
+        self.values = values
+        self.deps = list(deps)
+
+    def input_paths(self):
+        return sorted(self.inputs() if callable(self.inputs) else self.inputs)
+
+    def output_paths(self):
+        return sorted(self.outputs() if callable(self.outputs) else self.outputs)
+
+
+class Graph:
+    def __init__(self, state=state_file):
+        self.tasks = {}
+        self.state_path = state
+        self.lock = threading.Lock()
+        self.state = {'tasks': {}, 'files': {}}
+        if os.path.exists(state):
+            try:
+                with open(state) as f:
+                    self.state = json.load(f)
+            except ValueError:
+                pass
+
+    def task(self, name, fn, **kwargs):
+        assert name not in self.tasks, f"task {name} defined twice"
+        for d in kwargs.get('deps', ()):
+            assert d in self.tasks, f"task {name} depends on {d}, which is not defined (yet)"
+        self.tasks[name] = Task(name, fn, **kwargs)
+
+    def digest(self, path):
+        # content hash of a file, or None if it does not exist
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            known = self.state['files'].get(path)
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        with self.lock:
+            self.state['files'][path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def digests(self, paths):
+        # {file: digest} with directories expanded into their files
+        out = {}
+        for p in paths:
+            if os.path.isdir(p):
+                for f in tree(p):
+                    out[f] = self.digest(f)
+            else:
+                out[p] = self.digest(p)
+        return out
+
+    def fingerprint(self, t):
+        h = hashlib.sha256()
+        for v in t.values:
+            h.update(str(v).encode() + b"\0")
+        return {'values': h.hexdigest(), 'inputs': self.digests(t.input_paths())}
+
+    def reason(self, t, changed):
+        """
+        Why t has to run, or None if it is up to date. changed holds the tasks that changed their outputs in this
+        invocation (for a dry run, the ones that would run).
+        """
+        prev = self.state['tasks'].get(t.name)
+        if prev is None:
+            return "never ran"
+        for d in t.deps:
+            if d in changed:
+                return f"{d} changed"
+        now = self.fingerprint(t)
+        if now['values'] != prev['values']:
+            return "options changed"
+        for p in sorted(set(now['inputs']) | set(prev['inputs'])):
+            if now['inputs'].get(p) != prev['inputs'].get(p):
+                return f"{p} changed"
+        for p, d in prev['outputs'].items():
+            if self.digest(p) != d:
+                return f"output {p} {'is missing' if d is not None and not os.path.exists(p) else 'changed'}"
+        return None
+
+    def order(self):
+        # definition order is a topological order, task() only accepts dependencies that are already defined
+        return list(self.tasks.values())
+
+    def plan(self):
+        # [(task, reason or None)] for a dry run
+        ran = set()
+        out = []
+        for t in self.order():
+            r = self.reason(t, ran)
+            if r is not None:
+                ran.add(t.name)
+            out.append((t, r))
+        return out
+
+    def _run_task(self, t):
+        # Run t and keep the mtime of outputs it rewrote without changing them. Returns its fingerprint and whether
+        # any output changed, tasks after it only need to run if one did.
+        before = {}
+        for p in t.output_paths():
+            for f in (tree(p) if os.path.isdir(p) else [p]):
+                if os.path.isfile(f):
+                    before[f] = (self.digest(f), os.stat(f).st_mtime_ns)
+        fp = self.fingerprint(t)
+        t.fn()
+        for f, (d, mtime) in before.items():
+            if os.path.isfile(f) and self.digest(f) == d:
+                st = os.stat(f)
+                if st.st_mtime_ns != mtime:
+                    os.utime(f, ns=(st.st_atime_ns, mtime))
+                    with self.lock:
+                        self.state['files'][f] = [st.st_size, mtime, d]
+        after = self.digests(t.output_paths())
+        changed = {f: d for f, d in after.items() if d is not None} != {f: d for f, (d, _) in before.items()}
+        return fp, changed
+
+    def run(self, jobs=None, explain=False, force=False):
+        """
+        Run what is out of date, as many independent tasks at once as jobs allows. Returns the names of the tasks
+        that ran.
+        """
+        ran = set()
+        changed = set()
+        done = set()
+        pending = self.order()
+        fingerprints = {}
+        running = {}
+        failed = None
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            while pending or running:
+                for t in [t for t in pending if all(d in done for d in t.deps)]:
+                    pending.remove(t)
+                    r = "forced" if force else self.reason(t, changed)
+                    if r is None:
+                        if explain:
+                            print(f"[build] {t.name}: up to date")
+                        done.add(t.name)
+                        continue
+                    if explain:
+                        print(f"[build] {t.name}: running, {r}")
+                    ran.add(t.name)
+                    running[pool.submit(self._run_task, t)] = t
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    t = running.pop(fut)
+                    try:
+                        fingerprints[t.name], outputs_changed = fut.result()
+                    except Exception as e:
+                        # let what is running finish, start nothing new
+                        failed = failed or (t, e)
+                        pending = []
+                        continue
+                    done.add(t.name)
+                    if outputs_changed:
+                        changed.add(t.name)
+        # outputs are recorded once everything ran, a later task may edit what an earlier one wrote
+        for t in self.order():
+            if t.name not in done:
+                # failed, or not reached after a failure: run it next time
+                self.state['tasks'].pop(t.name, None)
+                continue
+            fp = fingerprints.get(t.name, self.state['tasks'].get(t.name))
+            self.state['tasks'][t.name] = {'values': fp['values'], 'inputs': fp['inputs'],
+                                           'outputs': self.digests(t.output_paths())}
+        # forget files that no task reads or writes any more
+        used = set()
+        for s in self.state['tasks'].values():
+            used |= set(s['inputs']) | set(s['outputs'])
+        self.state['files'] = {p: v for p, v in self.state['files'].items() if p in used}
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+        if failed is not None:
+            print(f"[build] {failed[0].name} failed")
+            raise failed[1]
+        return ran
@@ -0,0 +1,163 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import timing_report
+
+# Multi-strategy build sweeps. aws-gen-build lays out one CL directory per variant under sweep/, each with its own
+# build/ and a symlink to the shared design/, and aws-sweep runs them side by side and keeps the one with the best WNS.
+
+sweep_dir = "sweep"
+
+# Each variant is an HDK strategy plus optional overrides of the directives that strategy sets. Vivado has no placer
+# seed, so directives are what makes the runs explore different solutions.
+default_variants = [
+    {'strategy': 'TIMING'},
+    {'strategy': 'DEFAULT'},
+    {'strategy': 'EXPLORE'},
+    {'strategy': 'CONGESTION'},
+    {'strategy': 'TIMING', 'place_directive': 'ExtraNetDelay_high'},
+    {'strategy': 'TIMING', 'place_directive': 'AltSpreadLogic_high', 'route_directive': 'AggressiveExplore'},
+    {'strategy': 'EXPLORE', 'synth_directive': 'PerformanceOptimized'},
+    {'strategy': 'TIMING', 'place_directive': 'ExtraTimingOpt', 'phys_directive': 'AggressiveExplore'},
+    {'strategy': 'CONGESTION', 'place_directive': 'SSI_SpreadLogic_high'},
+    {'strategy': 'EXPLORE', 'synth_directive': 'AlternateRoutability', 'route_directive': 'NoTimingRelaxation'},
+]
+override_names = ['synth_directive', 'opt_directive', 'place_directive', 'phys_directive', 'route_directive']
+
+# create_dcp_from_cl.tcl runs Vivado with maxThreads 8 and the HDK asks for 30GB per build
+threads_per_build = 8
+memory_per_build_kb = 30000000
+
+
+def variant_name(i, variant):
+    return f"v{i}_{variant['strategy'].lower()}" + "".join(
+        f"_{variant[k]}" for k in override_names if k in variant)
+
+
+def parse_variant(spec):
+    # "TIMING" or "TIMING:place_directive=ExtraNetDelay_high:route_directive=Explore"
+    fields = spec.split(":")
+    variant = {'strategy': fields[0].upper()}
+    for f in fields[1:]:
+        k, v = f.split("=", 1)
+        if k not in override_names:
+            raise Exception(f"Unknown sweep override '{k}', expected one of {', '.join(override_names)}")
+        variant[k] = v
+    return variant
+
+
+def create_sweep(n, opts):
+    """
+    Lay out `n` build variants under sweep/ next to the regular build/ directory created by aws-gen-build.
+    `sweep_variants` in opts (comma-separated, see parse_variant) replaces the built-in variant list.
+    """
+    if opts.get('sweep_variants') is not None:
+        variants = [parse_variant(s) for s in opts['sweep_variants'].split(",")]
+    else:
+        variants = default_variants
+    if n > len(variants):
+        print(f"Only {len(variants)} sweep variants are defined, building {len(variants)} instead of {n}")
+    os.system(f"rm -rf {sweep_dir} && mkdir -p {sweep_dir}")
+    design = os.path.abspath("design")
+    manifest = []
+    for i, variant in enumerate(variants[:n]):
+        d = f"{sweep_dir}/{variant_name(i, variant)}"
+        os.system(f"mkdir -p {d}/build/checkpoints/to_aws {d}/build/reports && "
+                  f"cp -r build/scripts build/constraints {d}/build/ && ln -s {design} {d}/design")
+        with open(f"{d}/build/scripts/build_overrides.tcl", 'w') as f:
+            f.write("# sourced by create_dcp_from_cl.tcl after the strategy\n")
+            for k in override_names:
+                if k in variant:
+                    f.write(f"set {k} {variant[k]}\n")
+        manifest.append(dict(name=os.path.basename(d), cl_dir=os.path.abspath(d), **variant))
+    with open(f"{sweep_dir}/variants.json", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Created {len(manifest)} build variants in {sweep_dir}/. Run `aws-sweep` to build them.")
+
+
+def get_instance_memory_kb():
+    with open("/proc/meminfo") as f:
+        for ln in f.readlines():
+            if ln.startswith("MemTotal"):
+                return int(ln.split()[1])
+    return memory_per_build_kb
+
+
+def default_jobs():
+    # as many builds as there are cores and memory for, but always at least one
+    return max(1, min(os.cpu_count() // threads_per_build, get_instance_memory_kb() // memory_per_build_kb))
+
+
+def variant_timing(variant):
+    reports = glob_reports(variant['cl_dir'], "SH_CL_final_timing_summary.rpt")
+    if len(reports) == 0:
+        return None
+    # newest run of this variant
+    report = timing_report.parse_timing_report(reports[-1])
+    if report['summary'] is None or report['summary']['wns'] is None:
+        return None
+    timestamp = os.path.basename(reports[-1]).split(".")[0]
+    timing_report.record_build(report, timestamp, os.getcwd(), reports[-1])
+    return {'report': reports[-1], 'timestamp': timestamp, 'wns': report['summary']['wns'],
+            'tns': report['summary']['tns'], 'whs': report['summary']['whs']}
+
+
+def glob_reports(cl_dir, suffix):
+    rpt = f"{cl_dir}/build/reports"
+    if not os.path.isdir(rpt):
+        return []
+    return sorted(f"{rpt}/{x}" for x in os.listdir(rpt) if x.endswith(suffix))
+
+
+def run_variant(variant, build_args):
+    scripts = f"{variant['cl_dir']}/build/scripts"
+    start = time.time()
+    print(f"[sweep] starting {variant['name']}")
+    ret = os.system(f"cd {scripts} && CL_DIR={variant['cl_dir']} ./aws_build_dcp_from_cl.sh -foreground "
+                    f"-strategy {variant['strategy']} {build_args} > sweep.out 2>&1")
+    print(f"[sweep] {variant['name']} finished in {(time.time() - start) / 3600:.1f}h "
+          f"({'ok' if ret == 0 else f'exit status {ret}'})")
+    return ret
+
+
+def pick_winner(variants):
+    # best WNS, ties go to the better TNS. Writes sweep/results.json and sweep/winner.json.
+    results = []
+    for v in variants:
+        results.append(dict(name=v['name'], cl_dir=v['cl_dir'], strategy=v['strategy'], timing=variant_timing(v)))
+    done = [r for r in results if r['timing'] is not None]
+    with open(f"{sweep_dir}/results.json", 'w') as f:
+        json.dump(results, f, indent=2)
+    for r in sorted(done, key=lambda r: (r['timing']['wns'], r['timing']['tns']), reverse=True):
+        print(f"  {r['name']:<60} WNS {r['timing']['wns']:8.3f}  TNS {r['timing']['tns']:10.3f}")
+    for r in results:
+        if r['timing'] is None:
+            print(f"  {r['name']:<60} no timing summary (failed or still running)")
+    if len(done) == 0:
+        if os.path.exists(f"{sweep_dir}/winner.json"):
+            os.remove(f"{sweep_dir}/winner.json")
+        return None
+    winner = max(done, key=lambda r: (r['timing']['wns'], r['timing']['tns']))
+    with open(f"{sweep_dir}/winner.json", 'w') as f:
+        json.dump(winner, f, indent=2)
+    return winner
+
+
+def load_variants():
+    with open(f"{sweep_dir}/variants.json") as f:
+        return json.load(f)
+
+
+def run_sweep(jobs=None, build_args=""):
+    """
+    Build every variant in sweep/ on a pool of `jobs` concurrent Vivado runs and pick the winner. build_args is
+    passed to every aws_build_dcp_from_cl.sh invocation (clock recipes etc.).
+    """
+    variants = load_variants()
+    jobs = jobs or default_jobs()
+    jobs = min(jobs, len(variants))
+    print(f"Building {len(variants)} variants, {jobs} at a time")
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(lambda v: run_variant(v, build_args), variants))
+    return pick_winner(variants)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import util
+
+# Content-addressed store of finished builds. The key covers everything that goes into a build: the design sources
+# (beethoven_aws.sv and the generated sources under design/), the constraints, the build scripts, the shell version
+# and the arguments aws_build_dcp_from_cl.sh was called with. A hit restores the checkpoints and reports of the
+# earlier build instead of running Vivado again.
+
+cache_dir = f"{util.beethoven_cache}/dcp"
+default_size_gb = 200
+# files under build/scripts that influence the result, the rest are logs and Vivado's scratch files
+script_types = ('.tcl', '.sh', '.xdc', '.f', '.vh')
+
+
+def size_cap():
+    return int(float(os.environ.get("BEETHOVEN_DCP_CACHE_GB", default_size_gb)) * (1 << 30))
+
+
+def _hash_file(h, fname):
+    with open(fname, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            h.update(chunk)
+
+
+def _tree(root, keep=lambda f: True):
+    # every file under root as a path relative to root, sorted so that the key does not depend on listing order
+    files = []
+    for d, dirs, fs in os.walk(root):
+        dirs[:] = [x for x in dirs if not x.startswith('.')]
+        files += [os.path.relpath(f"{d}/{f}", root) for f in fs if keep(f)]
+    return sorted(files)
+
+
+def build_key(cl_dir, build_args=""):
+    h = hashlib.sha256()
+    inputs = [("design", lambda f: True), ("build/constraints", lambda f: True),
+              ("build/scripts", lambda f: f.endswith(script_types))]
+    for sub, keep in inputs:
+        for rel in _tree(f"{cl_dir}/{sub}", keep):
+            h.update(f"{sub}/{rel}\0".encode())
+            _hash_file(h, f"{cl_dir}/{sub}/{rel}")
+    for env in ['HDK_SHELL_DIR', 'HDK_DIR']:
+        for version in ['shell_version.txt', 'hdk_version.txt']:
+            fname = f"{os.environ.get(env, '')}/{version}"
+            if os.path.exists(fname):
+                _hash_file(h, fname)
+    h.update(os.environ.get("VIVADO_TOOL_VERSION", "").encode())
+    h.update(" ".join(build_args.split()).encode())
+    return h.hexdigest()
+
+
+def _entries():
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for key in os.listdir(cache_dir):
+        meta = f"{cache_dir}/{key}/meta.json"
+        if os.path.exists(meta):
+            with open(meta) as f:
+                entries.append(json.load(f))
+    return entries
+
+
+def _touch(entry):
+    entry['last_used'] = time.time()
+    with open(f"{cache_dir}/{entry['key']}/meta.json", 'w') as f:
+        json.dump(entry, f, indent=2)
+
+
+def _place(src, dst):
+    # hard links when the cache is on the same filesystem, the checkpoints are GBs
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def lookup(key):
+    meta = f"{cache_dir}/{key}/meta.json"
+    if not os.path.exists(meta):
+        return None
+    with open(meta) as f:
+        return json.load(f)
+
+
+def fetch(cl_dir, key):
+    """
+    Restore a cached build into cl_dir/build. Returns the timestamp the build was made under, or None on a miss.
+    """
+    entry = lookup(key)
+    if entry is None:
+        return None
+    for rel in entry['files']:
+        os.makedirs(os.path.dirname(f"{cl_dir}/build/{rel}"), exist_ok=True)
+        _place(f"{cache_dir}/{key}/files/{rel}", f"{cl_dir}/build/{rel}")
+    _touch(entry)
+    return entry['timestamp']
+
+
+def store(cl_dir, key, timestamp):
+    # Store the outputs of the build `timestamp` in cl_dir/build under key, then evict down to the size cap
+    files = []
+    for sub in ['checkpoints', 'checkpoints/to_aws', 'reports']:
+        d = f"{cl_dir}/build/{sub}"
+        if os.path.isdir(d):
+            files += [f"{sub}/{f}" for f in sorted(os.listdir(d))
+                      if f.startswith(timestamp) and os.path.isfile(f"{d}/{f}")]
+    if not any(f.endswith("SH_CL_routed.dcp") for f in files):
+        print(f"No routed checkpoint for {timestamp} in {cl_dir}/build, not caching")
+        return None
+    tmp = f"{cache_dir}/.tmp-{key}-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    for rel in files:
+        os.makedirs(os.path.dirname(f"{tmp}/files/{rel}"), exist_ok=True)
+        _place(f"{cl_dir}/build/{rel}", f"{tmp}/files/{rel}")
+    entry = {'key': key, 'timestamp': timestamp, 'files': files, 'created': time.time(), 'last_used': time.time(),
+             'size': sum(os.path.getsize(f"{tmp}/files/{rel}") for rel in files), 'cl_dir': os.path.abspath(cl_dir)}
+    with open(f"{tmp}/meta.json", 'w') as f:
+        json.dump(entry, f, indent=2)
+    shutil.rmtree(f"{cache_dir}/{key}", ignore_errors=True)
+    os.rename(tmp, f"{cache_dir}/{key}")
+    evict(size_cap())
+    return entry
+
+
+def evict(cap):
+    # drop the least recently used builds until the store fits in cap bytes. Returns the evicted entries.
+    entries = sorted(_entries(), key=lambda e: e['last_used'])
+    total = sum(e['size'] for e in entries)
+    evicted = []
+    while total > cap and len(entries) > 0:
+        e = entries.pop(0)
+        shutil.rmtree(f"{cache_dir}/{e['key']}", ignore_errors=True)
+        total -= e['size']
+        evicted.append(e)
+    return evicted
+
+
+def list_entries():
+    # most recently used first
+    return sorted(_entries(), key=lambda e: e['last_used'], reverse=True)
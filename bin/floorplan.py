@@ -0,0 +1,298 @@
+import fnmatch
+import json
+import os
+import re
+import ooc_synth
+import utilization
+
+# SLR floorplanning of the accelerator cores. Every instance of a replicated core in generated-src/beethoven.sv is
+# given an SLR: the one of the DDR controller its memory traffic goes to if that SLR has room, otherwise the nearest
+# one that does. Resource estimates come from the hierarchical utilization report of the last build when there is one
+# and from the size of the RTL otherwise. The result is beethoven_floorplan.xdc, appended to the user's pnr
+# constraints by aws-gen-build, or with pblocks build/scripts/beethoven_floorplan.tcl, which create_dcp_from_cl.tcl
+# sources before placement.
+
+xdc_file = "beethoven_floorplan.xdc"
+tcl_file = "build/scripts/beethoven_floorplan.tcl"
+json_file = "beethoven_floorplan.json"
+top_instance = "myTop"
+# CL resources of one SLR of the F2 part (xcvu47p, 3 SLRs), used until a build reports what the CL can actually use
+default_capacity = {f"SLR{i}": {'LUT': 434560, 'FF': 869120, 'BRAM': 672, 'URAM': 320, 'DSP': 3008} for i in range(3)}
+# where the DDR controllers sit, by the shell's DDR names (see insert_ddr_xbar)
+default_ddr_slrs = {'A': "SLR0", 'B': "SLR1", 'C': "SLR1", 'D': "SLR2"}
+# without a utilization report, LUTs per line of elaborated RTL
+luts_per_line = 2
+
+
+def _slr_index(slr):
+    m = re.search(r"\d+", slr)
+    return int(m.group(0)) if m is not None else 0
+
+
+def core_instances(modules, cores, top="BeethovenTop", prefix=top_instance):
+    # [(instance path, core module)] of every core instance below top, in source order
+    names = ooc_synth.instance_names(modules)
+    out = []
+
+    def visit(module, path):
+        for child, inst in names.get(module, []):
+            if child in cores:
+                out.append((f"{path}/{inst}", child))
+            else:
+                visit(child, f"{path}/{inst}")
+
+    visit(top, prefix)
+    return out
+
+
+def rtl_estimates(modules, cores):
+    # {core: {resource: estimate}} from the elaborated number of RTL lines
+    names = ooc_synth.instance_names(modules)
+    size = {}
+
+    def lines(m):
+        if m not in size:
+            size[m] = modules[m].count("\n") + sum(lines(c) for c, _ in names[m])
+        return size[m]
+
+    return {c: dict(dict.fromkeys(utilization.resources, 0.0), LUT=lines(c) * luts_per_line) for c in cores}
+
+
+def estimates(cl_dir, modules, cores):
+    """
+    Per-core resources and where they come from: the last build's utilization report, for the cores it has, or the
+    RTL size.
+    """
+    est = rtl_estimates(modules, cores)
+    source = "RTL size"
+    build = utilization.latest_build(cl_dir) if os.path.isdir(f"{cl_dir}/build/reports") else None
+    if build is not None:
+        rows = utilization.parse_hierarchical(
+            f"{cl_dir}/build/reports/{build}.SH_CL_utilization_hierarchical.rpt")
+        measured = utilization.breakdown(rows, cores)['cores']
+        for core, c in measured.items():
+            est[core] = c['per_core']
+        if measured:
+            source = f"build {build}"
+    return est, source
+
+
+def capacity(cl_dir):
+    build = utilization.latest_build(cl_dir) if os.path.isdir(f"{cl_dir}/build/reports") else None
+    fname = f"{cl_dir}/build/reports/{build}.SH_CL_slr_capacity.txt"
+    if build is not None and os.path.exists(fname):
+        slrs, _ = utilization.parse_capacity(fname)
+        if slrs:
+            return slrs
+    return default_capacity
+
+
+def ddr_channels(cl_dir):
+    # NUM_DDR_CHANNELS of beethoven_hardware.h, like aws_tools.get_num_ddr_channels
+    with open(f"{cl_dir}/generated-src/beethoven_hardware.h") as f:
+        for ln in f:
+            if "NUM_DDR_CHANNELS" in ln:
+                return int(ln.strip().split()[-1])
+    return 0
+
+
+def ddr_homes(instances, opts, ddr_map, channels=1):
+    """
+    SLR of the DDR controller each core instance talks to, None when the channels are interleaved (every core uses
+    all of them). By default the cores are split into contiguous blocks, one per channel, in instance order.
+    `floorplan_core_ddr` overrides that with <instance glob>=<channel>,... .
+    """
+    if ddr_map is not None and ddr_map['mode'] == 'interleave':
+        return [None] * len(instances)
+    # without the crossbar, BeethovenTop's memory ports are wired to the shell's DDRs in this order
+    ddr = ddr_map['ddr'] if ddr_map is not None else ['C', 'A', 'B', 'D'][:channels]
+    n = len(ddr)
+    if n == 0:
+        return [None] * len(instances)
+    slrs = dict(default_ddr_slrs)
+    for kv in opts.get('floorplan_ddr_slrs', "").split(","):
+        if "=" in kv:
+            k, v = kv.split("=", 1)
+            slrs[k.strip()] = v.strip() if v.strip().startswith("SLR") else f"SLR{v.strip()}"
+    rules = [kv.split("=", 1) for kv in opts.get('floorplan_core_ddr', "").split(",") if "=" in kv]
+    homes = []
+    for i, (path, _) in enumerate(instances):
+        channel = i * n // len(instances)
+        for pattern, ch in rules:
+            if fnmatch.fnmatch(path, pattern.strip()):
+                channel = int(ch)
+        homes.append(slrs.get(ddr[channel]) if channel < n else None)
+    return homes
+
+
+def assign(instances, est, cap, homes, max_util, balance):
+    """
+    {instance path: SLR} and the resulting load per SLR as a fraction of each resource. An instance goes to its home
+    SLR, or the nearest one, as long as that stays within `balance` of the average load and below max_util. When no
+    SLR qualifies it goes wherever the load ends up lowest.
+    """
+    load = {slr: dict.fromkeys(utilization.resources, 0.0) for slr in cap}
+
+    def fill(slr, extra):
+        return max((load[slr][r] + extra[r]) / cap[slr][r] for r in utilization.resources if cap[slr].get(r, 0) > 0)
+
+    demand = {r: sum(est[m][r] for _, m in instances) for r in utilization.resources}
+    total = {r: sum(c.get(r, 0) for c in cap.values()) for r in utilization.resources}
+    mean = max(demand[r] / total[r] for r in utilization.resources if total[r] > 0)
+    target = min(max_util, mean + balance)
+    placed = {}
+    # largest first, they are the hardest to fit
+    order = sorted(range(len(instances)), key=lambda i: -max(est[instances[i][1]][r] / max(total[r], 1)
+                                                             for r in utilization.resources))
+    for i in order:
+        path, module = instances[i]
+        home = homes[i]
+        if home is not None:
+            candidates = sorted(cap, key=lambda s: (abs(_slr_index(s) - _slr_index(home)), fill(s, est[module])))
+        else:
+            candidates = sorted(cap, key=lambda s: fill(s, est[module]))
+        slr = next((s for s in candidates if fill(s, est[module]) <= target),
+                   min(cap, key=lambda s: fill(s, est[module])))
+        placed[path] = slr
+        for r in utilization.resources:
+            load[slr][r] += est[module][r]
+    fractions = {slr: {r: load[slr][r] / cap[slr][r] if cap[slr].get(r, 0) > 0 else 0.0
+                       for r in utilization.resources} for slr in cap}
+    return placed, fractions
+
+
+def _cell(path):
+    return f"[get_cells -hierarchical -filter {{NAME =~ */{path}}}]"
+
+
+def write_xdc(instances, placed, fname):
+    # USER_SLR_ASSIGNMENT steers the placer without fencing anything off
+    with open(fname, 'w') as f:
+        f.write("# generated by aws-gen-build (floorplan.py), core instance -> SLR\n")
+        for path, _ in instances:
+            f.write(f"set_property USER_SLR_ASSIGNMENT {placed[path]} {_cell(path)}\n")
+
+
+def write_tcl(instances, placed, fname, parent=None):
+    """
+    Pin the cores to their SLR with one pblock per SLR. The CL sits in the shell's reconfigurable partition, so the
+    pblocks are children of the pblock around it (or of `parent`) and only get the part of their SLR inside it. That
+    takes a site intersection, which XDC cannot express, hence a hook script rather than constraints.
+    """
+    with open(fname, 'w') as f:
+        f.write("# generated by aws-gen-build (floorplan.py), core instance -> SLR pblock inside the CL's pblock\n")
+        if parent is not None:
+            f.write(f"set beethoven_parent [get_pblocks -quiet {parent}]\n")
+        else:
+            f.write(f"set beethoven_cl [get_cells -quiet -hierarchical -filter "
+                    f"{{ORIG_REF_NAME == {utilization.cl_module} || REF_NAME == {utilization.cl_module}}}]\n"
+                    f"set beethoven_parent [get_pblocks -quiet -of_objects $beethoven_cl]\n")
+        what = f"named {parent}" if parent is not None else f"around {utilization.cl_module}"
+        f.write("if {[llength $beethoven_parent] != 1} {\n"
+                f"   error \"Beethoven floorplan: no single pblock {what} to nest the core pblocks in, "
+                f"set floorplan_parent in beethoven.cfg\"\n"
+                "}\n"
+                "set beethoven_parent_sites [get_sites -of_objects $beethoven_parent]\n")
+        for slr in sorted(set(placed.values()), key=_slr_index):
+            pb = f"pblock_beethoven_{slr}"
+            f.write(f"set beethoven_sites [struct::set intersect [get_sites -of_objects [get_slrs {slr}]] "
+                    f"$beethoven_parent_sites]\n"
+                    "if {[llength $beethoven_sites] == 0} {\n"
+                    f"   error \"Beethoven floorplan: the CL's pblock has no sites in {slr}\"\n"
+                    "}\n"
+                    f"create_pblock {pb}\n"
+                    f"resize_pblock [get_pblocks {pb}] -add $beethoven_sites\n"
+                    f"set_property PARENT [get_property NAME $beethoven_parent] [get_pblocks {pb}]\n")
+            for path, _ in instances:
+                if placed[path] == slr:
+                    f.write(f"add_cells_to_pblock [get_pblocks {pb}] {_cell(path)}\n")
+
+
+def beethoven_placed(fname):
+    # cell patterns that a constraint file puts into pblocks or assigns to an SLR
+    patterns = []
+    if not os.path.exists(fname):
+        return patterns
+    with open(fname) as f:
+        for ln in f:
+            if "add_cells_to_pblock" not in ln and "USER_SLR_ASSIGNMENT" not in ln:
+                continue
+            for cells in re.findall(r"\[get_cells\s+([^\]]*)\]", ln):
+                m = re.search(r"NAME\s*=~\s*([^\s}]+)", cells)
+                if m is not None:
+                    patterns.append(m.group(1))
+                else:
+                    patterns += [c for c in re.sub(r"[{}]", " ", cells).split() if not c.startswith("-")]
+    return patterns
+
+
+def conflicts(path, patterns):
+    """
+    Whether one of `patterns` covers instance path, one of its parents or something inside it. Beethoven writes its
+    paths from BeethovenTop down, so they are matched against every tail of path.
+    """
+    parts = path.split("/")
+    # path and its parents, each with every leading part dropped
+    above = ["/".join(parts[i:j]) for j in range(1, len(parts) + 1) for i in range(j)]
+    tails = ["/".join(parts[i:]) for i in range(len(parts))]
+    for p in patterns:
+        inner = p.lstrip("*").lstrip("/")
+        if any(fnmatch.fnmatch(t, p) for t in above) or any(inner.startswith(t + "/") for t in tails):
+            return True
+    return False
+
+
+def clear(cl_dir="."):
+    for fname in [xdc_file, json_file, tcl_file]:
+        if os.path.exists(f"{cl_dir}/{fname}"):
+            os.remove(f"{cl_dir}/{fname}")
+
+
+def plan(cl_dir, opts):
+    """
+    Floorplan the cores of generated-src/beethoven.sv and write beethoven_floorplan.xdc (and .json, for a look at the
+    result). `floorplan on` assigns SLRs, `floorplan pblock` instead fences the cores in with one pblock per SLR,
+    nested in the CL's pblock (or floorplan_parent), through build/scripts/beethoven_floorplan.tcl.
+    """
+    with open(f"{cl_dir}/generated-src/beethoven.sv") as f:
+        _, modules = ooc_synth.split_modules(f.read())
+    # whole cores, a core split over SLRs pays for the crossings inside it
+    cores = set(ooc_synth.find_replicated(modules, int(opts.get('floorplan_min_instances', 2)),
+                                          int(opts.get('floorplan_min_lines', 1000))))
+    instances = core_instances(modules, cores)
+    clear(cl_dir)
+    # Beethoven's own floorplan (DeviceContext) ends up in the same cl_pnr_user.xdc, what it places is left to it
+    pinned = beethoven_placed(f"{cl_dir}/generated-src/user_constraints.xdc")
+    skipped = [p for p, _ in instances if conflicts(p, pinned)]
+    if skipped:
+        print(f"Floorplan: {len(skipped)} cores are already placed by generated-src/user_constraints.xdc, "
+              f"leaving them out: {', '.join(skipped[:4])}{', ...' if len(skipped) > 4 else ''}")
+        instances = [(p, m) for p, m in instances if p not in skipped]
+    if not instances:
+        print("Floorplan: no replicated cores found, leaving placement to Vivado")
+        return None
+    ddr_map = None
+    if os.path.exists(f"{cl_dir}/generated-src/beethoven_ddr_map.json"):
+        with open(f"{cl_dir}/generated-src/beethoven_ddr_map.json") as f:
+            ddr_map = json.load(f)
+    est, source = estimates(cl_dir, modules, cores)
+    cap = capacity(cl_dir)
+    homes = ddr_homes(instances, opts, ddr_map, ddr_channels(cl_dir))
+    placed, fractions = assign(instances, est, cap, homes, float(opts.get('floorplan_max_util', 0.7)),
+                               float(opts.get('floorplan_balance', 0.1)))
+    if opts.get('floorplan') == 'pblock':
+        write_tcl(instances, placed, f"{cl_dir}/{tcl_file}", opts.get('floorplan_parent'))
+    else:
+        write_xdc(instances, placed, f"{cl_dir}/{xdc_file}")
+    result = {'estimates': source, 'capacity': cap,
+              'instances': [{'path': p, 'module': m, 'home': h, 'slr': placed[p]}
+                            for (p, m), h in zip(instances, homes)],
+              'load': fractions}
+    with open(f"{cl_dir}/{json_file}", 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Floorplan of {len(instances)} cores (estimates from {source}):")
+    for slr in sorted(cap, key=_slr_index):
+        n = sum(1 for s in placed.values() if s == slr)
+        busiest = max(fractions[slr], key=fractions[slr].get)
+        print(f"  {slr}: {n} cores, {fractions[slr][busiest] * 100:.0f}% of {busiest}")
+    return result
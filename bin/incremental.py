@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import shutil
+import ooc_synth
+import timing_report
+
+# Incremental implementation. The last routed checkpoint of a design that met timing is kept as reference in
+# build/checkpoints/reference together with a per-module fingerprint of the RTL it was built from. aws-gen-build
+# writes build/scripts/incremental.tcl, which create_dcp_from_cl.tcl sources before placement, unless too much of
+# the design changed since. Vivado's -auto_incremental falls back to the default flow on its own when the netlists
+# match too poorly.
+
+ref_dir = "build/checkpoints/reference"
+default_max_change = 0.3
+
+
+def fingerprint(cl_dir):
+    # {module: [hash, lines]} over the top-level source and the out-of-context cores
+    sources = [f"{cl_dir}/design/beethoven_aws.sv"]
+    ooc = f"{cl_dir}/design/{ooc_synth.ooc_dir}"
+    if os.path.isdir(ooc):
+        sources += [f"{ooc}/{f}" for f in sorted(os.listdir(ooc))]
+    fp = {}
+    for src in sources:
+        if not os.path.exists(src):
+            continue
+        with open(src) as f:
+            _, modules = ooc_synth.split_modules(f.read())
+        for name, text in modules.items():
+            # black box stubs are not what the module looks like
+            if name not in fp or fp[name][1] < text.count("\n"):
+                fp[name] = [hashlib.sha1(text.encode()).hexdigest(), text.count("\n")]
+    return fp
+
+
+def changed_fraction(old, new):
+    # share of the RTL lines that are in modules which changed, were added or were removed
+    total = 0
+    changed = 0
+    for m in set(old) | set(new):
+        lines = new[m][1] if m in new else old[m][1]
+        total += lines
+        if old.get(m, [None])[0] != new.get(m, [None])[0]:
+            changed += lines
+    return changed / max(total, 1)
+
+
+def snapshot(cl_dir, timestamp):
+    # the RTL as it was when build `timestamp` started, record() uses it once the build is done
+    with open(f"{cl_dir}/build/checkpoints/{timestamp}.fingerprint.json", 'w') as f:
+        json.dump(fingerprint(cl_dir), f)
+
+
+def record(cl_dir, timestamp):
+    """
+    Make build `timestamp` the reference if it met timing. Returns True if it did.
+    """
+    rpt = f"{cl_dir}/build/reports/{timestamp}.SH_CL_final_timing_summary.rpt"
+    dcp = f"{cl_dir}/build/checkpoints/{timestamp}.SH_CL_routed.dcp"
+    fp = f"{cl_dir}/build/checkpoints/{timestamp}.fingerprint.json"
+    if not os.path.exists(rpt) or not os.path.exists(dcp) or not os.path.exists(fp):
+        return False
+    s = timing_report.parse_timing_report(rpt, 0)['summary']
+    if s is None or s['wns'] is None or s['wns'] < 0 or (s['whs'] is not None and s['whs'] < 0):
+        print(f"Build {timestamp} did not meet timing, keeping the previous incremental reference")
+        return False
+    tmp = f"{cl_dir}/{ref_dir}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        os.link(dcp, f"{tmp}/SH_CL_routed.dcp")
+    except OSError:
+        shutil.copy2(dcp, f"{tmp}/SH_CL_routed.dcp")
+    shutil.copy2(fp, f"{tmp}/fingerprint.json")
+    with open(f"{tmp}/reference.json", 'w') as f:
+        json.dump({'timestamp': timestamp, 'wns': s['wns'], 'whs': s['whs']}, f, indent=2)
+    shutil.rmtree(f"{cl_dir}/{ref_dir}", ignore_errors=True)
+    os.rename(tmp, f"{cl_dir}/{ref_dir}")
+    print(f"Build {timestamp} is the new incremental reference")
+    return True
+
+
+def reference(cl_dir):
+    meta = f"{cl_dir}/{ref_dir}/reference.json"
+    if not os.path.exists(meta):
+        return None
+    with open(meta) as f:
+        return json.load(f)
+
+
+def write_hook(cl_dir, opts):
+    """
+    Write build/scripts/incremental.tcl if there is a reference and the design is close enough to it. The threshold
+    is `incremental_max_change`, the share of RTL lines in changed modules.
+    """
+    hook = f"{cl_dir}/build/scripts/incremental.tcl"
+    if os.path.exists(hook):
+        os.remove(hook)
+    ref = reference(cl_dir)
+    if ref is None:
+        print("Incremental implementation: no routed checkpoint that met timing yet, implementing from scratch")
+        return False
+    with open(f"{cl_dir}/{ref_dir}/fingerprint.json") as f:
+        change = changed_fraction(json.load(f), fingerprint(cl_dir))
+    max_change = float(opts.get('incremental_max_change', default_max_change))
+    if change > max_change:
+        print(f"Incremental implementation: {change * 100:.0f}% of the RTL changed since build {ref['timestamp']} "
+              f"(limit {max_change * 100:.0f}%), implementing from scratch")
+        return False
+    with open(hook, 'w') as f:
+        f.write(f"# written by aws-gen-build, reference build {ref['timestamp']} (WNS {ref['wns']}ns), "
+                f"{change * 100:.0f}% of the RTL changed since\n"
+                f"puts \"AWS FPGA: incremental implementation against {ref['timestamp']}\"\n"
+                f"read_checkpoint -incremental -auto_incremental {os.path.abspath(cl_dir)}/{ref_dir}/SH_CL_routed.dcp\n")
+    print(f"Incremental implementation against build {ref['timestamp']} ({change * 100:.0f}% of the RTL changed)")
+    return True
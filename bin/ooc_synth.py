@@ -0,0 +1,237 @@
+import os
+import re
+
+# Out-of-context synthesis of replicated cores. Chisel emits one module per distinct core and instantiates it nCores
+# times, so synthesising each such module once on its own and reusing the netlist for every instance takes the core
+# count out of synthesis time. The cores are turned into black boxes in the top-level source, the out-of-context runs
+# start next to the top-level synth_design and their checkpoints are read into the black boxes afterwards
+# (ooc_stitch.tcl, sourced by synth.tcl).
+
+_module = re.compile(r"^module\s+([A-Za-z_]\w*)")
+_instance = re.compile(r"^\s+([A-Za-z_]\w*)\s+(#\s*\(.*?\)\s*)?([A-Za-z_]\w*)\s*\(")
+ooc_dir = "ooc"
+
+
+def split_modules(text):
+    """
+    {name: text} of every module in `text` plus the text around them, in order, as a list of (name or None, text).
+    """
+    pieces = []
+    modules = {}
+    current = None
+    buf = []
+    for ln in text.splitlines(keepends=True):
+        m = _module.match(ln)
+        if current is None and m is not None:
+            if buf:
+                pieces.append((None, "".join(buf)))
+            current, buf = m.group(1), [ln]
+            continue
+        buf.append(ln)
+        if current is not None and ln.startswith("endmodule"):
+            pieces.append((current, "".join(buf)))
+            modules[current] = "".join(buf)
+            current, buf = None, []
+    if buf:
+        pieces.append((current, "".join(buf)))
+    return pieces, modules
+
+
+def instances(modules):
+    # {module: {child: number of instances in module}}, parameterised instances are marked with child None
+    children = {}
+    for name, text in modules.items():
+        kids = {}
+        for ln in text.splitlines()[1:]:
+            m = _instance.match(ln)
+            if m is None or m.group(1) not in modules:
+                continue
+            if m.group(2) is not None:
+                kids.setdefault(None, set()).add(m.group(1))
+            kids[m.group(1)] = kids.get(m.group(1), 0) + 1
+        children[name] = kids
+    return children
+
+
+def instance_names(modules):
+    # {module: [(child module, instance name)]} in source order
+    out = {}
+    for name, text in modules.items():
+        out[name] = []
+        for ln in text.splitlines()[1:]:
+            m = _instance.match(ln)
+            if m is not None and m.group(1) in modules:
+                out[name].append((m.group(1), m.group(3)))
+    return out
+
+
+def subtree(children, name):
+    seen = set()
+    todo = [name]
+    while todo:
+        m = todo.pop()
+        if m in seen:
+            continue
+        seen.add(m)
+        todo += [c for c in children[m] if c is not None]
+    return seen
+
+
+def find_replicated(modules, min_instances=2, min_lines=2000):
+    """
+    Modules that end up instantiated at least min_instances times in the elaborated design and that elaborate to at
+    least min_lines lines of RTL including their submodules. Only the outermost such module of a hierarchy is returned.
+    Returns {module: elaborated instance count}.
+    """
+    children = instances(modules)
+    parameterised = set()
+    for kids in children.values():
+        parameterised |= kids.get(None, set())
+    roots = [m for m in modules if not any(m in kids for kids in children.values())]
+    # elaborated instance counts, parents before children
+    order = []
+    visited = set()
+
+    def visit(m):
+        if m in visited:
+            return
+        visited.add(m)
+        for c in children[m]:
+            if c is not None:
+                visit(c)
+        order.append(m)
+
+    for r in roots:
+        visit(r)
+    count = {m: 0 for m in modules}
+    for r in roots:
+        count[r] = 1
+    for m in reversed(order):
+        for c, n in children[m].items():
+            if c is not None:
+                count[c] += count[m] * n
+    # elaborated size in lines of RTL, children before parents
+    size = {}
+    for m in order:
+        size[m] = modules[m].count("\n") + sum(n * size[c] for c, n in children[m].items() if c is not None)
+    found = {}
+    for m in reversed(order):
+        if count[m] < min_instances or size[m] < min_lines or m in parameterised or "#(" in modules[m].split(")")[0]:
+            continue
+        if any(m in subtree(children, f) for f in found):
+            continue
+        found[m] = count[m]
+    return found
+
+
+def stub(module_text):
+    # the port list of a module with an empty body, which synthesis treats as a black box
+    header = []
+    for ln in module_text.splitlines(keepends=True):
+        header.append(ln)
+        if ln.rstrip().endswith(");"):
+            break
+    return "".join(header) + "endmodule\n"
+
+
+def prepare(design_file, opts):
+    """
+    Split the replicated cores out of design_file (design/beethoven_aws.sv) into design/ooc/<core>.sv, leave black
+    boxes in their place and write the out-of-context run scripts to build/scripts. Returns the cores found.
+    """
+    with open(design_file) as f:
+        pieces, modules = split_modules(f.read())
+    cores = find_replicated(modules, int(opts.get('ooc_min_instances', 2)), int(opts.get('ooc_min_lines', 2000)))
+    clear_scripts()
+    if len(cores) == 0:
+        print("Out-of-context synthesis: no replicated cores found, synthesising the design in one run")
+        return cores
+    children = instances(modules)
+    # modules that are still needed outside of the cores stay in the top-level source
+    outside = set()
+    for r in [m for m in modules if not any(m in kids for kids in children.values())]:
+        todo = [r]
+        while todo:
+            m = todo.pop()
+            if m in outside or m in cores:
+                continue
+            outside.add(m)
+            todo += [c for c in children[m] if c is not None]
+    design_dir = os.path.dirname(design_file)
+    os.makedirs(f"{design_dir}/{ooc_dir}", exist_ok=True)
+    for core in cores:
+        with open(f"{design_dir}/{ooc_dir}/{core}.sv", 'w') as f:
+            for name, text in pieces:
+                if name is None or name in subtree(children, core):
+                    f.write(text)
+    with open(design_file, 'w') as f:
+        for name, text in pieces:
+            if name in cores:
+                f.write(stub(text))
+            elif name is None or name in outside:
+                f.write(text)
+    write_scripts(cores, opts)
+    for core, n in cores.items():
+        print(f"Out-of-context synthesis: {core} ({n} instances)")
+    return cores
+
+
+def clear_scripts():
+    # synth.tcl runs the out-of-context flow whenever these exist
+    for fname in ["build/scripts/ooc_run.sh", "build/scripts/ooc_stitch.tcl"]:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+
+def write_scripts(cores, opts):
+    # one Vivado run per core, all started by ooc_run.sh at once up to the job limit
+    jobs = int(opts.get('ooc_jobs', max(1, os.cpu_count() // 8 - 1)))
+    directive = opts.get('ooc_directive', 'default')
+    period = opts.get('ooc_clock_period')
+    for core in cores:
+        with open(f"build/scripts/ooc_{core}.tcl", 'w') as f:
+            f.write(f"set_param general.maxThreads 8\n"
+                    f"source $::env(HDK_SHELL_DIR)/build/scripts/device_type.tcl\n"
+                    f"create_project -in_memory -part [DEVICE_TYPE] -force\n"
+                    f"source src_list.tcl\n"
+                    f"# only the other sources, the core and everything below it is in its own file\n"
+                    f"set hdl_sources [lsearch -all -inline -not -glob $hdl_sources *beethoven*.sv]\n"
+                    f"set hdl_sources [lsearch -all -inline -not -glob $hdl_sources *BeethovenTopVCSHarness.v]\n"
+                    f"read_verilog -sv [concat ../../design/{ooc_dir}/{core}.sv $hdl_sources]\n")
+            if period is not None:
+                # the core's clock, so that the run optimises for the frequency it will be placed at
+                with open(f"build/scripts/ooc_{core}.xdc", 'w') as x:
+                    x.write(f"create_clock -period {period} [get_ports -quiet clock]\n")
+                f.write(f"read_xdc -mode out_of_context ooc_{core}.xdc\n")
+            # the defines of the in-context run (synth.tcl), so that the core is synthesised from the same RTL
+            f.write(f"set vdefines {{}}\n"
+                    f"if {{[info exists ::env(BEETHOVEN_VDEFINES)]}} {{\n"
+                    f"    set vdefines $::env(BEETHOVEN_VDEFINES)\n"
+                    f"}}\n"
+                    f"eval [concat synth_design -top {core} -verilog_define XSDB_SLV_DIS $vdefines "
+                    f"-part [DEVICE_TYPE] -mode out_of_context -directive {directive}]\n"
+                    f"file mkdir ../checkpoints/{ooc_dir}\n"
+                    f"write_checkpoint -force ../checkpoints/{ooc_dir}/{core}.dcp\n")
+    with open("build/scripts/ooc_run.sh", 'w') as f:
+        f.write("#!/bin/bash\n"
+                "# started in the background by synth.tcl, ooc.done holds the exit status when all runs are over\n"
+                "cd $(dirname $0)\n"
+                f"printf '%s\\n' {' '.join(cores)} | xargs -P {jobs} -I CORE "
+                f"vivado -mode batch -nojournal -log ooc_CORE.log -source ooc_CORE.tcl > /dev/null\n"
+                "echo $? > ooc.done\n")
+    os.chmod("build/scripts/ooc_run.sh", 0o755)
+    with open("build/scripts/ooc_stitch.tcl", 'w') as f:
+        f.write("# Wait for the out-of-context runs and read their netlists into the black boxes\n"
+                "while {![file exists ooc.done]} {\n"
+                "    after 10000\n"
+                "}\n"
+                "set ooc_status [string trim [read [open ooc.done]]]\n"
+                "if {$ooc_status != 0} {\n"
+                "    puts \"AWS FPGA: FATAL ERROR--out-of-context synthesis failed, see ooc_*.log\"\n"
+                "    exit 1\n"
+                "}\n"
+                f"foreach core {{{' '.join(cores)}}} {{\n"
+                "    foreach cell [get_cells -hierarchical -filter \"REF_NAME == $core\"] {\n"
+                f"        read_checkpoint -cell $cell ../checkpoints/{ooc_dir}/$core.dcp\n"
+                "    }\n"
+                "}\n")
@@ -0,0 +1,211 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Uploads for aws-build-mv. With boto3 installed, files and compressed archives are streamed straight into S3
+# multipart uploads with several parts in flight. Without it the aws CLI is used, still streaming the archive through
+# a pipe. BEETHOVEN_S3_ENDPOINT points both at an S3-compatible stand-in (e.g. a local MinIO) for testing.
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+part_size = 64 << 20
+threads = 8
+# content hash of what was uploaded, compared before uploading again
+checksum_key = "beethoven-sha256"
+
+
+def endpoint():
+    return os.environ.get("BEETHOVEN_S3_ENDPOINT")
+
+
+def client(region):
+    return boto3.client("s3", region_name=region, endpoint_url=endpoint())
+
+
+def _cli(cmd):
+    ep = endpoint()
+    return f"aws {cmd}" + (f" --endpoint-url {ep}" if ep is not None else "")
+
+
+def compressor():
+    # multithreaded gzip if there is one, the object names promise .tar.gz
+    if shutil.which("pigz") is not None:
+        return f"pigz -p {os.cpu_count()}"
+    return "gzip"
+
+
+def ensure_bucket(bucket, region):
+    if boto3 is None:
+        # mb fails when the bucket is already there, only ls tells the two apart
+        if os.system(_cli(f"s3 ls s3://{bucket} --region {region} > /dev/null 2>&1")) != 0:
+            assert 0 == os.system(_cli(f"s3 mb s3://{bucket} --region {region}"))
+        return
+    s3 = client(region)
+    try:
+        s3.head_bucket(Bucket=bucket)
+    except s3.exceptions.ClientError:
+        if region == "us-east-1":
+            s3.create_bucket(Bucket=bucket)
+        else:
+            s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': region})
+
+
+def _hash_file(h, fname):
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+
+def file_checksum(fname):
+    h = hashlib.sha256()
+    _hash_file(h, fname)
+    return h.hexdigest()
+
+
+def tree_checksum(root, files):
+    # stable over re-archiving: paths and contents, not tar headers or gzip timestamps
+    paths = []
+    for rel in files:
+        if os.path.isdir(f"{root}/{rel}"):
+            for d, dirs, fs in os.walk(f"{root}/{rel}"):
+                paths += [f"{d}/{f}" for f in fs]
+        else:
+            paths.append(f"{root}/{rel}")
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        h.update(os.path.relpath(path, root).encode() + b"\0")
+        _hash_file(h, path)
+    return h.hexdigest()
+
+
+def already_uploaded(bucket, key, checksum, region):
+    if boto3 is None:
+        out = subprocess.run(_cli(f"s3api head-object --bucket {bucket} --key {key} --region {region} "
+                                  f"--query 'Metadata.\"{checksum_key}\"' --output text"),
+                             shell=True, capture_output=True, text=True)
+        return out.returncode == 0 and out.stdout.strip() == checksum
+    s3 = client(region)
+    try:
+        head = s3.head_object(Bucket=bucket, Key=key)
+    except s3.exceptions.ClientError:
+        return False
+    return head.get('Metadata', {}).get(checksum_key) == checksum
+
+
+class Progress:
+    def __init__(self, label):
+        self.label = label
+        self.start = time.time()
+        self.sent = 0
+        self.lock = threading.Lock()
+        self.last = self.start
+
+    def add(self, n):
+        with self.lock:
+            self.sent += n
+            now = time.time()
+            if now - self.last > 10:
+                self.last = now
+                print(f"  {self.label}: {self.sent / (1 << 20):.0f}MB, {self.rate():.1f}MB/s")
+
+    def rate(self):
+        return self.sent / (1 << 20) / max(time.time() - self.start, 1e-3)
+
+    def done(self):
+        print(f"Uploaded {self.label}: {self.sent / (1 << 20):.1f}MB in {time.time() - self.start:.1f}s "
+              f"({self.rate():.1f}MB/s)")
+
+
+def _multipart(stream, bucket, key, region, metadata, label, check=None):
+    # Read parts off `stream` one after the other and upload up to `threads` of them at once. Memory stays at
+    # about threads + 1 parts no matter how large the object is. `check` runs once the stream is drained, the upload
+    # is abandoned if it raises.
+    s3 = client(region)
+    upload = s3.create_multipart_upload(Bucket=bucket, Key=key, Metadata=metadata)
+    progress = Progress(label)
+    slots = threading.Semaphore(threads + 1)
+
+    def send(n, body):
+        try:
+            etag = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload['UploadId'], PartNumber=n,
+                                  Body=body)['ETag']
+            progress.add(len(body))
+            return {'PartNumber': n, 'ETag': etag}
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = []
+            n = 1
+            while True:
+                slots.acquire()
+                body = stream.read(part_size)
+                if not body and n > 1:
+                    slots.release()
+                    break
+                futures.append(pool.submit(send, n, body))
+                n += 1
+                if len(body) < part_size:
+                    break
+            parts = [f.result() for f in futures]
+        if check is not None:
+            check()
+        s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload['UploadId'],
+                                     MultipartUpload={'Parts': parts})
+    except BaseException:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload['UploadId'])
+        raise
+    progress.done()
+
+
+def upload_file(fname, bucket, key, region):
+    # Upload one file unless the bucket already holds the same content under key
+    checksum = file_checksum(fname)
+    if already_uploaded(bucket, key, checksum, region):
+        print(f"s3://{bucket}/{key} is up to date, skipping")
+        return
+    if boto3 is None:
+        start = time.time()
+        assert 0 == os.system(_cli(f"s3 cp {fname} s3://{bucket}/{key} --region {region} "
+                                   f"--metadata {checksum_key}={checksum}"))
+        print(f"Uploaded {key}: {os.path.getsize(fname) / (1 << 20) / max(time.time() - start, 1e-3):.1f}MB/s")
+        return
+    with open(fname, 'rb') as f:
+        _multipart(f, bucket, key, region, {checksum_key: checksum}, key)
+
+
+def upload_tree(root, files, bucket, key, region):
+    """
+    Upload `files` (relative to root) as a gzipped tarball. tar, the compressor and the upload run concurrently,
+    the archive never touches the disk.
+    """
+    checksum = tree_checksum(root, files)
+    if already_uploaded(bucket, key, checksum, region):
+        print(f"s3://{bucket}/{key} is up to date, skipping")
+        return
+    archive = f"tar -C {root} -cf - {' '.join(files)} | {compressor()}"
+    if boto3 is None:
+        start = time.time()
+        upload = _cli(f"s3 cp - s3://{bucket}/{key} --region {region} --metadata {checksum_key}={checksum}")
+        assert 0 == subprocess.run(["bash", "-o", "pipefail", "-c", f"{archive} | {upload}"]).returncode
+        print(f"Uploaded {key} in {time.time() - start:.1f}s")
+        return
+    proc = subprocess.Popen(["bash", "-o", "pipefail", "-c", archive], stdout=subprocess.PIPE)
+
+    def check():
+        if proc.wait() != 0:
+            raise Exception(f"Creating the archive for {key} failed ({archive})")
+
+    try:
+        _multipart(proc.stdout, bucket, key, region, {checksum_key: checksum}, key, check)
+    finally:
+        proc.stdout.close()
+        proc.wait()
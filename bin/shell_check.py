@@ -0,0 +1,154 @@
+import re
+from VerilogUtils import *
+
+# Connectivity and width checks over a generated shell netlist. Everything here runs on the in-memory Netlist so that
+# mistakes in the generator show up in seconds instead of after a synthesis run.
+
+_ident = re.compile(r"(?<!')\b[A-Za-z_][\w$]*")
+_target = re.compile(r"^(\w+)(?:\[(\d+)\])?$")
+
+
+class ShellIssue:
+    def __init__(self, severity, kind, message):
+        # severity is one of 'error', 'warning', 'info'
+        self.severity = severity
+        self.kind = kind
+        self.message = message
+
+    def __str__(self):
+        return f"[{self.severity}] {self.kind}: {self.message}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+_request_id = re.compile(r"_(aw|ar)id(_|\[|$)")
+_response_id = re.compile(r"_(b|r)id(_|\[|$)")
+
+
+def check_widths(g: Netlist):
+    issues = []
+    # request IDs that were zero-extended on the way to the shell make the matching response ID truncation lossless
+    extended_ids = set()
+    for lhs, lw, op, ow in g.width_changes:
+        if lw > ow and _request_id.search(lhs):
+            extended_ids.add((ow, lw))
+    for lhs, lw, op, ow in g.width_changes:
+        if lw < ow:
+            if _response_id.search(lhs) and (lw, ow) in extended_ids:
+                issues.append(ShellIssue('info', 'truncation', f"{lhs} ({lw}b) <- {op} ({ow}b), ID round-trip"))
+            else:
+                issues.append(ShellIssue('error', 'truncation', f"{lhs} ({lw}b) <- {op} ({ow}b) drops upper bits"))
+        else:
+            issues.append(ShellIssue('info', 'extension', f"{lhs} ({lw}b) <- {op} ({ow}b) zero-extended"))
+    return issues
+
+
+def check_connectivity(g: Netlist, shell_ports: PortTable, externally_driven=()):
+    """
+    Check drivers and loads of every signal in the netlist. `externally_driven` names signals that are driven
+    outside of `g` (e.g. the reset logic in the module header).
+    """
+    issues = []
+    shapes = dict(g.shapes)
+    for p in shell_ports:
+        shapes.setdefault(p.name, (p.width, p.ar_width))
+
+    # base -> [whole drive count, {element: count}, [driver descriptions]]
+    drivers = {}
+    reads = set()
+
+    def drive(target, source):
+        target = target.strip()
+        if target.startswith('{') and target.endswith('}'):
+            # (possibly nested) concatenation connected to an output port
+            for t in target.replace('{', '').replace('}', '').split(','):
+                drive(t, source)
+            return
+        m = _target.match(target)
+        if m is None:
+            return
+        entry = drivers.setdefault(m.group(1), [0, {}, []])
+        if m.group(2) is None:
+            entry[0] += 1
+        else:
+            idx = int(m.group(2))
+            entry[1][idx] = entry[1].get(idx, 0) + 1
+        entry[2].append(source)
+
+    def read(expr):
+        for t in _ident.findall(expr):
+            reads.add(t)
+
+    for lhs, rhs in g.assigns:
+        drive(lhs, f"assign {lhs}")
+        read(rhs)
+    for lhs, rhs in g.reg_assigns:
+        drive(lhs, f"always_ff {lhs}")
+        read(rhs)
+    for module, name, conns in g.instances:
+        for port, sig, io_type in conns:
+            if io_type == 'output':
+                drive(sig, f"{name}.{port}")
+            else:
+                read(sig)
+
+    def n_elements(base):
+        width, ar_width = shapes.get(base, (1, 1))
+        return ar_width if ar_width > 1 else width
+
+    def is_driven(base):
+        if base in externally_driven or base in g.driven:
+            return True
+        port = shell_ports.get(base)
+        if port is not None and not port.output:
+            return True
+        entry = drivers.get(base)
+        if entry is None:
+            return False
+        return entry[0] > 0 or len(entry[1]) == n_elements(base)
+
+    for base, (whole, elems, sources) in drivers.items():
+        if whole > 1 or (whole == 1 and len(elems) > 0) or any(c > 1 for c in elems.values()):
+            issues.append(ShellIssue('error', 'multiple drivers', f"{base} driven by {', '.join(sources)}"))
+        port = shell_ports.get(base)
+        if port is not None and port.input:
+            issues.append(ShellIssue('error', 'driven input', f"shell input {base} driven by {', '.join(sources)}"))
+
+    for p in shell_ports:
+        if p.output and not is_driven(p.name):
+            issues.append(ShellIssue('error', 'undriven output', f"shell output {p.name} is never driven"))
+
+    for module, name, conns in g.instances:
+        for port, sig, io_type in conns:
+            m = _target.match(sig)
+            if m is None or m.group(1) not in shapes:
+                continue
+            if io_type == 'input' and not is_driven(m.group(1)):
+                issues.append(ShellIssue('error', 'undriven input', f"{name}.{port} is connected to undriven {sig}"))
+            elif io_type == 'output' and module == 'BeethovenTop' and m.group(1) not in reads:
+                issues.append(ShellIssue('warning', 'unconnected output', f"{name}.{port} ({sig}) goes nowhere"))
+    return issues
+
+
+def check_shell(g: Netlist, shell_ports: PortTable, externally_driven=()):
+    return check_widths(g) + check_connectivity(g, shell_ports, externally_driven)
+
+
+def report_shell_issues(issues, strict=False, path="shell_check.rpt"):
+    # Full report goes to `path`, errors and warnings are also printed. In strict mode errors fail generation.
+    counts = {'error': 0, 'warning': 0, 'info': 0}
+    for issue in issues:
+        counts[issue.severity] += 1
+    if path is not None:
+        with open(path, 'w') as f:
+            for issue in sorted(issues, key=lambda x: ['error', 'warning', 'info'].index(x.severity)):
+                f.write(str(issue) + "\n")
+    for issue in issues:
+        if issue.severity != 'info':
+            print(issue)
+    print(f"Shell check: {counts['error']} errors, {counts['warning']} warnings, {counts['info']} notes"
+          + (f" (see {path})" if path is not None else ""))
+    if strict and counts['error'] > 0:
+        raise Exception(f"Shell check failed with {counts['error']} errors (strict mode)")
+    return counts['error'] == 0
@@ -0,0 +1,860 @@
+# SystemVerilog helper modules that the shell generator can instantiate around BeethovenTop. The generator asks for
+# the modules it uses through Netlist.require_module() and they are written ahead of beethoven_aws.
+
+AXI_REG_SLICE = """
+// One full register slice stage for a valid/ready channel. A skid register keeps the channel at full throughput
+// while registering valid, data and ready.
+module beethoven_axi_reg_slice #(parameter WIDTH = 1) (
+\tinput clk,
+\tinput rst,
+\tinput s_valid,
+\toutput s_ready,
+\tinput [WIDTH-1:0] s_data,
+\toutput m_valid,
+\tinput m_ready,
+\toutput [WIDTH-1:0] m_data
+);
+logic main_valid, skid_valid;
+logic [WIDTH-1:0] main_data, skid_data;
+assign s_ready = !skid_valid;
+assign m_valid = main_valid;
+assign m_data = main_data;
+always_ff @(posedge clk)
+begin
+\tif (rst)
+\tbegin
+\t\tmain_valid <= 0;
+\t\tskid_valid <= 0;
+\tend
+\telse if (m_ready || !main_valid)
+\tbegin
+\t\tif (skid_valid)
+\t\tbegin
+\t\t\tmain_valid <= 1;
+\t\t\tmain_data <= skid_data;
+\t\t\tskid_valid <= 0;
+\t\tend
+\t\telse
+\t\tbegin
+\t\t\tmain_valid <= s_valid;
+\t\t\tmain_data <= s_data;
+\t\tend
+\tend
+\telse if (s_valid && !skid_valid)
+\tbegin
+\t\tskid_valid <= 1;
+\t\tskid_data <= s_data;
+\tend
+end
+endmodule
+"""
+
+AXI_CDC = """
+// Asynchronous FIFO for a valid/ready channel crossing between two clocks. Pointers cross as gray code through two
+// ASYNC_REG flops, the generator constrains their skew with set_bus_skew. Each side is reset in its own domain.
+module beethoven_axi_cdc #(parameter WIDTH = 1, parameter ADDR = 3) (
+\tinput s_clk,
+\tinput s_rst,
+\tinput s_valid,
+\toutput s_ready,
+\tinput [WIDTH-1:0] s_data,
+\tinput m_clk,
+\tinput m_rst,
+\toutput m_valid,
+\tinput m_ready,
+\toutput [WIDTH-1:0] m_data
+);
+(* ram_style = "distributed" *) logic [WIDTH-1:0] mem [0:(1<<ADDR)-1];
+logic [ADDR:0] wptr_bin, wptr_gray, rptr_bin, rptr_gray;
+(* ASYNC_REG = "TRUE" *) logic [ADDR:0] wptr_meta, wptr_sync;
+(* ASYNC_REG = "TRUE" *) logic [ADDR:0] rptr_meta, rptr_sync;
+wire [ADDR:0] wptr_next = wptr_bin + 1;
+wire [ADDR:0] rptr_next = rptr_bin + 1;
+// full when the write pointer is a whole lap ahead: top two gray bits differ, the rest match
+assign s_ready = wptr_gray != {~rptr_sync[ADDR:ADDR-1], rptr_sync[ADDR-2:0]};
+assign m_valid = rptr_gray != wptr_sync;
+assign m_data = mem[rptr_bin[ADDR-1:0]];
+always_ff @(posedge s_clk)
+\tif (s_valid && s_ready)
+\t\tmem[wptr_bin[ADDR-1:0]] <= s_data;
+always_ff @(posedge s_clk)
+begin
+\tif (s_rst)
+\tbegin
+\t\twptr_bin <= 0;
+\t\twptr_gray <= 0;
+\t\trptr_meta <= 0;
+\t\trptr_sync <= 0;
+\tend
+\telse
+\tbegin
+\t\tif (s_valid && s_ready)
+\t\tbegin
+\t\t\twptr_bin <= wptr_next;
+\t\t\twptr_gray <= wptr_next ^ (wptr_next >> 1);
+\t\tend
+\t\trptr_meta <= rptr_gray;
+\t\trptr_sync <= rptr_meta;
+\tend
+end
+always_ff @(posedge m_clk)
+begin
+\tif (m_rst)
+\tbegin
+\t\trptr_bin <= 0;
+\t\trptr_gray <= 0;
+\t\twptr_meta <= 0;
+\t\twptr_sync <= 0;
+\tend
+\telse
+\tbegin
+\t\tif (m_valid && m_ready)
+\t\tbegin
+\t\t\trptr_bin <= rptr_next;
+\t\t\trptr_gray <= rptr_next ^ (rptr_next >> 1);
+\t\tend
+\t\twptr_meta <= wptr_gray;
+\t\twptr_sync <= wptr_meta;
+\tend
+end
+endmodule
+"""
+
+RR_ARB = """
+// Round-robin arbiter that keeps its choice once it has been shown: until the chosen request is accepted, and for
+// bursts until the beat with `last` is accepted.
+module beethoven_rr_arb #(parameter N = 2, parameter IW = (N > 1) ? $clog2(N) : 1) (
+\tinput clk,
+\tinput rst,
+\tinput [N-1:0] req,
+\tinput ready,
+\tinput last,
+\toutput valid,
+\toutput [IW-1:0] idx,
+\toutput [N-1:0] grant
+);
+logic locked, any;
+logic [IW-1:0] held, ptr, pick;
+always_comb
+begin
+\tpick = ptr;
+\tany = 0;
+\tfor (int k = N - 1; k >= 0; k--)
+\t\tif (req[(ptr + k) % N])
+\t\tbegin
+\t\t\tpick = IW'((ptr + k) % N);
+\t\t\tany = 1;
+\t\tend
+end
+assign idx = locked ? held : pick;
+assign valid = locked ? req[held] : any;
+assign grant = valid ? (N'(1) << idx) : '0;
+always_ff @(posedge clk)
+begin
+\tif (rst)
+\tbegin
+\t\tlocked <= 0;
+\t\tptr <= 0;
+\tend
+\telse if (valid && ready)
+\tbegin
+\t\tlocked <= !last;
+\t\theld <= idx;
+\t\tif (last)
+\t\t\tptr <= IW'((idx + 1) % N);
+\tend
+\telse if (valid && !locked)
+\tbegin
+\t\tlocked <= 1;
+\t\theld <= pick;
+\tend
+end
+endmodule
+"""
+
+ID_REMAP = """
+// Squeezes the IDs of one AXI request channel (AW or AR) into OW bits for a path that cannot carry all IW, and gives
+// the responses (B or R) their original ID back. Outstanding IDs hold one of N slots, requests with an ID that
+// already has one reuse it so that AXI ordering per ID is kept. A request waits while no slot is free or its slot's
+// count is full.
+module beethoven_axi_id_remap #(parameter IW = 16, parameter OW = 4, parameter N = 16, parameter CW = 8) (
+\tinput clk,
+\tinput rst,
+\tinput s_valid,
+\toutput logic s_ready,
+\tinput [IW-1:0] s_id,
+\toutput logic m_valid,
+\tinput m_ready,
+\toutput logic [OW-1:0] m_id,
+\tinput rsp_valid,
+\tinput rsp_ready,
+\tinput rsp_last,
+\tinput [OW-1:0] rsp_m_id,
+\toutput [IW-1:0] rsp_s_id
+);
+logic [N-1:0] used;
+logic [IW-1:0] orig [N];
+logic [CW-1:0] count [N];
+logic hit, free, room;
+logic [OW-1:0] slot, hit_slot, free_slot;
+always_comb
+begin
+\thit = 0;
+\tfree = 0;
+\thit_slot = 0;
+\tfree_slot = 0;
+\tfor (int k = N - 1; k >= 0; k--)
+\tbegin
+\t\tif (used[k] && orig[k] == s_id)
+\t\tbegin
+\t\t\thit = 1;
+\t\t\thit_slot = OW'(k);
+\t\tend
+\t\tif (!used[k])
+\t\tbegin
+\t\t\tfree = 1;
+\t\t\tfree_slot = OW'(k);
+\t\tend
+\tend
+\tslot = hit ? hit_slot : free_slot;
+\troom = hit ? count[hit_slot] != '1 : free;
+\tm_valid = s_valid && room;
+\ts_ready = m_ready && room;
+\tm_id = slot;
+end
+assign rsp_s_id = orig[rsp_m_id];
+always_ff @(posedge clk)
+begin
+\tif (rst)
+\t\tused <= 0;
+\telse
+\tbegin
+\t\tfor (int k = 0; k < N; k++)
+\t\tbegin
+\t\t\tlogic up, down;
+\t\t\tup = s_valid && s_ready && slot == OW'(k);
+\t\t\tdown = rsp_valid && rsp_ready && rsp_last && rsp_m_id == OW'(k);
+\t\t\tif (up && !down)
+\t\t\tbegin
+\t\t\t\tused[k] <= 1;
+\t\t\t\tcount[k] <= used[k] ? count[k] + 1 : 1;
+\t\t\tend
+\t\t\telse if (down && !up)
+\t\t\tbegin
+\t\t\t\tcount[k] <= count[k] - 1;
+\t\t\t\tif (count[k] == 1)
+\t\t\t\t\tused[k] <= 0;
+\t\t\tend
+\t\t\tif (up && !used[k])
+\t\t\t\torig[k] <= s_id;
+\t\tend
+\tend
+end
+endmodule
+"""
+
+AXI_XBAR = """
+// Crossbar from NM AXI masters to NS memory channels. With INTERLEAVE consecutive 2**GRAN byte blocks go to
+// consecutive channels and the channel bits are squeezed out of the address, so every channel sees a dense address
+// space. Without it the channel bits above GRAN select a 2**GRAN byte region per channel and are cleared. Masters
+// with their bit set in FIXED always go to the channel with their own index, address untouched. Request IDs get the
+// master index on top to route responses back. A master keeps all of its unfinished write data on one channel and
+// all outstanding transactions of one ID on one channel. The first keeps W routing free of deadlocks, the second
+// keeps responses in AXI order. IDs are tracked by their low TW bits, IDs sharing those only stall each other. NS
+// must be a power of two and GRAN at least 12 so that no burst crosses a channel boundary.
+module beethoven_axi_xbar #(
+\tparameter NM = 2,
+\tparameter NS = 2,
+\tparameter IDW = 1,
+\tparameter AW = 64,
+\tparameter GRAN = 12,
+\tparameter INTERLEAVE = 1,
+\tparameter FIXED = 0,
+\tparameter AWP = 1,
+\tparameter WP = 1,
+\tparameter BP = 1,
+\tparameter ARP = 1,
+\tparameter RP = 1,
+\tparameter DEPTH = 8,
+\tparameter CW = 6,
+\tparameter TW = (IDW < 6) ? IDW : 6,
+\tparameter MB = (NM > 1) ? $clog2(NM) : 1,
+\tparameter SIDW = IDW + MB
+) (
+\tinput clk,
+\tinput rst,
+\tinput [NM-1:0] s_aw_valid,
+\toutput logic [NM-1:0] s_aw_ready,
+\tinput [NM*IDW-1:0] s_aw_id,
+\tinput [NM*AW-1:0] s_aw_addr,
+\tinput [NM*AWP-1:0] s_aw_data,
+\tinput [NM-1:0] s_w_valid,
+\toutput logic [NM-1:0] s_w_ready,
+\tinput [NM-1:0] s_w_last,
+\tinput [NM*WP-1:0] s_w_data,
+\toutput logic [NM-1:0] s_b_valid,
+\tinput [NM-1:0] s_b_ready,
+\toutput logic [NM*IDW-1:0] s_b_id,
+\toutput logic [NM*BP-1:0] s_b_data,
+\tinput [NM-1:0] s_ar_valid,
+\toutput logic [NM-1:0] s_ar_ready,
+\tinput [NM*IDW-1:0] s_ar_id,
+\tinput [NM*AW-1:0] s_ar_addr,
+\tinput [NM*ARP-1:0] s_ar_data,
+\toutput logic [NM-1:0] s_r_valid,
+\tinput [NM-1:0] s_r_ready,
+\toutput logic [NM*IDW-1:0] s_r_id,
+\toutput logic [NM-1:0] s_r_last,
+\toutput logic [NM*RP-1:0] s_r_data,
+\toutput logic [NS-1:0] m_aw_valid,
+\tinput [NS-1:0] m_aw_ready,
+\toutput logic [NS*SIDW-1:0] m_aw_id,
+\toutput logic [NS*AW-1:0] m_aw_addr,
+\toutput logic [NS*AWP-1:0] m_aw_data,
+\toutput logic [NS-1:0] m_w_valid,
+\tinput [NS-1:0] m_w_ready,
+\toutput logic [NS-1:0] m_w_last,
+\toutput logic [NS*WP-1:0] m_w_data,
+\tinput [NS-1:0] m_b_valid,
+\toutput logic [NS-1:0] m_b_ready,
+\tinput [NS*SIDW-1:0] m_b_id,
+\tinput [NS*BP-1:0] m_b_data,
+\toutput logic [NS-1:0] m_ar_valid,
+\tinput [NS-1:0] m_ar_ready,
+\toutput logic [NS*SIDW-1:0] m_ar_id,
+\toutput logic [NS*AW-1:0] m_ar_addr,
+\toutput logic [NS*ARP-1:0] m_ar_data,
+\tinput [NS-1:0] m_r_valid,
+\toutput logic [NS-1:0] m_r_ready,
+\tinput [NS*SIDW-1:0] m_r_id,
+\tinput [NS-1:0] m_r_last,
+\tinput [NS*RP-1:0] m_r_data
+);
+localparam SB = (NS > 1) ? $clog2(NS) : 1;
+localparam FB = (DEPTH > 1) ? $clog2(DEPTH) : 1;
+localparam NID = 1 << TW;
+
+function automatic [SB-1:0] channel_of(input int m, input [AW-1:0] addr);
+\tif (FIXED[m])
+\t\tchannel_of = SB'(m);
+\telse
+\t\tchannel_of = (NS > 1) ? SB'(addr >> GRAN) : '0;
+endfunction
+
+function automatic [AW-1:0] local_addr(input int m, input [AW-1:0] addr);
+\tif (FIXED[m] || NS == 1)
+\t\tlocal_addr = addr;
+\telse if (INTERLEAVE)
+\t\tlocal_addr = ((addr >> (GRAN + SB)) << GRAN) | (addr & ((AW'(1) << GRAN) - 1));
+\telse
+\t\tlocal_addr = addr & ~(((AW'(1) << SB) - 1) << GRAN);
+endfunction
+
+// per master: accepted AWs whose write data is not through yet, and the channel it goes to
+logic [CW-1:0] wd_out [NM];
+logic [SB-1:0] wd_tgt [NM];
+// per master and ID slot: transactions without a response yet, and the channel they went to
+logic [CW-1:0] w_out [NM][NID];
+logic [SB-1:0] w_tgt [NM][NID];
+logic [CW-1:0] r_out [NM][NID];
+logic [SB-1:0] r_tgt [NM][NID];
+
+logic [SB-1:0] aw_ch [NM];
+logic [SB-1:0] ar_ch [NM];
+logic [NM-1:0] aw_ok, ar_ok;
+always_comb
+begin
+\tfor (int m = 0; m < NM; m++)
+\tbegin
+\t\taw_ch[m] = channel_of(m, s_aw_addr[m*AW +: AW]);
+\t\tar_ch[m] = channel_of(m, s_ar_addr[m*AW +: AW]);
+\t\taw_ok[m] = (wd_out[m] == 0 || wd_tgt[m] == aw_ch[m]) && wd_out[m] != '1 &&
+\t\t\t(w_out[m][s_aw_id[m*IDW +: TW]] == 0 || w_tgt[m][s_aw_id[m*IDW +: TW]] == aw_ch[m]) &&
+\t\t\tw_out[m][s_aw_id[m*IDW +: TW]] != '1;
+\t\tar_ok[m] = (r_out[m][s_ar_id[m*IDW +: TW]] == 0 || r_tgt[m][s_ar_id[m*IDW +: TW]] == ar_ch[m]) &&
+\t\t\tr_out[m][s_ar_id[m*IDW +: TW]] != '1;
+\tend
+end
+
+// order in which each channel accepted write addresses, W beats are forwarded in that order
+logic [MB-1:0] wq [NS][DEPTH];
+logic [FB-1:0] wq_rd [NS];
+logic [FB-1:0] wq_wr [NS];
+logic [FB:0] wq_count [NS];
+
+logic [NM-1:0] aw_grant [NS];
+logic [NM-1:0] ar_grant [NS];
+logic [MB-1:0] aw_sel [NS];
+logic [MB-1:0] ar_sel [NS];
+logic [NS-1:0] b_grant [NM];
+logic [NS-1:0] r_grant [NM];
+logic [SB-1:0] b_sel [NM];
+logic [SB-1:0] r_sel [NM];
+
+genvar gs, gm;
+generate
+\tfor (gs = 0; gs < NS; gs++)
+\tbegin : channel
+\t\tlogic [NM-1:0] aw_req, ar_req;
+\t\talways_comb
+\t\t\tfor (int m = 0; m < NM; m++)
+\t\t\tbegin
+\t\t\t\taw_req[m] = s_aw_valid[m] && aw_ok[m] && aw_ch[m] == gs && wq_count[gs] != DEPTH;
+\t\t\t\tar_req[m] = s_ar_valid[m] && ar_ok[m] && ar_ch[m] == gs;
+\t\t\tend
+\t\tbeethoven_rr_arb #(.N(NM), .IW(MB)) aw_arb(.clk(clk), .rst(rst), .req(aw_req), .ready(m_aw_ready[gs]),
+\t\t\t.last(1'b1), .valid(m_aw_valid[gs]), .idx(aw_sel[gs]), .grant(aw_grant[gs]));
+\t\tbeethoven_rr_arb #(.N(NM), .IW(MB)) ar_arb(.clk(clk), .rst(rst), .req(ar_req), .ready(m_ar_ready[gs]),
+\t\t\t.last(1'b1), .valid(m_ar_valid[gs]), .idx(ar_sel[gs]), .grant(ar_grant[gs]));
+\tend
+\tfor (gm = 0; gm < NM; gm++)
+\tbegin : master
+\t\tlogic [NS-1:0] b_req, r_req;
+\t\talways_comb
+\t\t\tfor (int s = 0; s < NS; s++)
+\t\t\tbegin
+\t\t\t\tb_req[s] = m_b_valid[s] && m_b_id[s*SIDW+IDW +: MB] == gm;
+\t\t\t\tr_req[s] = m_r_valid[s] && m_r_id[s*SIDW+IDW +: MB] == gm;
+\t\t\tend
+\t\tbeethoven_rr_arb #(.N(NS), .IW(SB)) b_arb(.clk(clk), .rst(rst), .req(b_req), .ready(s_b_ready[gm]),
+\t\t\t.last(1'b1), .valid(s_b_valid[gm]), .idx(b_sel[gm]), .grant(b_grant[gm]));
+\t\tbeethoven_rr_arb #(.N(NS), .IW(SB)) r_arb(.clk(clk), .rst(rst), .req(r_req), .ready(s_r_ready[gm]),
+\t\t\t.last(m_r_last[r_sel[gm]]), .valid(s_r_valid[gm]), .idx(r_sel[gm]), .grant(r_grant[gm]));
+\tend
+endgenerate
+
+always_comb
+begin
+\ts_aw_ready = '0;
+\ts_ar_ready = '0;
+\ts_w_ready = '0;
+\tm_b_ready = '0;
+\tm_r_ready = '0;
+\tfor (int s = 0; s < NS; s++)
+\tbegin
+\t\tm_aw_id[s*SIDW +: SIDW] = {MB'(aw_sel[s]), s_aw_id[aw_sel[s]*IDW +: IDW]};
+\t\tm_aw_addr[s*AW +: AW] = local_addr(aw_sel[s], s_aw_addr[aw_sel[s]*AW +: AW]);
+\t\tm_aw_data[s*AWP +: AWP] = s_aw_data[aw_sel[s]*AWP +: AWP];
+\t\tm_ar_id[s*SIDW +: SIDW] = {MB'(ar_sel[s]), s_ar_id[ar_sel[s]*IDW +: IDW]};
+\t\tm_ar_addr[s*AW +: AW] = local_addr(ar_sel[s], s_ar_addr[ar_sel[s]*AW +: AW]);
+\t\tm_ar_data[s*ARP +: ARP] = s_ar_data[ar_sel[s]*ARP +: ARP];
+\t\tfor (int m = 0; m < NM; m++)
+\t\tbegin
+\t\t\tif (aw_grant[s][m] && m_aw_ready[s])
+\t\t\t\ts_aw_ready[m] = 1;
+\t\t\tif (ar_grant[s][m] && m_ar_ready[s])
+\t\t\t\ts_ar_ready[m] = 1;
+\t\tend
+\t\t// the master at the head of the order queue has all of its pending write data going here
+\t\tm_w_valid[s] = wq_count[s] != 0 && s_w_valid[wq[s][wq_rd[s]]];
+\t\tm_w_last[s] = s_w_last[wq[s][wq_rd[s]]];
+\t\tm_w_data[s*WP +: WP] = s_w_data[wq[s][wq_rd[s]]*WP +: WP];
+\t\tif (wq_count[s] != 0 && m_w_ready[s])
+\t\t\ts_w_ready[wq[s][wq_rd[s]]] = 1;
+\tend
+\tfor (int m = 0; m < NM; m++)
+\tbegin
+\t\ts_b_id[m*IDW +: IDW] = m_b_id[b_sel[m]*SIDW +: IDW];
+\t\ts_b_data[m*BP +: BP] = m_b_data[b_sel[m]*BP +: BP];
+\t\ts_r_id[m*IDW +: IDW] = m_r_id[r_sel[m]*SIDW +: IDW];
+\t\ts_r_last[m] = m_r_last[r_sel[m]];
+\t\ts_r_data[m*RP +: RP] = m_r_data[r_sel[m]*RP +: RP];
+\t\tfor (int s = 0; s < NS; s++)
+\t\tbegin
+\t\t\tif (b_grant[m][s] && s_b_ready[m])
+\t\t\t\tm_b_ready[s] = 1;
+\t\t\tif (r_grant[m][s] && s_r_ready[m])
+\t\t\t\tm_r_ready[s] = 1;
+\t\tend
+\tend
+end
+
+always_ff @(posedge clk)
+begin
+\tif (rst)
+\tbegin
+\t\tfor (int s = 0; s < NS; s++)
+\t\tbegin
+\t\t\twq_rd[s] <= 0;
+\t\t\twq_wr[s] <= 0;
+\t\t\twq_count[s] <= 0;
+\t\tend
+\t\tfor (int m = 0; m < NM; m++)
+\t\tbegin
+\t\t\twd_out[m] <= 0;
+\t\t\tfor (int i = 0; i < NID; i++)
+\t\t\tbegin
+\t\t\t\tw_out[m][i] <= 0;
+\t\t\t\tr_out[m][i] <= 0;
+\t\t\tend
+\t\tend
+\tend
+\telse
+\tbegin
+\t\tfor (int s = 0; s < NS; s++)
+\t\tbegin
+\t\t\tif (m_aw_valid[s] && m_aw_ready[s])
+\t\t\tbegin
+\t\t\t\twq[s][wq_wr[s]] <= aw_sel[s];
+\t\t\t\twq_wr[s] <= FB'((wq_wr[s] + 1) % DEPTH);
+\t\t\tend
+\t\t\tif (m_w_valid[s] && m_w_ready[s] && m_w_last[s])
+\t\t\t\twq_rd[s] <= FB'((wq_rd[s] + 1) % DEPTH);
+\t\t\twq_count[s] <= wq_count[s] + (m_aw_valid[s] && m_aw_ready[s]) - (m_w_valid[s] && m_w_ready[s] && m_w_last[s]);
+\t\tend
+\t\tfor (int m = 0; m < NM; m++)
+\t\tbegin
+\t\t\twd_out[m] <= wd_out[m] + (s_aw_valid[m] && s_aw_ready[m]) - (s_w_valid[m] && s_w_ready[m] && s_w_last[m]);
+\t\t\tif (s_aw_valid[m] && s_aw_ready[m])
+\t\t\t\twd_tgt[m] <= aw_ch[m];
+\t\t\tfor (int i = 0; i < NID; i++)
+\t\t\tbegin
+\t\t\t\tw_out[m][i] <= w_out[m][i] + (s_aw_valid[m] && s_aw_ready[m] && s_aw_id[m*IDW +: TW] == i)
+\t\t\t\t\t- (s_b_valid[m] && s_b_ready[m] && s_b_id[m*IDW +: TW] == i);
+\t\t\t\tif (s_aw_valid[m] && s_aw_ready[m] && s_aw_id[m*IDW +: TW] == i)
+\t\t\t\t\tw_tgt[m][i] <= aw_ch[m];
+\t\t\t\tr_out[m][i] <= r_out[m][i] + (s_ar_valid[m] && s_ar_ready[m] && s_ar_id[m*IDW +: TW] == i)
+\t\t\t\t\t- (s_r_valid[m] && s_r_ready[m] && s_r_last[m] && s_r_id[m*IDW +: TW] == i);
+\t\t\t\tif (s_ar_valid[m] && s_ar_ready[m] && s_ar_id[m*IDW +: TW] == i)
+\t\t\t\t\tr_tgt[m][i] <= ar_ch[m];
+\t\t\tend
+\t\tend
+\tend
+end
+endmodule
+"""
+
+AXI_PERF = """
+// Performance counters for one AXI memory port. Only looks at the handshake signals, it never drives the port.
+// Register block (32-bit words, 64-bit counters low word first), kept in sync with aws_tools.perf_registers:
+//   0 cycles, 2 aw_count, 4 w_beats, 6 b_count, 8 ar_count, 10 r_beats,
+//   12 aw_stall, 14 w_stall, 16 b_stall, 18 ar_stall, 20 r_stall (cycles with valid and no ready),
+//   22 rd_outstanding, 23 wr_outstanding, 24..31 read latency histogram (AR to first R beat, buckets <32, <64, ...
+//   <2048, >=2048 cycles). Latency is sampled one read at a time, from reads whose ID slot (low TW bits) has nothing
+//   else outstanding so that the next response with that ID is theirs. freeze holds all counters, clear zeroes them.
+module beethoven_axi_perf #(parameter IDW = 1, parameter CW = 8, parameter TW = (IDW < 6) ? IDW : 6) (
+\tinput clk,
+\tinput rst,
+\tinput freeze,
+\tinput clear,
+\tinput aw_valid,
+\tinput aw_ready,
+\tinput w_valid,
+\tinput w_ready,
+\tinput b_valid,
+\tinput b_ready,
+\tinput ar_valid,
+\tinput ar_ready,
+\tinput [IDW-1:0] ar_id,
+\tinput r_valid,
+\tinput r_ready,
+\tinput [IDW-1:0] r_id,
+\tinput r_last,
+\toutput [32*32-1:0] regs
+);
+localparam N64 = 11;
+logic [63:0] count [N64];
+logic [31:0] hist [8];
+logic [31:0] rd_outstanding, wr_outstanding;
+wire [N64-1:0] inc = {r_valid && !r_ready, ar_valid && !ar_ready, b_valid && !b_ready, w_valid && !w_ready,
+\taw_valid && !aw_ready, r_valid && r_ready, ar_valid && ar_ready, b_valid && b_ready, w_valid && w_ready,
+\taw_valid && aw_ready, 1'b1};
+wire ar_fire = ar_valid && ar_ready;
+wire r_fire = r_valid && r_ready;
+
+// outstanding reads per ID slot
+logic [CW-1:0] id_out [1 << TW];
+logic sampling;
+logic [IDW-1:0] sample_id;
+logic [31:0] sample_time;
+wire sample_done = sampling && r_fire && r_id == sample_id;
+
+function automatic [2:0] bucket(input [31:0] t);
+\tbucket = 7;
+\tfor (int k = 6; k >= 0; k--)
+\t\tif (t < (32 << k))
+\t\t\tbucket = 3'(k);
+endfunction
+
+genvar gi;
+generate
+\tfor (gi = 0; gi < N64; gi++)
+\tbegin : counter
+\t\tassign regs[gi*64 +: 64] = count[gi];
+\tend
+\tfor (gi = 0; gi < 8; gi++)
+\tbegin : histogram
+\t\tassign regs[(24+gi)*32 +: 32] = hist[gi];
+\tend
+endgenerate
+assign regs[22*32 +: 32] = rd_outstanding;
+assign regs[23*32 +: 32] = wr_outstanding;
+
+always_ff @(posedge clk)
+begin
+\tif (rst)
+\tbegin
+\t\trd_outstanding <= 0;
+\t\twr_outstanding <= 0;
+\t\tsampling <= 0;
+\t\tfor (int i = 0; i < (1 << TW); i++)
+\t\t\tid_out[i] <= 0;
+\tend
+\telse
+\tbegin
+\t\trd_outstanding <= rd_outstanding + ar_fire - (r_fire && r_last);
+\t\twr_outstanding <= wr_outstanding + (aw_valid && aw_ready) - (b_valid && b_ready);
+\t\tfor (int i = 0; i < (1 << TW); i++)
+\t\t\tid_out[i] <= id_out[i] + (ar_fire && ar_id[TW-1:0] == i) - (r_fire && r_last && r_id[TW-1:0] == i);
+\t\tif (!sampling)
+\t\tbegin
+\t\t\tif (ar_fire && id_out[ar_id[TW-1:0]] == 0 && !(r_valid && r_id[TW-1:0] == ar_id[TW-1:0]))
+\t\t\tbegin
+\t\t\t\tsampling <= 1;
+\t\t\t\tsample_id <= ar_id;
+\t\t\t\tsample_time <= 1;
+\t\t\tend
+\t\tend
+\t\telse if (sample_done)
+\t\t\tsampling <= 0;
+\t\telse
+\t\t\tsample_time <= sample_time + 1;
+\tend
+end
+
+always_ff @(posedge clk)
+begin
+\tif (rst || clear)
+\tbegin
+\t\tfor (int i = 0; i < N64; i++)
+\t\t\tcount[i] <= 0;
+\t\tfor (int i = 0; i < 8; i++)
+\t\t\thist[i] <= 0;
+\tend
+\telse if (!freeze)
+\tbegin
+\t\tfor (int i = 0; i < N64; i++)
+\t\t\tcount[i] <= count[i] + inc[i];
+\t\tif (sample_done)
+\t\t\thist[bucket(sample_time)] <= hist[bucket(sample_time)] + 1;
+\tend
+end
+endmodule
+"""
+
+PERF_OCL = """
+// Sits on the OCL path in front of BeethovenTop and answers accesses to a 4 KiB window at BASE from the performance
+// counters, everything else is passed through. Handles one read and one write at a time, a write's address and data
+// are taken in parallel, as soon as the address says where they go. Window layout: word 0 is
+// control (bit 0 freeze, bit 1 clear), word 1 the number of ports, port k's register block starts at 128 * (k + 1).
+module beethoven_perf_ocl #(parameter AW = 32, parameter BASE = 0, parameter NPORTS = 1) (
+\tinput clk,
+\tinput rst,
+\tinput [AW-1:0] s_awaddr,
+\tinput s_awvalid,
+\toutput logic s_awready,
+\tinput [31:0] s_wdata,
+\tinput [3:0] s_wstrb,
+\tinput s_wvalid,
+\toutput logic s_wready,
+\toutput logic [1:0] s_bresp,
+\toutput logic s_bvalid,
+\tinput s_bready,
+\tinput [AW-1:0] s_araddr,
+\tinput s_arvalid,
+\toutput logic s_arready,
+\toutput logic [31:0] s_rdata,
+\toutput logic [1:0] s_rresp,
+\toutput logic s_rvalid,
+\tinput s_rready,
+\toutput logic [AW-1:0] m_awaddr,
+\toutput logic m_awvalid,
+\tinput m_awready,
+\toutput logic [31:0] m_wdata,
+\toutput logic [3:0] m_wstrb,
+\toutput logic m_wvalid,
+\tinput m_wready,
+\tinput [1:0] m_bresp,
+\tinput m_bvalid,
+\toutput logic m_bready,
+\toutput logic [AW-1:0] m_araddr,
+\toutput logic m_arvalid,
+\tinput m_arready,
+\tinput [31:0] m_rdata,
+\tinput [1:0] m_rresp,
+\tinput m_rvalid,
+\toutput logic m_rready,
+\tinput [NPORTS*32*32-1:0] regs,
+\toutput logic freeze,
+\toutput logic clear
+);
+localparam IDLE = 2'd0, FWD = 2'd1, LOCAL = 2'd2, RESP = 2'd3;
+logic [1:0] wstate, rstate;
+logic aw_done, w_done, w_local_q, w_ctrl_q;
+// where the write in IDLE goes, from the accepted address or the one being presented
+logic w_known, w_local, w_ctrl, aw_fire, w_fire;
+logic [31:0] rdata_q;
+
+function automatic local_addr(input [AW-1:0] addr);
+\tlocal_addr = (addr >> 12) == (AW'(BASE) >> 12);
+endfunction
+
+function automatic [31:0] lookup(input [AW-1:0] addr);
+\tlogic [9:0] word;
+\tword = addr[11:2];
+\tif (word == 0)
+\t\tlookup = {30'b0, 1'b0, freeze};
+\telse if (word == 1)
+\t\tlookup = NPORTS;
+\telse if (word >= 32 && (word >> 5) - 1 < NPORTS)
+\t\tlookup = regs[(word - 32) * 32 +: 32];
+\telse
+\t\tlookup = 0;
+endfunction
+
+always_comb
+begin
+\tm_awaddr = s_awaddr;
+\tm_wdata = s_wdata;
+\tm_wstrb = s_wstrb;
+\tm_araddr = s_araddr;
+\tm_awvalid = 0;
+\ts_awready = 0;
+\tm_wvalid = 0;
+\ts_wready = 0;
+\tm_bready = 0;
+\ts_bvalid = 0;
+\ts_bresp = 0;
+\tw_known = aw_done || s_awvalid;
+\tw_local = aw_done ? w_local_q : local_addr(s_awaddr);
+\tw_ctrl = aw_done ? w_ctrl_q : s_awaddr[11:2] == 0;
+\tcase (wstate)
+\t\tIDLE:
+\t\tbegin
+\t\t\t// AW and W are handed on independently, a slave may wait for both before accepting either
+\t\t\tif (s_awvalid && !aw_done)
+\t\t\tbegin
+\t\t\t\tif (w_local)
+\t\t\t\t\ts_awready = 1;
+\t\t\t\telse
+\t\t\t\tbegin
+\t\t\t\t\tm_awvalid = 1;
+\t\t\t\t\ts_awready = m_awready;
+\t\t\t\tend
+\t\t\tend
+\t\t\tif (w_known && !w_done)
+\t\t\tbegin
+\t\t\t\tif (w_local)
+\t\t\t\t\ts_wready = 1;
+\t\t\t\telse
+\t\t\t\tbegin
+\t\t\t\t\tm_wvalid = s_wvalid;
+\t\t\t\t\ts_wready = m_wready;
+\t\t\t\tend
+\t\t\tend
+\t\tend
+\t\tFWD:
+\t\tbegin
+\t\t\ts_bvalid = m_bvalid;
+\t\t\ts_bresp = m_bresp;
+\t\t\tm_bready = s_bready;
+\t\tend
+\t\tdefault:
+\t\t\ts_bvalid = 1;
+\tendcase
+\taw_fire = s_awvalid && s_awready;
+\tw_fire = s_wvalid && s_wready;
+\tm_arvalid = 0;
+\ts_arready = 0;
+\tm_rready = 0;
+\ts_rvalid = 0;
+\ts_rdata = rdata_q;
+\ts_rresp = 0;
+\tcase (rstate)
+\t\tIDLE:
+\t\t\tif (s_arvalid)
+\t\t\tbegin
+\t\t\t\tif (local_addr(s_araddr))
+\t\t\t\t\ts_arready = 1;
+\t\t\t\telse
+\t\t\t\tbegin
+\t\t\t\t\tm_arvalid = 1;
+\t\t\t\t\ts_arready = m_arready;
+\t\t\t\tend
+\t\t\tend
+\t\tFWD:
+\t\tbegin
+\t\t\ts_rvalid = m_rvalid;
+\t\t\ts_rdata = m_rdata;
+\t\t\ts_rresp = m_rresp;
+\t\t\tm_rready = s_rready;
+\t\tend
+\t\tdefault:
+\t\t\ts_rvalid = 1;
+\tendcase
+end
+
+always_ff @(posedge clk)
+begin
+\tclear <= 0;
+\tif (rst)
+\tbegin
+\t\twstate <= IDLE;
+\t\trstate <= IDLE;
+\t\taw_done <= 0;
+\t\tw_done <= 0;
+\t\tfreeze <= 0;
+\tend
+\telse
+\tbegin
+\t\tcase (wstate)
+\t\t\tIDLE:
+\t\t\tbegin
+\t\t\t\tif (aw_fire)
+\t\t\t\tbegin
+\t\t\t\t\taw_done <= 1;
+\t\t\t\t\tw_local_q <= w_local;
+\t\t\t\t\tw_ctrl_q <= w_ctrl;
+\t\t\t\tend
+\t\t\t\tif (w_fire)
+\t\t\t\tbegin
+\t\t\t\t\tw_done <= 1;
+\t\t\t\t\tif (w_local && w_ctrl && s_wstrb[0])
+\t\t\t\t\tbegin
+\t\t\t\t\t\tfreeze <= s_wdata[0];
+\t\t\t\t\t\tclear <= s_wdata[1];
+\t\t\t\t\tend
+\t\t\t\tend
+\t\t\t\t// both halves accepted, wait for the response
+\t\t\t\tif ((aw_done || aw_fire) && (w_done || w_fire))
+\t\t\t\tbegin
+\t\t\t\t\twstate <= w_local ? RESP : FWD;
+\t\t\t\t\taw_done <= 0;
+\t\t\t\t\tw_done <= 0;
+\t\t\t\tend
+\t\t\tend
+\t\t\tFWD:
+\t\t\t\tif (s_bvalid && s_bready)
+\t\t\t\t\twstate <= IDLE;
+\t\t\tRESP:
+\t\t\t\tif (s_bready)
+\t\t\t\t\twstate <= IDLE;
+\t\tendcase
+\t\tcase (rstate)
+\t\t\tIDLE:
+\t\t\t\tif (s_arvalid && s_arready)
+\t\t\t\tbegin
+\t\t\t\t\trstate <= local_addr(s_araddr) ? LOCAL : FWD;
+\t\t\t\t\trdata_q <= lookup(s_araddr);
+\t\t\t\tend
+\t\t\tFWD:
+\t\t\t\tif (s_rvalid && s_rready)
+\t\t\t\t\trstate <= IDLE;
+\t\t\tdefault:
+\t\t\t\tif (s_rready)
+\t\t\t\t\trstate <= IDLE;
+\t\tendcase
+\tend
+end
+endmodule
+"""
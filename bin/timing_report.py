@@ -0,0 +1,252 @@
+import heapq
+import os
+import re
+import sqlite3
+import time
+import util
+
+# Post-route timing reports (report_timing_summary output) as data, and a per-build history of them. Reports are read
+# line by line, routed timing summaries of large designs run into hundreds of MB.
+
+history_db = f"{util.beethoven_cache}/timing_history.db"
+
+_slack = re.compile(r"^\s*Slack(?: \((VIOLATED|MET)\))?\s*:\s*(-?[\d.]+|inf)ns")
+_field = re.compile(r"^\s{2}(Source|Destination|Path Group|Path Type|Requirement|Data Path Delay|Logic Levels)"
+                    r":\s*(.*?)\s*$")
+_clock = re.compile(r"^\s*(From|To) Clock:\s*(\S+)")
+_delay = re.compile(r"^(-?[\d.]+)ns\s*\(logic (-?[\d.]+)ns.*route (-?[\d.]+)ns")
+_ns = re.compile(r"^(-?[\d.]+)ns")
+
+# numeric columns of the design summary and the clock tables, in report order
+summary_cols = ['wns', 'tns', 'tns_failing', 'tns_total', 'whs', 'ths', 'ths_failing', 'ths_total']
+_tables = {'Design Timing Summary': 0, 'Intra Clock Table': 1, 'Inter Clock Table': 2}
+
+
+def _number(s):
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _table_row(ln, spans, n_names):
+    # Values are right-aligned under the dashes of the header. Clocks without paths leave their columns empty, so
+    # fall back on the column positions when the row has fewer fields than the header.
+    fields = ln.split()
+    if len(fields) >= len(spans):
+        return fields[:n_names], [_number(x) for x in fields[n_names:]]
+    return fields[:n_names], [_number(ln[s:e].strip()) if ln[s:e].strip() != "" else None for s, e in spans[n_names:]]
+
+
+def parse_timing_report(fname, top_n=10):
+    """
+    Stream a report_timing_summary report. Returns
+      {'summary': {wns, tns, tns_failing, ..., whs, ths, ...},
+       'clocks': [{'from', 'to', wns, tns, ...}] (from == to for the intra-clock table),
+       'paths': [the top_n worst violating paths, worst first],
+       'violated': True if anything in the report is VIOLATED}
+    """
+    report = {'summary': None, 'clocks': [], 'paths': [], 'violated': False}
+    worst = []  # heap of (-slack, n, path), the best of the kept paths on top
+    section = None
+    pending = None
+    table = None
+    clocks = [None, None]
+    path = None
+    n = 0
+
+    def close_path():
+        nonlocal n
+        if path is None or not path['violated'] or path['slack'] is None or top_n <= 0:
+            return
+        n += 1
+        if len(worst) < top_n:
+            heapq.heappush(worst, (-path['slack'], n, path))
+        elif -path['slack'] > worst[0][0]:
+            heapq.heapreplace(worst, (-path['slack'], n, path))
+
+    with open(fname) as f:
+        for ln in f:
+            if "VIOLATED" in ln:
+                report['violated'] = True
+            stripped = ln.strip()
+            if table is not None:
+                if stripped == "":
+                    table = None
+                    continue
+                names, values = _table_row(ln.rstrip("\n"), table[1], _tables[table[0]])
+                row = dict(zip(summary_cols, values))
+                if table[0] == 'Design Timing Summary':
+                    report['summary'] = row
+                else:
+                    row.update({'from': names[0], 'to': names[-1]})
+                    report['clocks'].append(row)
+                continue
+            if stripped.startswith("| "):
+                if not stripped[2:].startswith("-"):
+                    section = stripped[2:].strip()
+                pending = None
+                continue
+            if section in _tables:
+                if "WNS(ns)" in ln:
+                    pending = section
+                elif pending is not None and stripped.startswith("-"):
+                    table = (pending, [(m.start(), m.end()) for m in re.finditer(r"-+", ln.rstrip("\n"))])
+                    pending = None
+                continue
+            m = _clock.match(ln)
+            if m is not None:
+                clocks[0 if m.group(1) == 'From' else 1] = m.group(2)
+                continue
+            m = _slack.match(ln)
+            if m is not None:
+                close_path()
+                path = {'slack': None if m.group(2) == 'inf' else float(m.group(2)),
+                        'violated': m.group(1) == 'VIOLATED', 'from_clock': clocks[0], 'to_clock': clocks[1]}
+                continue
+            if path is None:
+                continue
+            m = _field.match(ln)
+            if m is None:
+                continue
+            key, value = m.group(1), m.group(2)
+            if key == 'Data Path Delay':
+                d = _delay.match(value)
+                if d is not None:
+                    path['data_path_delay'] = float(d.group(1))
+                    path['logic_delay'] = float(d.group(2))
+                    path['route_delay'] = float(d.group(3))
+            elif key == 'Requirement':
+                d = _ns.match(value)
+                path['requirement'] = None if d is None else float(d.group(1))
+            elif key == 'Logic Levels':
+                # "5  (CARRY8=1 LUT6=4)"
+                path['logic_levels'] = int(value.split()[0]) if value[:1].isdigit() else None
+                path['logic_detail'] = value
+            elif key == 'Path Type':
+                path['path_type'] = value.split()[0] if value != "" else value
+            else:
+                # Source and Destination continue with the clocking detail on the next line
+                path[key.lower().replace(' ', '_')] = value.split()[0] if value != "" else value
+        close_path()
+    report['paths'] = [p for _, _, p in sorted(worst, reverse=True)]
+    return report
+
+
+def open_history(db=None):
+    db = db or history_db
+    os.makedirs(os.path.dirname(db), exist_ok=True)
+    conn = sqlite3.connect(db)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS builds (
+            id INTEGER PRIMARY KEY, project TEXT, build TEXT, report TEXT, recorded REAL,
+            wns REAL, tns REAL, tns_failing REAL, tns_total REAL, whs REAL, ths REAL, ths_failing REAL, ths_total REAL,
+            violated INTEGER, UNIQUE(project, build));
+        CREATE TABLE IF NOT EXISTS clocks (
+            build_id INTEGER, from_clock TEXT, to_clock TEXT,
+            wns REAL, tns REAL, tns_failing REAL, tns_total REAL, whs REAL, ths REAL, ths_failing REAL, ths_total REAL);
+        CREATE TABLE IF NOT EXISTS paths (
+            build_id INTEGER, rank INTEGER, slack REAL, path_type TEXT, path_group TEXT, from_clock TEXT,
+            to_clock TEXT, source TEXT, destination TEXT, requirement REAL, data_path_delay REAL, logic_delay REAL,
+            route_delay REAL, logic_levels INTEGER);
+    """)
+    return conn
+
+
+def record_build(report, build, project=None, fname=None, db=None):
+    # A build that is recorded again replaces its earlier entry. Returns the build's row id.
+    project = project or os.getcwd()
+    conn = open_history(db)
+    with conn:
+        old = conn.execute("SELECT id FROM builds WHERE project = ? AND build = ?", (project, build)).fetchone()
+        if old is not None:
+            for t in ['clocks', 'paths']:
+                conn.execute(f"DELETE FROM {t} WHERE build_id = ?", old)
+            conn.execute("DELETE FROM builds WHERE id = ?", old)
+        summary = report['summary'] or {}
+        cur = conn.execute(
+            f"INSERT INTO builds (project, build, report, recorded, {', '.join(summary_cols)}, violated) "
+            f"VALUES ({', '.join(['?'] * (len(summary_cols) + 5))})",
+            [project, build, fname, time.time()] + [summary.get(c) for c in summary_cols] + [int(report['violated'])])
+        build_id = cur.lastrowid
+        conn.executemany(
+            f"INSERT INTO clocks VALUES ({', '.join(['?'] * (len(summary_cols) + 3))})",
+            [[build_id, c['from'], c['to']] + [c.get(k) for k in summary_cols] for c in report['clocks']])
+        conn.executemany(
+            "INSERT INTO paths VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [[build_id, i, p['slack'], p.get('path_type'), p.get('path_group'), p.get('from_clock'),
+              p.get('to_clock'), p.get('source'), p.get('destination'), p.get('requirement'),
+              p.get('data_path_delay'), p.get('logic_delay'), p.get('route_delay'), p.get('logic_levels')]
+             for i, p in enumerate(report['paths'])])
+    conn.close()
+    return build_id
+
+
+def _rows(conn, query, args):
+    cur = conn.execute(query, args)
+    names = [d[0] for d in cur.description]
+    return [dict(zip(names, r)) for r in cur.fetchall()]
+
+
+def list_builds(project=None, last=None, db=None):
+    # oldest first
+    conn = open_history(db)
+    rows = _rows(conn, "SELECT * FROM builds WHERE project = ? ORDER BY recorded", (project or os.getcwd(),))
+    conn.close()
+    return rows if last is None else rows[-last:]
+
+
+def load_build(build, project=None, db=None):
+    # {build row, 'clocks': [...], 'paths': [...]} or None
+    conn = open_history(db)
+    rows = _rows(conn, "SELECT * FROM builds WHERE project = ? AND build = ?", (project or os.getcwd(), build))
+    if len(rows) == 0:
+        conn.close()
+        return None
+    b = rows[0]
+    b['clocks'] = _rows(conn, "SELECT * FROM clocks WHERE build_id = ?", (b['id'],))
+    b['paths'] = _rows(conn, "SELECT * FROM paths WHERE build_id = ? ORDER BY rank", (b['id'],))
+    conn.close()
+    return b
+
+
+def diff_builds(a, b):
+    """
+    What moved between two loaded builds: per clock pair WNS/TNS/WHS change, and which failing endpoints are new
+    in b and which got fixed.
+    """
+    def key(c):
+        return c['from_clock'], c['to_clock']
+
+    old = {key(c): c for c in a['clocks']}
+    clocks = []
+    for c in b['clocks']:
+        o = old.get(key(c), {})
+        clocks.append({'from': c['from_clock'], 'to': c['to_clock'],
+                       **{f"{k}_delta": None if c[k] is None or o.get(k) is None else c[k] - o[k]
+                          for k in ['wns', 'tns', 'whs']},
+                       'wns': c['wns'], 'tns': c['tns'], 'whs': c['whs'], 'new': key(c) not in old})
+    a_ends = {p['destination']: p for p in a['paths']}
+    b_ends = {p['destination']: p for p in b['paths']}
+    return {'wns_delta': None if a['wns'] is None or b['wns'] is None else b['wns'] - a['wns'],
+            'tns_delta': None if a['tns'] is None or b['tns'] is None else b['tns'] - a['tns'],
+            'clocks': clocks,
+            'new_failing': [p for d, p in b_ends.items() if d not in a_ends],
+            'fixed': [p for d, p in a_ends.items() if d not in b_ends],
+            'worse': [(a_ends[d], p) for d, p in b_ends.items() if d in a_ends and p['slack'] < a_ends[d]['slack']]}
+
+
+def format_summary(report):
+    # short human-readable version of parse_timing_report's output
+    s = report['summary'] or {}
+    failing = None if s.get('tns_failing') is None else int(s['tns_failing'])
+    out = [f"WNS {s.get('wns')}ns  TNS {s.get('tns')}ns ({failing} failing endpoints)  "
+           f"WHS {s.get('whs')}ns  THS {s.get('ths')}ns"]
+    for c in report['clocks']:
+        if (c['wns'] is not None and c['wns'] < 0) or (c['whs'] is not None and c['whs'] < 0):
+            name = c['from'] if c['from'] == c['to'] else f"{c['from']} -> {c['to']}"
+            out.append(f"  {name}: WNS {c['wns']}ns TNS {c['tns']}ns WHS {c['whs']}ns")
+    for p in report['paths']:
+        out.append(f"  {p['slack']:8.3f}ns {p.get('path_type', '')} {p.get('source')} -> {p.get('destination')} "
+                   f"(levels {p.get('logic_levels')}, logic {p.get('logic_delay')}ns, route {p.get('route_delay')}ns)")
+    return "\n".join(out)
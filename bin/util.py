@@ -1,9 +1,11 @@
 import os
 import sys
 import json
+import shutil
 
 
 aws_cache = os.environ['HOME'] + "/.aws-cache"
+beethoven_cache = os.environ['HOME'] + "/.beethoven-cache"
 
 
 def get_config():
@@ -26,7 +28,21 @@ def append_to_file(dst, src):
     if not os.path.exists(dst) or not os.path.exists(src):
         print("Weak warning: No constraints found. Not appending")
         return
-    a = open(dst, "a")
-    with open(src, 'r') as f:
-        for ln in f.readlines():
-            a.write(ln)
+    append_file(dst, src)
+
+
+def append_file(dst, src):
+    # Stream src onto the end of dst. Memory use stays constant regardless of the file sizes.
+    with open(dst, 'ab') as a, open(src, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                sent = os.sendfile(a.fileno(), f.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except (AttributeError, OSError):
+            # no sendfile for regular files on this platform
+            f.seek(offset)
+            shutil.copyfileobj(f, a, 16 * 1024 * 1024)
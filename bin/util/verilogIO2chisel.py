@@ -1,6 +1,15 @@
 import math
 import sys
 
+# Width in bytes of the memory bus of the platforms the harness can be built for, wide inputs are read in beats of
+# up to this size
+platform_bus_bytes = {"KriaPlatform": 16, "AWSF2Platform": 64}
+# how HLSRun.scala constructs each platform, AWSF2Platform takes its Parameters implicitly
+platform_constructors = {"KriaPlatform": "KriaPlatform()", "AWSF2Platform": "new AWSF2Platform"}
+default_platform = "KriaPlatform"
+# wide inputs up to this many bits share one burst
+default_pack_bits = 512
+
 
 # Given a file `<name>.v` with topmodule <name>, output to text the
 # IOs for that module as a Chisel bundle. All multi-bit inputs will
@@ -43,8 +52,30 @@ val io = IO(new Bundle {{
     return inputs, outputs
 
 
-def generate_beethoven_harness_from_spec(io_pr, ofile, nm):
+def read_channel_bytes(nbytes, bus_bytes):
+    # Widest beat that fits the bus and divides the argument, so that nothing past its end is read. Arguments are
+    # multiples of 4 bytes, so this is at least 4.
+    return min(bus_bytes, nbytes & -nbytes)
+
+
+def field_offsets(fields):
+    # bit offset of each (name, width) when they are laid out back to back, the first at the lowest address
+    offsets = []
+    off = 0
+    for _, w in fields:
+        offsets.append(off)
+        off += w
+    return offsets
+
+
+def generate_beethoven_harness_from_spec(io_pr, ofile, nm, platform=default_platform, bus_bytes=None,
+                                         pack_bits=default_pack_bits):
     inputs, outputs = io_pr
+    if bus_bytes is None:
+        if platform not in platform_bus_bytes:
+            print(f"Error: no bus width known for {platform}, give it with --bus_bytes")
+            exit(1)
+        bus_bytes = platform_bus_bytes[platform]
     # just look for memories and setup right now
     # memories are structed as <prefix>_[address, q, d, ce, we][<number>]
     # store memories as (prefix, <number> (None if not present))
@@ -130,6 +161,70 @@ mod.io.{prefix}_q{number} := {prefix}_sp.dataChannels({number}).res.bits
         #     "address": f"{prefix}_address{number}",
         #     "hook_up":
         # })
+    # Inputs wider than 64 bits are read from memory. Each gets a reader as wide as the bus allows, those of at most
+    # pack_bits are laid out back to back at one address and loaded with a single burst.
+    packed = []
+
+    def wide_loader(channel, fields):
+        total = sum(w for _, w in fields)
+        if total % 32 != 0:
+            print(f"Error: {', '.join(n for n, _ in fields)} must be a multiple of 32 bits wide")
+            exit(1)
+        nbytes = total // 8
+        note = ""
+        if len(fields) > 1:
+            # The layout of a packed block is ours, so it is padded to whole beats rather than narrowing the beat.
+            # The burst then reads past the data, the host has to allocate the block at the padded size.
+            beat_bytes = min(bus_bytes, 1 << (nbytes - 1).bit_length())
+            padded = -(-nbytes // beat_bytes) * beat_bytes
+            layout = ", ".join(f"{n[:-2]} @ {off // 8}" for (n, _), off in zip(fields, field_offsets(fields)))
+            note = (f"// input_{channel}_addr: {', '.join(n[:-2] for n, _ in fields)} back to back ({layout}), "
+                    f"{nbytes}B of data read as one {padded}B burst, allocate the buffer at {padded}B\n")
+            print(note[3:].strip())
+            nbytes = padded
+        else:
+            beat_bytes = read_channel_bytes(nbytes, bus_bytes)
+        beats = nbytes // beat_bytes
+        io_defs.append(f"val input_{channel}_addr = Address()")
+        declarations.append(f"""
+{note}val reg_{channel} = Reg(Vec({beats}, UInt({beat_bytes * 8}.W)))
+val wire_{channel} = reg_{channel}.asUInt
+val ReaderModuleChannel(req_{channel}, dat_{channel}) = getReaderModule("{channel}")
+val sm_{channel}_idle :: sm_{channel}_mem :: Nil = Enum(2)
+val state_{channel} = RegInit(sm_{channel}_idle)
+dat_{channel}.data.ready := false.B
+
+req_{channel}.bits.addr := io.req.bits.input_{channel}_addr
+req_{channel}.bits.len := {nbytes}.U
+req_{channel}.valid := io.req.fire
+
+val {channel}_in_ctr = Reg(UInt(log2Up({beats}).W))
+when (state_{channel} === sm_{channel}_idle) {{
+    when (io.req.fire) {{
+        state_{channel} := sm_{channel}_mem
+        {channel}_in_ctr := 0.U
+    }}
+}}.elsewhen (state_{channel} === sm_{channel}_mem) {{
+    dat_{channel}.data.ready := true.B
+    when (dat_{channel}.data.fire) {{
+        reg_{channel}({channel}_in_ctr) := dat_{channel}.data.bits
+        {channel}_in_ctr := {channel}_in_ctr + 1.U
+        when ({channel}_in_ctr === {beats - 1}.U) {{
+            state_{channel} := sm_{channel}_idle
+        }}
+    }}
+}}
+""")
+        secondary_ready_conditions.append(f"(state_{channel} === sm_{channel}_idle)")
+        # the first beat is the lowest address and ends up in the low bits
+        for (name, w), off in zip(fields, field_offsets(fields)):
+            attaches_and_state_machines.append(f"""mod.io.{name} := wire_{channel}({off + w - 1}, {off})""")
+        memory_configs.append(f"""
+        ReadChannelConfig(
+          name = "{channel}",
+          dataBytes = {beat_bytes}
+)""")
+
     for name, w in inputs:
         if name[-2:] != "_i":
             continue
@@ -142,45 +237,14 @@ when (io.req.fire) {{
 }}
 mod.io.{name} := {name[:-2]}_reg
 """)
+        elif w <= pack_bits:
+            packed.append((name, w))
         else:
-            io_defs.append(f"val input_{name}_addr = Address()")
-            declarations.append(f"""
-assert({w} % 32 == 0)
-val reg_{name} = Reg(Vec({w//32}, UInt(32.W)))
-val wire_{name} = reg_{name}.asUInt
-val ReaderModuleChannel(req_{name}, dat_{name}) = getReaderModule("{name}")
-val sm_{name}_idle :: sm_{name}_mem :: Nil = Enum(2)
-val state_{name} = RegInit(sm_{name}_idle)
-dat_{name}.data.ready := false.B
-
-req_{name}.bits.addr := io.req.bits.input_{name}_addr
-req_{name}.bits.len := {w // 8}.U
-req_{name}.valid := io.req.fire
-
-val {name}_in_ctr = Reg(UInt(log2Up({w // 32}).W))
-when (state_{name} === sm_{name}_idle) {{
-    when (io.req.fire) {{
-        state_{name} := sm_{name}_mem
-        {name}_in_ctr := 0.U
-    }}
-}}.elsewhen (state_{name} === sm_{name}_mem) {{
-    dat_{name}.data.ready := true.B
-    when (dat_{name}.data.fire) {{
-        reg_{name}({name}_in_ctr) := dat_{name}.data.bits
-        {name}_in_ctr := {name}_in_ctr + 1.U
-        when ({name}_in_ctr === {(w // 32) - 1}.U) {{
-            state_{name} := sm_{name}_idle
-        }}
-    }}
-}}
-""")
-            secondary_ready_conditions.append(f"(state_{name} === sm_{name}_idle)")
-            attaches_and_state_machines.append(f"""mod.io.{name} := wire_{name}""")
-            memory_configs.append(f"""
-        ReadChannelConfig(
-          name = "{name}",
-          dataBytes = 4
-)""")
+            wide_loader(name, [(name, w)])
+    if len(packed) == 1:
+        wide_loader(packed[0][0], packed)
+    elif len(packed) > 1:
+        wide_loader("packed_i", packed)
 
     axi_m = set()
     axi_s = False
@@ -359,18 +423,29 @@ import chipsalliance.rocketchip.config._
 
 object HLSRun extends BeethovenBuild(
   new HLSConfig(1),
-  platform = KriaPlatform()
+  platform = {platform}
 )
 
-""")
+""".replace("{platform}", platform_constructors.get(platform, f"new {platform}")))
 
 
 if __name__ == '__main__':
     print(sys.argv)
-    if len(sys.argv) != 2:
-        print('Usage: verilogIO2chisel.py <file.v>')
+    args = {}
+    positional = []
+    for arg in sys.argv[1:]:
+        if arg[:2] == "--" and "=" in arg:
+            k, v = arg[2:].split("=", 1)
+            args.update({k: v})
+        else:
+            positional.append(arg)
+    if len(positional) != 1:
+        print(f'Usage: verilogIO2chisel.py <file.v> [--platform={default_platform}] [--bus_bytes=<bytes>] '
+              f'[--pack_bits={default_pack_bits}]')
         exit(1)
-    q = verilog_to_chisel_blackbox(sys.argv[1], 'bb.scala')
-    name = sys.argv[1].split('/')[-1].split('.')[0]
-    generate_beethoven_harness_from_spec(q, 'ch.scala', name)
+    q = verilog_to_chisel_blackbox(positional[0], 'bb.scala')
+    name = positional[0].split('/')[-1].split('.')[0]
+    generate_beethoven_harness_from_spec(q, 'ch.scala', name, args.get('platform', default_platform),
+                                         int(args['bus_bytes']) if 'bus_bytes' in args else None,
+                                         int(args.get('pack_bits', default_pack_bits)))
     exit(0)
@@ -0,0 +1,210 @@
+import math
+import os
+import ooc_synth
+
+# Where the resources of a build go, and how many cores would fit. create_dcp_from_cl.tcl writes a hierarchical
+# utilization report and the sites the CL can use in each SLR (<timestamp>.SH_CL_slr_capacity.txt). The cores are the
+# replicated modules ooc_synth finds in design/beethoven_aws.sv, everything else in the CL is interconnect and
+# Beethoven's own logic, which does not grow with the core count.
+
+resources = ['LUT', 'FF', 'BRAM', 'URAM', 'DSP']
+cl_module = "beethoven_aws"
+default_max_util = 0.8
+# a replicated module is a core from this size on, as for out-of-context synthesis (ooc_min_lines), so that queues
+# and arbiters the interconnect instantiates more than once stay part of the interconnect
+default_min_lines = 2000
+
+
+def _cells(ln):
+    return [c for c in ln.rstrip().rstrip("|").split("|")[1:]]
+
+
+def _number(s):
+    try:
+        return float(s.strip())
+    except ValueError:
+        return 0.0
+
+
+def _usage(header, cells):
+    # Column names differ between Vivado versions (DSP48 Blocks, DSP Blocks), BRAM is counted in RAMB36 tiles
+    u = dict.fromkeys(resources, 0.0)
+    for name, c in zip(header, cells):
+        if name == "Total LUTs":
+            u['LUT'] = _number(c)
+        elif name == "FFs":
+            u['FF'] = _number(c)
+        elif name == "RAMB36":
+            u['BRAM'] += _number(c)
+        elif name == "RAMB18":
+            u['BRAM'] += _number(c) / 2
+        elif name == "URAM":
+            u['URAM'] = _number(c)
+        elif name.startswith("DSP"):
+            u['DSP'] = _number(c)
+    return u
+
+
+def parse_hierarchical(fname):
+    """
+    Stream a `report_utilization -hierarchical` report. Returns [{instance, module, depth, path, LUT, FF, ...}] in
+    report order, path being the instance path from the top.
+    """
+    rows = []
+    header = None
+    stack = []
+    with open(fname, errors='replace') as f:
+        for ln in f:
+            if not ln.startswith("|"):
+                continue
+            cells = _cells(ln)
+            if header is None:
+                if cells and cells[0].strip() == "Instance":
+                    header = [c.strip() for c in cells]
+                continue
+            if len(cells) < len(header) or cells[0].strip() == "Instance":
+                continue
+            # one space of padding, then two per level of hierarchy
+            depth = (len(cells[0]) - len(cells[0].lstrip()) - 1) // 2
+            instance = cells[0].strip()
+            stack = stack[:depth] + [instance]
+            row = {'instance': instance, 'module': cells[1].strip(), 'depth': depth, 'path': "/".join(stack)}
+            row.update(_usage(header, cells))
+            rows.append(row)
+    return rows
+
+
+def parse_capacity(fname):
+    # {slr: {LUT, FF, ...}} and whether the capacity is the CL's pblock or the whole device
+    slrs = {}
+    scope = "device"
+    with open(fname) as f:
+        for ln in f:
+            fields = ln.split()
+            if len(fields) == 2 and fields[0] == "scope":
+                scope = fields[1]
+            elif len(fields) > 2:
+                slrs[fields[0]] = {k: float(v) for k, v in zip(fields[1::2], fields[2::2])}
+    return slrs, scope
+
+
+def core_modules(cl_dir, min_lines=default_min_lines):
+    # the cores split out for out-of-context synthesis, else the large replicated modules of the top-level source
+    ooc = f"{cl_dir}/design/{ooc_synth.ooc_dir}"
+    if os.path.isdir(ooc) and os.listdir(ooc):
+        return sorted(f[:-3] for f in os.listdir(ooc) if f.endswith(".sv"))
+    with open(f"{cl_dir}/design/beethoven_aws.sv") as f:
+        _, modules = ooc_synth.split_modules(f.read())
+    return sorted(ooc_synth.find_replicated(modules, 2, min_lines))
+
+
+def _is(module, name):
+    # Vivado reports parameterised copies as <module>__parameterized<n>
+    return module == name or module.startswith(name + "__parameterized")
+
+
+def _sub(a, b):
+    return {r: a[r] - b[r] for r in resources}
+
+
+def breakdown(rows, cores):
+    """
+    Resources of every core instance, the rest of the CL and the shell. Returns
+      {'total', 'cl', 'shell', 'interconnect': {resource: used}, 'cores': {module: {'instances': [{path, ...}],
+       'per_core': {resource: mean over the instances}}}}
+    """
+    total = rows[0] if rows else dict.fromkeys(resources, 0.0)
+    cl = next((r for r in rows if _is(r['module'], cl_module)), None)
+    if cl is None:
+        cl = next((r for r in rows if r['depth'] == 1), total)
+    out = {'total': {r: total[r] for r in resources}, 'cl': {r: cl[r] for r in resources}, 'cores': {}}
+    out['shell'] = _sub(total, cl)
+    in_cores = dict.fromkeys(resources, 0.0)
+    for core in cores:
+        instances = []
+        for row in rows:
+            if not _is(row['module'], core) or not row['path'].startswith(cl.get('path', '') + "/"):
+                continue
+            # only the outermost, instances of a core inside another one are already counted
+            if any(row['path'].startswith(i['path'] + "/") for c in out['cores'].values() for i in c['instances']):
+                continue
+            if any(row['path'].startswith(i['path'] + "/") for i in instances):
+                continue
+            instances.append({k: row[k] for k in ['path'] + resources})
+        if not instances:
+            continue
+        per_core = {r: sum(i[r] for i in instances) / len(instances) for r in resources}
+        out['cores'][core] = {'instances': instances, 'per_core': per_core}
+        for i in instances:
+            for r in resources:
+                in_cores[r] += i[r]
+    out['interconnect'] = _sub(out['cl'], in_cores)
+    return out
+
+
+def project(util, capacity, scope, max_util=default_max_util):
+    """
+    Largest number of cores of each kind that fits, with the other kinds at their current count. Per SLR that is
+    what fits into one SLR on its own, for the device it is the sum over the SLRs minus the interconnect (and the
+    shell when the capacity is the whole device). Every resource is filled to at most max_util so that the design
+    still routes. Returns {module: {'current', 'per_slr': {slr: (n, limiting resource)}, 'device': (n, limiting)}}.
+    """
+    fixed = dict(util['interconnect'])
+    if scope == "device":
+        fixed = {r: fixed[r] + util['shell'][r] for r in resources}
+    device = {r: sum(c.get(r, 0) for c in capacity.values()) for r in resources}
+    out = {}
+    for core, c in util['cores'].items():
+        others = {r: sum(len(o['instances']) * o['per_core'][r] for k, o in util['cores'].items() if k != core)
+                  for r in resources}
+
+        def fit(cap, used):
+            best = None
+            for r in resources:
+                if c['per_core'][r] <= 0:
+                    continue
+                n = max(0, math.floor((cap.get(r, 0) * max_util - used[r]) / c['per_core'][r]))
+                if best is None or n < best[0]:
+                    best = (n, r)
+            return best if best is not None else (None, None)
+
+        out[core] = {'current': len(c['instances']),
+                     'per_slr': {slr: fit(cap, dict.fromkeys(resources, 0.0)) for slr, cap in capacity.items()},
+                     'device': fit(device, {r: fixed[r] + others[r] for r in resources})}
+    return out
+
+
+def analyse(cl_dir, timestamp, max_util=default_max_util, cores=None, min_lines=default_min_lines):
+    reports = f"{cl_dir}/build/reports"
+    util = breakdown(parse_hierarchical(f"{reports}/{timestamp}.SH_CL_utilization_hierarchical.rpt"),
+                     core_modules(cl_dir, min_lines) if cores is None else cores)
+    cap_file = f"{reports}/{timestamp}.SH_CL_slr_capacity.txt"
+    if os.path.exists(cap_file):
+        capacity, scope = parse_capacity(cap_file)
+        util['capacity'] = capacity
+        util['scope'] = scope
+        util['projection'] = project(util, capacity, scope, max_util)
+    return util
+
+
+def latest_build(cl_dir):
+    reports = f"{cl_dir}/build/reports"
+    builds = sorted(f.split(".")[0] for f in os.listdir(reports) if f.endswith(".SH_CL_utilization_hierarchical.rpt"))
+    return builds[-1] if builds else None
+
+
+def format_breakdown(util):
+    def row(name, u, n=None):
+        return (f"{name[:32]:<32} {'' if n is None else n:>5} " +
+                " ".join(f"{u[r]:>10.0f}" if r != 'BRAM' else f"{u[r]:>10.1f}" for r in resources))
+
+    lines = [f"{'':<32} {'count':>5} " + " ".join(f"{r:>10}" for r in resources),
+             row("total", util['total']), row("shell", util['shell']), row("CL", util['cl']),
+             row("  interconnect and Beethoven", util['interconnect'])]
+    for core, c in util['cores'].items():
+        lines.append(row(f"  {core} (per core)", c['per_core'], len(c['instances'])))
+    for core, p in util.get('projection', {}).items():
+        slrs = ", ".join(f"{slr} {n} ({r})" for slr, (n, r) in p['per_slr'].items())
+        n, r = p['device']
+        lines.append(f"{core}: {p['current']} now, {n} fit the device ({r} bound), per SLR on its own: {slrs}")
+    return "\n".join(lines)
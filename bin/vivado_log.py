@@ -0,0 +1,260 @@
+import datetime
+import json
+import os
+import re
+import time
+
+# Build telemetry from Vivado logs. Every command logs its run time and memory when it finishes
+# ("place_design: Time (s): cpu = ... ; elapsed = ... . Memory (MB): peak = ..."), the log itself has the time of day
+# only here and there (session start, the AWS FPGA progress lines, synth.tcl). The timeline places each command by
+# its elapsed time after the last known time of day. Logs are read line by line and can be followed while Vivado is
+# still writing them.
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+_command = re.compile(r"^Command: (\w+)")
+_usage = re.compile(r"^(?:(\w+): )?Time \(s\): cpu = (\d+):(\d\d):(\d\d)(?:\.\d+)? ; "
+                    r"elapsed = (\d+):(\d\d):(\d\d)(?:\.\d+)? \. "
+                    r"Memory \(MB\): peak = ([\d.]+) ; gain = (-?[\d.]+)")
+_threads = re.compile(r"Multithreading enabled for (\w+) using a maximum of (\d+) (?:CPUs|processes)")
+_date = re.compile(r"(\w{3} \w{3} +\d+ \d\d:\d\d:\d\d \d{4})")
+_time_of_day = re.compile(r"^AWS FPGA: \((\d\d):(\d\d):(\d\d)\)")
+_exit = re.compile(r"Exiting Vivado at")
+
+# Vivado command -> build phase, everything else (reports, checkpoints, link_design, ...) is "other"
+phases = {'synth_design': 'synth', 'opt_design': 'opt', 'place_design': 'place', 'phys_opt_design': 'phys_opt',
+          'route_design': 'route'}
+phase_order = ['synth', 'opt', 'place', 'phys_opt', 'route', 'post_route_phys_opt', 'other']
+
+
+def _seconds(h, m, s):
+    return int(h) * 3600 + int(m) * 60 + int(s)
+
+
+def read_lines(fname, follow=False, pid=None, poll=5):
+    """
+    Lines of fname. With follow, keep reading as the file grows until Vivado says it is exiting or, if pid is given,
+    that process is gone and everything it wrote has been read.
+    """
+    def alive():
+        if pid is None:
+            return True
+        try:
+            os.kill(pid, 0)
+            return True
+        except OSError:
+            return False
+
+    while follow and not os.path.exists(fname):
+        if not alive():
+            return
+        time.sleep(poll)
+    with open(fname, errors='replace') as f:
+        partial = ""
+        while True:
+            ln = f.readline()
+            if ln.endswith("\n"):
+                yield partial + ln
+                partial = ""
+                if follow and _exit.search(ln):
+                    return
+                continue
+            partial += ln
+            if not follow:
+                if partial:
+                    yield partial
+                return
+            if not alive():
+                # the writer is gone, read what is left and stop
+                follow = False
+                continue
+            time.sleep(poll)
+
+
+def parse_log(lines, on_command=None):
+    """
+    Timeline of a Vivado run from its log lines. Returns
+      {'start', 'end' (ISO times or None), 'complete': True if Vivado exited normally,
+       'commands': [{command, phase, start, end, elapsed, cpu, peak_mb, gain_mb, threads}],
+       'phases': {phase: {start, end, elapsed, cpu, peak_mb, threads, runs}}, 'peak_mb', 'elapsed', 'cpu'}
+    on_command(timeline) is called every time a command finishes, for writing out partial timelines.
+    """
+    timeline = {'start': None, 'end': None, 'complete': False, 'commands': [], 'phases': {}, 'peak_mb': 0.0,
+                'elapsed': 0, 'cpu': 0}
+    clock = None
+    current = None
+    routed = False
+
+    def iso(t):
+        return None if t is None else t.isoformat(timespec='seconds')
+
+    for ln in lines:
+        m = _date.search(ln)
+        if m is not None and ("Start of session" in ln or "Running synth_design" in ln or _exit.search(ln)):
+            try:
+                clock = datetime.datetime.strptime(" ".join(m.group(1).split()), "%a %b %d %H:%M:%S %Y")
+            except ValueError:
+                pass
+            if timeline['start'] is None:
+                timeline['start'] = iso(clock)
+            if _exit.search(ln):
+                timeline['complete'] = True
+                timeline['end'] = iso(clock)
+            continue
+        m = _time_of_day.match(ln)
+        if m is not None and clock is not None:
+            t = clock.replace(hour=int(m.group(1)), minute=int(m.group(2)), second=int(m.group(3)))
+            if t < clock - datetime.timedelta(hours=1):
+                t += datetime.timedelta(days=1)
+            clock = t
+            continue
+        m = _command.match(ln)
+        if m is not None:
+            phase = phases.get(m.group(1), 'other')
+            if phase == 'phys_opt' and routed:
+                phase = 'post_route_phys_opt'
+            routed = routed or m.group(1) == 'route_design'
+            current = {'command': m.group(1), 'phase': phase, 'start': iso(clock), 'end': None, 'elapsed': None,
+                       'cpu': None, 'peak_mb': 0.0, 'gain_mb': None, 'threads': None}
+            continue
+        m = _threads.search(ln)
+        if m is not None and current is not None:
+            current['threads'] = int(m.group(2))
+            continue
+        m = _usage.match(ln)
+        if m is None:
+            continue
+        peak = float(m.group(8))
+        timeline['peak_mb'] = max(timeline['peak_mb'], peak)
+        if current is None:
+            continue
+        current['peak_mb'] = max(current['peak_mb'], peak)
+        if m.group(1) != current['command']:
+            # progress line of a sub-step
+            continue
+        current['cpu'] = _seconds(*m.group(2, 3, 4))
+        current['elapsed'] = _seconds(*m.group(5, 6, 7))
+        current['gain_mb'] = float(m.group(9))
+        if clock is not None:
+            clock = clock + datetime.timedelta(seconds=current['elapsed'])
+            current['end'] = iso(clock)
+        timeline['commands'].append(current)
+        timeline['elapsed'] += current['elapsed']
+        timeline['cpu'] += current['cpu']
+        p = timeline['phases'].setdefault(current['phase'], {'start': current['start'], 'end': None, 'elapsed': 0,
+                                                             'cpu': 0, 'peak_mb': 0.0, 'threads': None, 'runs': 0})
+        p['end'] = current['end']
+        p['elapsed'] += current['elapsed']
+        p['cpu'] += current['cpu']
+        p['peak_mb'] = max(p['peak_mb'], current['peak_mb'])
+        if current['threads'] is not None:
+            p['threads'] = max(p['threads'] or 0, current['threads'])
+        p['runs'] += 1
+        current = None
+        if on_command is not None:
+            on_command(timeline)
+    if timeline['end'] is None:
+        timeline['end'] = iso(clock)
+    return timeline
+
+
+def build_name(log):
+    # aws_build_dcp_from_cl.sh names the log <timestamp>.vivado.log
+    return os.path.basename(log).split(".")[0]
+
+
+def write_timeline(timeline, fname):
+    tmp = f"{fname}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(timeline, f, indent=2)
+    os.replace(tmp, fname)
+
+
+def analyse(log, out=None, follow=False, pid=None):
+    """
+    Timeline of one log, written to `out` as JSON if given (after every command when following, so that a running
+    build can be watched).
+    """
+    def save(timeline):
+        timeline['log'] = os.path.abspath(log)
+        timeline['build'] = build_name(log)
+        if out is not None:
+            write_timeline(timeline, out)
+
+    timeline = parse_log(read_lines(log, follow, pid), save if follow else None)
+    save(timeline)
+    return timeline
+
+
+def load_timeline(fname):
+    with open(fname) as f:
+        return json.load(f)
+
+
+def _hms(s):
+    return "-" if s is None else f"{s // 3600}:{s // 60 % 60:02d}:{s % 60:02d}"
+
+
+def format_timeline(timeline):
+    lines = [f"Build {timeline.get('build', '?')}: {timeline['start']} - {timeline['end']}"
+             f"{'' if timeline['complete'] else ' (incomplete)'}",
+             f"{'phase':<20} {'elapsed':>9} {'cpu':>9} {'cpu/wall':>8} {'threads':>7} {'peak MB':>9}"]
+    for name in phase_order:
+        p = timeline['phases'].get(name)
+        if p is None:
+            continue
+        ratio = p['cpu'] / p['elapsed'] if p['elapsed'] else 0
+        lines.append(f"{name:<20} {_hms(p['elapsed']):>9} {_hms(p['cpu']):>9} {ratio:8.1f} "
+                     f"{p['threads'] if p['threads'] is not None else '-':>7} {p['peak_mb']:9.0f}")
+    lines.append(f"{'total':<20} {_hms(timeline['elapsed']):>9} {_hms(timeline['cpu']):>9} "
+                 f"{timeline['cpu'] / max(timeline['elapsed'], 1):8.1f} {'':>7} {timeline['peak_mb']:9.0f}")
+    if timeline['commands']:
+        slowest = max(timeline['commands'], key=lambda c: c['elapsed'])
+        lines.append(f"Slowest command: {slowest['command']} ({_hms(slowest['elapsed'])}), "
+                     f"peak memory {timeline['peak_mb'] / 1024:.1f}GB")
+    return "\n".join(lines)
+
+
+def format_comparison(timelines):
+    # one row per phase, one column per build: elapsed time and peak memory
+    names = [t.get('build', '?') for t in timelines]
+    lines = [f"{'phase':<20} " + " ".join(f"{n[:19]:>19}" for n in names)]
+    for name in phase_order + ['total']:
+        cells = []
+        for t in timelines:
+            p = t if name == 'total' else t['phases'].get(name)
+            cells.append("-" if p is None else f"{_hms(p['elapsed'])} {p['peak_mb'] / 1024:5.1f}GB")
+        if any(c != "-" for c in cells):
+            lines.append(f"{name:<20} " + " ".join(f"{c:>19}" for c in cells))
+    return "\n".join(lines)
+
+
+def chart(timelines, fname):
+    """
+    Elapsed time per phase as stacked bars and peak memory per phase as markers, one row per build. Needs matplotlib.
+    """
+    if plt is None:
+        raise Exception("Charts need matplotlib (pip install matplotlib)")
+    names = [t.get('build', '?') for t in timelines]
+    fig, (ax_time, ax_mem) = plt.subplots(1, 2, figsize=(14, 1 + 0.6 * len(timelines)), sharey=True)
+    colors = plt.get_cmap("tab10")
+    for i, name in enumerate(phase_order):
+        left = [sum(t['phases'][p]['elapsed'] for p in phase_order[:i] if p in t['phases']) / 3600
+                for t in timelines]
+        width = [t['phases'][name]['elapsed'] / 3600 if name in t['phases'] else 0 for t in timelines]
+        if not any(width):
+            continue
+        ax_time.barh(names, width, left=left, color=colors(i), label=name)
+        mem = [(t['phases'][name]['peak_mb'] / 1024, n) for t, n in zip(timelines, names) if name in t['phases']]
+        ax_mem.scatter([m for m, _ in mem], [n for _, n in mem], color=colors(i), label=name)
+    ax_time.set_xlabel("elapsed (h)")
+    ax_time.legend(loc="lower right", fontsize="small")
+    ax_mem.set_xlabel("peak memory (GB)")
+    fig.tight_layout()
+    fig.savefig(fname)
+    plt.close(fig)